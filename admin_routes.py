@@ -1,8 +1,7 @@
 from flask import Blueprint, render_template, redirect, url_for, request, flash, session, current_app
 from models import db, User
 from functools import wraps
-import os
-from werkzeug.utils import secure_filename
+from archivos import guardar_subida
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
 
@@ -44,11 +43,7 @@ def nuevo_usuario():
         foto_filename = 'default.jpg'
 
         if foto_file and foto_file.filename != '':
-            filename = secure_filename(foto_file.filename)
-            upload_folder = current_app.config['UPLOAD_FOLDER']
-            foto_path = os.path.join(upload_folder, filename)
-            foto_file.save(foto_path)
-            foto_filename = filename
+            foto_filename = guardar_subida(foto_file, current_app.config['UPLOAD_FOLDER'])
 
         if User.query.filter_by(username=username).first():
             flash('El nombre de usuario ya existe.', 'error')
@@ -92,11 +87,7 @@ def editar_usuario(user_id):
         # Procesar foto nueva
         foto_file = request.files.get('foto')
         if foto_file and foto_file.filename != '':
-            filename = secure_filename(foto_file.filename)
-            upload_folder = current_app.config['UPLOAD_FOLDER']
-            foto_path = os.path.join(upload_folder, filename)
-            foto_file.save(foto_path)
-            usuario.foto = filename
+            usuario.foto = guardar_subida(foto_file, current_app.config['UPLOAD_FOLDER'])
 
         db.session.commit()
 
@@ -155,11 +146,7 @@ def perfil():
         # Manejo de foto actualizada
         foto_file = request.files.get('foto')
         if foto_file and foto_file.filename != '':
-            filename = secure_filename(foto_file.filename)
-            upload_folder = current_app.config['UPLOAD_FOLDER']
-            foto_path = os.path.join(upload_folder, filename)
-            foto_file.save(foto_path)
-            usuario.foto = filename
+            usuario.foto = guardar_subida(foto_file, current_app.config['UPLOAD_FOLDER'])
 
         db.session.commit()
 
@@ -1,9 +1,20 @@
 # almacenista_routes.py
 
-from flask import Blueprint, render_template, request, redirect, url_for, session, flash, current_app
-from datetime import datetime, timezone
-from models import db, Material, User, Movimiento, Notificacion
-from utils import fecha_y_hora_colombia, emitir_notificacion, obtener_alertas_almacenista
+from flask import Blueprint, render_template, request, redirect, url_for, session, flash, current_app, Response, send_file, stream_with_context
+from datetime import datetime, timedelta
+from models import (
+    db, Material, User, Movimiento, Notificacion, ResumenMensual, ETIQUETAS_REVISION,
+    REVISION_EN_FERRETERIA, REVISION_APROBADO_FERRETERIA, REVISION_RECHAZADO_FERRETERIA,
+    REVISION_SIN_USO, REVISION_RETORNADO_STOCK, ORIGEN_ALTA
+)
+from utils import fecha_y_hora_colombia, inicio_del_dia_utc, emitir_notificacion, emitir_notificaciones, obtener_alertas_almacenista_cacheado, paginar_movimientos, CARGA_MOVIMIENTOS, CARGA_MOVIMIENTOS_CON_MATERIAL
+from busqueda import buscar_materiales
+from catalogo import materiales_activos
+from stock import descontar_stock, reponer_stock, fijar_stock, sumar_en_devolucion, reclamar_movimientos
+from libro_stock import origen_stock, stock_en_fecha
+from resumenes import mes_de, rango_del_mes
+from pronostico import obtener_sugerencias_reposicion_cacheado, DIAS_REPOSICION
+from carga_masiva import reactivar_material, leer_filas, importar_materiales, EXPORTACIONES, generar_csv, escribir_xlsx
 from sqlalchemy import and_, not_, or_
 from sqlalchemy.exc import IntegrityError
 import os
@@ -39,8 +50,10 @@ def sync_user_session():
 @almacenista_required
 def dashboard():
     sync_user_session()
-    datos = obtener_alertas_almacenista()
-    return render_template('Almacenista/dashboard_almacenista.html', **datos)
+    datos = obtener_alertas_almacenista_cacheado()
+    return render_template('Almacenista/dashboard_almacenista.html', **datos,
+                            sugerencias_reposicion=obtener_sugerencias_reposicion_cacheado(),
+                            dias_reposicion=DIAS_REPOSICION)
 
 # -----------------------------
 # CREAR / LISTAR MATERIALES
@@ -66,43 +79,93 @@ def materiales():
             stock=float(stock),
             stock_minimo=int(stock_minimo)
         )
-        try:
-            db.session.add(nuevo)
-            db.session.commit()
-            flash(' Material creado exitosamente.', 'success')
-        except IntegrityError:
-            db.session.rollback()
-            existente = Material.query.filter_by(codigo=codigo, activo=False).first()
-            if existente:
-                existente.nombre = nombre
-                existente.descripcion = descripcion
-                existente.unidad = unidad
-                existente.stock = float(stock)
-                existente.stock_minimo = int(stock_minimo)
-                existente.activo = True
+        with origen_stock(ORIGEN_ALTA, session.get('user_id')):
+            try:
+                db.session.add(nuevo)
                 db.session.commit()
-                flash(f' Material creado exitosamente.', 'success')
-            else:
-                flash(f' Ya existe un material con el código {codigo}.', 'error')
+                flash(' Material creado exitosamente.', 'success')
+            except IntegrityError:
+                db.session.rollback()
+                existente = Material.query.filter_by(codigo=codigo, activo=False).first()
+                if existente:
+                    reactivar_material(existente, {
+                        'nombre': nombre,
+                        'descripcion': descripcion,
+                        'unidad': unidad,
+                        'stock': float(stock),
+                        'stock_minimo': int(stock_minimo)
+                    })
+                    db.session.commit()
+                    flash(f' Material creado exitosamente.', 'success')
+                else:
+                    flash(f' Ya existe un material con el código {codigo}.', 'error')
 
         return redirect(url_for('almacenista.materiales'))
 
     search_query = request.args.get('q')
     if search_query:
-        materiales = Material.query.filter(
-            ((Material.codigo.ilike(f'%{search_query}%')) |
-            (Material.nombre.ilike(f'%{search_query}%')) |
-            (Material.descripcion.ilike(f'%{search_query}%'))) &
-            (Material.activo == True)
-        ).all()
+        materiales = buscar_materiales(search_query).all()
     else:
-        materiales = Material.query.filter(Material.activo == True).all()
+        materiales = materiales_activos()
 
     return render_template('Almacenista/nuevo_material.html', materiales=materiales)
 
 # -----------------------------
 # EDITAR MATERIAL
 # -----------------------------
+# -----------------------------
+# IMPORTAR / EXPORTAR MATERIALES
+# -----------------------------
+ERRORES_MOSTRADOS = 10
+
+@almacenista_bp.route('/materiales/importar', methods=['POST'])
+@almacenista_required
+def importar_materiales_archivo():
+    archivo = request.files.get('archivo')
+    if not archivo or not archivo.filename:
+        flash('Selecciona un archivo CSV o XLSX.', 'error')
+        return redirect(url_for('almacenista.materiales'))
+    if not archivo.filename.lower().endswith(('.csv', '.xlsx')):
+        flash('Formato no soportado. Usa CSV o XLSX.', 'error')
+        return redirect(url_for('almacenista.materiales'))
+
+    try:
+        resultado = importar_materiales(leer_filas(archivo.stream, archivo.filename), usuario_id=session.get('user_id'))
+    except Exception as e:
+        db.session.rollback()
+        flash(f'No se pudo leer el archivo: {e}', 'error')
+        return redirect(url_for('almacenista.materiales'))
+
+    flash(f'Importación terminada: {resultado.creados} creados, {resultado.actualizados} actualizados, '
+          f'{resultado.reactivados} reactivados.', 'success')
+    if resultado.errores:
+        detalle = '; '.join(f'fila {fila}: {motivo}' for fila, motivo in resultado.errores[:ERRORES_MOSTRADOS])
+        restantes = len(resultado.errores) - ERRORES_MOSTRADOS
+        if restantes > 0:
+            detalle += f' (y {restantes} más)'
+        flash(f'{len(resultado.errores)} filas con errores: {detalle}', 'error')
+    return redirect(url_for('almacenista.materiales'))
+
+@almacenista_bp.route('/exportar/<tipo>.<formato>')
+@almacenista_required
+def exportar(tipo, formato):
+    if tipo not in EXPORTACIONES or formato not in ('csv', 'xlsx'):
+        flash('Exportación no disponible.', 'error')
+        return redirect(url_for('almacenista.dashboard'))
+
+    nombre = f"{tipo}_{datetime.now().strftime('%Y%m%d')}.{formato}"
+    if formato == 'xlsx':
+        return send_file(
+            escribir_xlsx(EXPORTACIONES[tipo]()),
+            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+            as_attachment=True,
+            download_name=nombre
+        )
+
+    respuesta = Response(stream_with_context(generar_csv(EXPORTACIONES[tipo]())), mimetype='text/csv; charset=utf-8')
+    respuesta.headers['Content-Disposition'] = f'attachment; filename={nombre}'
+    return respuesta
+
 @almacenista_bp.route('/materiales/editar/<int:id>', methods=['GET', 'POST'])
 @almacenista_required
 def editar_material(id):
@@ -113,8 +176,11 @@ def editar_material(id):
         material.codigo = request.form['codigo']
         material.nombre = request.form['nombre']
         material.descripcion = request.form['descripcion']
-        material.stock = float(request.form['stock'])
         material.stock_minimo = int(request.form['stock_minimo'])
+        if not fijar_stock(material.id, float(request.form['stock']), usuario_id=session.get('user_id')):
+            db.session.rollback()
+            flash(' El stock cambió mientras se guardaba. Intente de nuevo.', 'error')
+            return redirect(url_for('almacenista.editar_material', id=id))
         db.session.commit()
         flash(' Material actualizado exitosamente.', 'success')
         return redirect(url_for('almacenista.materiales'))
@@ -141,18 +207,7 @@ def eliminar_material(id):
 def actualizar_existencias():
     query = request.args.get('q', '').strip()
     
-    materiales_q = Material.query.filter(Material.activo == True)
-    if query:
-        materiales_q = materiales_q.filter(
-            db.or_(
-                Material.nombre.ilike(f"%{query}%"),
-                Material.codigo.ilike(f"%{query}%"),
-                Material.descripcion.ilike(f"%{query}%"),
-                Material.unidad.ilike(f"%{query}%")
-            )
-        )
-    
-    materiales = materiales_q.order_by(Material.nombre).all()
+    materiales = buscar_materiales(query).all() if query else materiales_activos()
 
     # Agrupar por unidad, con fallback si no tiene
     grupos = defaultdict(list)
@@ -185,9 +240,12 @@ def actualizar_existencia_individual(material_id):
     material = Material.query.get(material_id)
     if material and material.activo:  # ← validación para materiales activos
         try:
-            material.stock = float(nuevo_stock)
-            db.session.commit()
-            flash(f'Stock actualizado para {material.nombre}', 'success')
+            if fijar_stock(material.id, float(nuevo_stock), usuario_id=session.get('user_id')):
+                db.session.commit()
+                flash(f'Stock actualizado para {material.nombre}', 'success')
+            else:
+                db.session.rollback()
+                flash(f'El stock de {material.nombre} cambió mientras se guardaba. Intente de nuevo.', 'error')
         except ValueError:
             flash('Valor inválido para stock. Debe ser un número.', 'error')
     else:
@@ -202,21 +260,23 @@ def actualizar_existencia_individual(material_id):
 @almacenista_required
 def retiros_pendientes():
     sync_user_session()
-    solicitudes = (
+    consulta = (
         Movimiento.query
+        .options(*CARGA_MOVIMIENTOS_CON_MATERIAL)
         .join(Material)  # Join con el modelo Material
         .filter(
             Movimiento.tipo == 'SOLICITUD',
+            Movimiento.estado == 'PENDIENTE',
             Material.activo == True
         )
-        .order_by(Movimiento.fecha.desc())
-        .all()
     )
+    pagina = paginar_movimientos(consulta)
+    solicitudes = pagina.items
 
     for solicitud in solicitudes:
         solicitud.fecha_local = fecha_y_hora_colombia(solicitud.fecha)
 
-    return render_template('Almacenista/retiros_pendientes.html', solicitudes=solicitudes)
+    return render_template('Almacenista/retiros_pendientes.html', solicitudes=solicitudes, pagina=pagina)
 
 # -----------------------------
 # AUTORIZAR RETIRO
@@ -235,7 +295,15 @@ def autorizar_retiro(id):
     observacion = request.form.get('observacion_almacenista')
     almacenista = db.session.get(User, session.get("user_id"))
 
-    if material.stock < solicitud.cantidad:
+    # Reclamar la solicitud y descontar el stock son UPDATE condicionales: si
+    # otra petición se adelantó, no se aplica nada
+    if not reclamar_movimientos([solicitud.id], Movimiento.tipo == 'SOLICITUD', Movimiento.estado == 'PENDIENTE'):
+        db.session.rollback()
+        flash(' La solicitud ya fue procesada.', 'warning')
+        return redirect(url_for('almacenista.retiros_pendientes'))
+
+    if not descontar_stock(material.id, solicitud.cantidad, solicitud.id, almacenista.id):
+        db.session.rollback()
         flash(f' Stock insuficiente. Disponible: {material.stock}', 'error')
         return redirect(url_for('almacenista.retiros_pendientes'))
     
@@ -244,7 +312,6 @@ def autorizar_retiro(id):
     solicitud.tipo = 'SALIDA'
     solicitud.usuario_id = almacenista.id
     solicitud.observacion_almacenista = observacion
-    material.stock -= solicitud.cantidad
     
     ingeniero = solicitud.solicitado_por
     
@@ -273,7 +340,10 @@ def rechazar_retiro(id):
     observacion = request.form.get('observacion_almacenista')
     
     # Validaciones opcionales (por ejemplo, verificar que esté pendiente, etc.)
-    if solicitud.estado != 'PENDIENTE':
+    if solicitud.estado != 'PENDIENTE' or not reclamar_movimientos(
+        [solicitud.id], Movimiento.tipo == 'SOLICITUD', Movimiento.estado == 'PENDIENTE'
+    ):
+        db.session.rollback()
         flash(' La solicitud ya fue procesada.', 'warning')
         return redirect(url_for('almacenista.retiros_pendientes'))
 
@@ -292,42 +362,179 @@ def rechazar_retiro(id):
     flash(' Solicitud de retiro rechazada.', 'warning')
     return redirect(url_for('almacenista.retiros_pendientes'))
 
+# -----------------------------
+# AUTORIZAR / RECHAZAR RETIROS EN LOTE
+# -----------------------------
+# Todas las solicitudes seleccionadas se procesan en una transacción: se
+# bloquean las filas (FOR UPDATE en Postgres; en SQLite lo garantizan los
+# UPDATE condicionales del servicio de stock), se descuenta el stock de todo el
+# lote o de nada y se envía una sola notificación por ingeniero.
+DETALLES_POR_NOTIFICACION = 5
+
+def _resumen_para_ingeniero(singular, plural, detalles):
+    if len(detalles) == 1:
+        return f" {singular}: {detalles[0]}"
+    texto = ', '.join(detalles[:DETALLES_POR_NOTIFICACION])
+    if len(detalles) > DETALLES_POR_NOTIFICACION:
+        texto += f' y {len(detalles) - DETALLES_POR_NOTIFICACION} más'
+    return f" {len(detalles)} {plural}: {texto}"
+
+@almacenista_bp.route('/retiros/lote', methods=['POST'])
+@almacenista_required
+def procesar_retiros_lote():
+    sync_user_session()
+
+    decision = request.form.get('decision')
+    observacion = request.form.get('observacion_almacenista')
+    ids = sorted({int(i) for i in request.form.getlist('ids') if i.isdigit()})
+    if decision not in ('autorizar', 'rechazar') or not ids:
+        flash(' Selecciona al menos una solicitud y una acción.', 'error')
+        return redirect(url_for('almacenista.retiros_pendientes'))
+
+    # Orden fijo (movimientos y luego materiales, por id) para no cruzar bloqueos
+    solicitudes = Movimiento.query.filter(
+        Movimiento.id.in_(ids),
+        Movimiento.tipo == 'SOLICITUD',
+        Movimiento.estado == 'PENDIENTE'
+    ).order_by(Movimiento.id).with_for_update().populate_existing().all()
+    if not solicitudes:
+        db.session.rollback()
+        flash(' Las solicitudes seleccionadas ya fueron procesadas.', 'warning')
+        return redirect(url_for('almacenista.retiros_pendientes'))
+
+    materiales = {m.id: m for m in Material.query.filter(
+        Material.id.in_({s.material_id for s in solicitudes})
+    ).order_by(Material.id).with_for_update().populate_existing()}
+
+    if reclamar_movimientos(
+        [s.id for s in solicitudes], Movimiento.tipo == 'SOLICITUD', Movimiento.estado == 'PENDIENTE'
+    ) != len(solicitudes):
+        db.session.rollback()
+        flash(' Algunas solicitudes cambiaron mientras se procesaban. Intenta de nuevo.', 'warning')
+        return redirect(url_for('almacenista.retiros_pendientes'))
+
+    almacenista = db.session.get(User, session.get("user_id"))
+    if decision == 'autorizar':
+        requerido = defaultdict(float)
+        for solicitud in solicitudes:
+            requerido[solicitud.material_id] += solicitud.cantidad
+        disponible = {m.id: m.stock for m in materiales.values()}
+
+        # Un descuento (y un asiento) por solicitud; si alguno no alcanza se deshace todo
+        faltantes = {}
+        for solicitud in sorted(solicitudes, key=lambda s: (s.material_id, s.id)):
+            material_id = solicitud.material_id
+            material = materiales.get(material_id)
+            if material_id in faltantes:
+                continue
+            if not material or not material.activo:
+                faltantes[material_id] = f'material {material_id} no disponible'
+            elif not descontar_stock(material_id, solicitud.cantidad, solicitud.id, almacenista.id):
+                faltantes[material_id] = f'{material.nombre} (requiere {requerido[material_id]}, disponible {disponible[material_id]})'
+        if faltantes:
+            db.session.rollback()
+            flash(f" Stock insuficiente, no se procesó ninguna solicitud: {'; '.join(faltantes.values())}", 'error')
+            return redirect(url_for('almacenista.retiros_pendientes'))
+
+    detalles_por_ingeniero = defaultdict(list)
+    for solicitud in solicitudes:
+        material = materiales[solicitud.material_id]
+        solicitud.estado = 'AUTORIZADO' if decision == 'autorizar' else 'RECHAZADO'
+        solicitud.tipo = 'SALIDA'
+        solicitud.usuario_id = almacenista.id
+        solicitud.observacion_almacenista = observacion
+        detalles_por_ingeniero[solicitud.solicitado_por_id].append(
+            f"{material.nombre} ({solicitud.cantidad} {material.unidad})"
+        )
+    db.session.commit()
+
+    if decision == 'autorizar':
+        titulos = (f"Retiro autorizado por {almacenista.nombre}", f"retiros autorizados por {almacenista.nombre}")
+    else:
+        titulos = ("Solicitud de retiro rechazada", "solicitudes de retiro rechazadas")
+    emitir_notificaciones('ingeniero', {
+        ingeniero_id: _resumen_para_ingeniero(*titulos, detalles)
+        for ingeniero_id, detalles in detalles_por_ingeniero.items()
+    })
+
+    omitidas = len(ids) - len(solicitudes)
+    accion = 'autorizadas' if decision == 'autorizar' else 'rechazadas'
+    flash(f' {len(solicitudes)} solicitudes {accion}.', 'success' if decision == 'autorizar' else 'warning')
+    if omitidas:
+        flash(f' {omitidas} solicitudes ya habían sido procesadas y se omitieron.', 'warning')
+    return redirect(url_for('almacenista.retiros_pendientes'))
+
 # -----------------------------
 # REPORTES MENSUALES
 # -----------------------------
-from sqlalchemy.orm import joinedload
+MATERIALES_MAS_RETIRADOS = 5
 
 @almacenista_bp.route('/reportes')
 @almacenista_required
 def reportes():
     sync_user_session()
 
-    ahora = datetime.now(timezone.utc)
-    mes_actual = ahora.month
-    año_actual = ahora.year
+    # Mes del reporte (?mes=AAAA-MM, calendario de Colombia); por defecto el actual
+    año_actual, mes_actual = mes_de(datetime.utcnow())
+    mes_pedido = request.args.get('mes')
+    if mes_pedido:
+        try:
+            pedido = datetime.strptime(mes_pedido, '%Y-%m')
+        except ValueError:
+            flash('Mes inválido.', 'error')
+        else:
+            año_actual, mes_actual = pedido.year, pedido.month
+    inicio, fin = rango_del_mes(año_actual, mes_actual)
 
-    movimientos_aprobados = Movimiento.query.join(Material).filter(
-        Movimiento.tipo == 'SALIDA',
-        Movimiento.estado == 'AUTORIZADO',
-        db.extract('month', Movimiento.fecha) == mes_actual,
-        db.extract('year', Movimiento.fecha) == año_actual,
+    # Rango de fechas (usa el índice de Movimiento.fecha) en vez de extraer mes y año
+    del_mes = Movimiento.query.join(Material).filter(
+        Movimiento.fecha >= inicio,
+        Movimiento.fecha < fin,
         Material.activo == True
-    ).options(joinedload(Movimiento.material)).all()
+    ).options(*CARGA_MOVIMIENTOS_CON_MATERIAL)
 
-    movimientos_rechazados = Movimiento.query.join(Material).filter(
+    movimientos_aprobados = del_mes.filter(
         Movimiento.tipo == 'SALIDA',
-        Movimiento.estado == 'RECHAZADO',
-        db.extract('month', Movimiento.fecha) == mes_actual,
-        db.extract('year', Movimiento.fecha) == año_actual,
-        Material.activo == True
-    ).options(joinedload(Movimiento.material)).all()
+        Movimiento.estado == 'AUTORIZADO'
+    ).all()
 
-    devoluciones = Movimiento.query.join(Material).filter(
-        Movimiento.tipo == 'DEVOLUCION',
-        db.extract('month', Movimiento.fecha) == mes_actual,
-        db.extract('year', Movimiento.fecha) == año_actual,
+    movimientos_rechazados = del_mes.filter(
+        Movimiento.tipo == 'SALIDA',
+        Movimiento.estado == 'RECHAZADO'
+    ).all()
+
+    devoluciones = del_mes.filter(
+        Movimiento.tipo == 'DEVOLUCION'
+    ).order_by(Movimiento.fecha.desc()).all()
+
+    # Totales del mes desde el resumen mensual, sin recorrer los movimientos
+    resumen = db.session.query(
+        ResumenMensual.material_id, ResumenMensual.tipo, ResumenMensual.estado,
+        ResumenMensual.movimientos, ResumenMensual.cantidad
+    ).join(Material).filter(
+        ResumenMensual.anio == año_actual,
+        ResumenMensual.mes == mes_actual,
         Material.activo == True
-    ).options(joinedload(Movimiento.material)).order_by(Movimiento.fecha.desc()).all()
+    ).all()
+    totales = defaultdict(int)
+    retirado_por_material = defaultdict(float)
+    for material_id, tipo, estado, movimientos, cantidad in resumen:
+        totales[(tipo, estado)] += movimientos
+        if tipo == 'SALIDA' and estado == 'AUTORIZADO':
+            retirado_por_material[material_id] += cantidad
+    totales = {
+        'aprobados': totales[('SALIDA', 'AUTORIZADO')],
+        'rechazados': totales[('SALIDA', 'RECHAZADO')],
+        'devoluciones': sum(n for (tipo, _), n in totales.items() if tipo == 'DEVOLUCION'),
+    }
+    mas_retirados = sorted(retirado_por_material.items(), key=lambda par: par[1], reverse=True)[:MATERIALES_MAS_RETIRADOS]
+    nombres = {m.id: m for m in Material.query.filter(Material.id.in_([i for i, _ in mas_retirados]))} if mas_retirados else {}
+    mas_retirados = [(nombres[i], cantidad) for i, cantidad in mas_retirados]
+
+    # Meses con movimientos para el selector
+    meses_disponibles = db.session.query(ResumenMensual.anio, ResumenMensual.mes).distinct().order_by(
+        ResumenMensual.anio.desc(), ResumenMensual.mes.desc()
+    ).all()
 
     ids_de_devoluciones = {d.id for d in devoluciones}
     movimientos_rechazados = [r for r in movimientos_rechazados if r.id not in ids_de_devoluciones]
@@ -338,6 +545,9 @@ def reportes():
     return render_template('Almacenista/reportes_mensuales.html',
                             mes=mes_actual,
                             anio=año_actual,
+                            meses_disponibles=meses_disponibles,
+                            totales=totales,
+                            mas_retirados=mas_retirados,
                             aprobados=movimientos_aprobados,
                             rechazados=movimientos_rechazados,
                             devoluciones=devoluciones)
@@ -358,6 +568,13 @@ def aprobar_o_rechazar_devolucion(id):
     observacion = request.form.get('observacion_almacenista', '').strip()
     almacenista = db.session.get(User, session.get("user_id"))
 
+    if decision in ('aceptar', 'rechazar') and not reclamar_movimientos(
+        [devolucion.id], Movimiento.tipo == 'DEVOLUCION', Movimiento.estado == 'PENDIENTE'
+    ):
+        db.session.rollback()
+        flash('Movimiento inválido o ya procesado.', 'error')
+        return redirect(url_for('almacenista.revisar_devoluciones'))
+
     # Asignación común
     devolucion.usuario_id = almacenista.id
     devolucion.observacion_almacenista = observacion
@@ -365,13 +582,14 @@ def aprobar_o_rechazar_devolucion(id):
 
     if decision == 'aceptar':
         material = devolucion.material
-        material.en_devolucion = (material.en_devolucion or 0) + devolucion.cantidad
+        sumar_en_devolucion(material.id, devolucion.cantidad)
         devolucion.estado = 'AUTORIZADO'
         mensaje = f" Devolución autorizada: {material.nombre} ({devolucion.cantidad} {material.unidad}). En proceso de validación."
         flash(' Devolución aprobada.', 'success')
 
     elif decision == 'rechazar':
         if not observacion:
+            db.session.rollback()
             flash('Debe ingresar una observación al rechazar una devolución.', 'error')
             return redirect(url_for('almacenista.revisar_devoluciones'))
 
@@ -399,7 +617,7 @@ def aprobar_o_rechazar_devolucion(id):
 @almacenista_required
 def revisar_devoluciones():
     sync_user_session()
-    devoluciones = Movimiento.query.filter_by(tipo='DEVOLUCION', estado='PENDIENTE') \
+    devoluciones = Movimiento.query.options(*CARGA_MOVIMIENTOS).filter_by(tipo='DEVOLUCION', estado='PENDIENTE') \
         .filter(Movimiento.material.has(activo=True)) \
         .order_by(Movimiento.fecha.desc()).all()
     for d in devoluciones:
@@ -411,6 +629,7 @@ def revisar_devoluciones():
 # -----------------------------
 # Función auxiliar para actualizar estado dentro de la observación
 def actualizar_estado_en_observacion(observacion_actual, nuevo_estado):
+    observacion_actual = observacion_actual or ''
     if 'estado:' in observacion_actual:
         partes = observacion_actual.split('| estado:')
         base = partes[0].strip()
@@ -418,48 +637,66 @@ def actualizar_estado_en_observacion(observacion_actual, nuevo_estado):
         base = observacion_actual.strip()
     return f"{base} | estado: {nuevo_estado}"
 
+# Cambia el estado de revisión (columna indexada) y deja el texto en la observación
+def cambiar_estado_revision(movimiento, estado_revision):
+    movimiento.estado_revision = estado_revision
+    movimiento.observacion_almacenista = actualizar_estado_en_observacion(
+        movimiento.observacion_almacenista, ETIQUETAS_REVISION[estado_revision]
+    )
+
 @almacenista_bp.route('/existencias')
 @almacenista_required
 def existencias():
     sync_user_session()
 
-    # Materiales en stock general
-    materiales = Material.query.filter_by(activo=True).all()
+    # Materiales en stock general (o el stock que tenían al final de un día pasado)
+    materiales = materiales_activos()
+    fecha_stock = request.args.get('fecha')
+    if fecha_stock:
+        try:
+            dia = datetime.strptime(fecha_stock, '%Y-%m-%d').date()
+        except ValueError:
+            flash('Fecha inválida.', 'error')
+            fecha_stock = None
+        else:
+            historico = stock_en_fecha(inicio_del_dia_utc(dia + timedelta(days=1)))
+            materiales = [m._replace(stock=historico.get(m.id, 0)) for m in materiales]
 
-    # Materiales devueltos visibles en existencias y que no están marcados como "en revisión en ferretería"
-    materiales_en_devolucion = Movimiento.query.filter(
+    # Materiales devueltos visibles en existencias y que aún no han sido revisados
+    pagina_devolucion = paginar_movimientos(Movimiento.query.options(*CARGA_MOVIMIENTOS).filter(
         Movimiento.tipo == 'DEVOLUCION',
         Movimiento.estado == 'AUTORIZADO',
         Movimiento.visible_en_existencias == True,
-        not_(Movimiento.observacion_almacenista.ilike('%estado: En revisión en ferretería%'))
-    ).order_by(Movimiento.fecha.desc()).all()
+        Movimiento.estado_revision.is_(None)
+    ), 'cursor_devolucion')
+    materiales_en_devolucion = pagina_devolucion.items
 
     # Materiales enviados a ferretería
-    enviados_ferreteria = Movimiento.query.filter(
+    pagina_ferreteria = paginar_movimientos(Movimiento.query.options(*CARGA_MOVIMIENTOS).filter(
         Movimiento.tipo == 'DEVOLUCION',
         Movimiento.estado == 'AUTORIZADO',
         Movimiento.visible_en_existencias == False,
-        Movimiento.observacion_almacenista.ilike('%estado: En revisión en ferretería%')
-    ).order_by(Movimiento.fecha.desc()).all()
+        Movimiento.estado_revision == REVISION_EN_FERRETERIA
+    ), 'cursor_ferreteria')
+    enviados_ferreteria = pagina_ferreteria.items
 
     # Materiales rechazados por ferretería o descartados por el almacenista
-    rechazados = Movimiento.query.filter(
+    pagina_rechazados = paginar_movimientos(Movimiento.query.options(*CARGA_MOVIMIENTOS).filter(
         Movimiento.tipo == 'DEVOLUCION',
         Movimiento.estado == 'AUTORIZADO',
         Movimiento.visible_en_existencias == False,
-        or_(
-            Movimiento.observacion_almacenista.ilike('%estado: rechazado por ferretería%'),
-            Movimiento.observacion_almacenista.ilike('%estado: movido a materiales sin uso%')
-        )
-    ).order_by(Movimiento.fecha.desc()).all()
+        Movimiento.estado_revision.in_([REVISION_RECHAZADO_FERRETERIA, REVISION_SIN_USO])
+    ), 'cursor_rechazados')
+    rechazados = pagina_rechazados.items
 
     # Materiales aprobados por ferretería
-    materiales_aprobados_ferreteria = Movimiento.query.filter(
+    pagina_aprobados = paginar_movimientos(Movimiento.query.options(*CARGA_MOVIMIENTOS).filter(
         Movimiento.tipo == 'DEVOLUCION',
         Movimiento.estado == 'AUTORIZADO',
         Movimiento.visible_en_existencias == False,
-        Movimiento.observacion_almacenista.ilike('%estado: aprobado por ferretería%')
-    ).order_by(Movimiento.fecha.desc()).all()
+        Movimiento.estado_revision == REVISION_APROBADO_FERRETERIA
+    ), 'cursor_aprobados')
+    materiales_aprobados_ferreteria = pagina_aprobados.items
 
     # Convertir fechas a zona horaria Colombia
     for lista in [materiales_en_devolucion, enviados_ferreteria, rechazados, materiales_aprobados_ferreteria]:
@@ -468,19 +705,24 @@ def existencias():
 
     # Agregar detalle de estado a los rechazados
     for mov in rechazados:
-        if 'rechazado por ferretería' in mov.observacion_almacenista.lower():
+        if mov.estado_revision == REVISION_RECHAZADO_FERRETERIA:
             mov.detalle_estado = 'Rechazado por ferretería'
-        elif 'movido a materiales sin uso' in mov.observacion_almacenista.lower():
+        elif mov.estado_revision == REVISION_SIN_USO:
             mov.detalle_estado = 'Material almacenado en descartados'
         else:
             mov.detalle_estado = 'Revisión finalizada'
 
     return render_template('Almacenista/existencias.html',
                             materiales=materiales,
+                            fecha_stock=fecha_stock,
                             materiales_en_devolucion=materiales_en_devolucion,
                             enviados_ferreteria=enviados_ferreteria,
                             rechazados=rechazados,
-                            materiales_aprobados_ferreteria=materiales_aprobados_ferreteria)
+                            materiales_aprobados_ferreteria=materiales_aprobados_ferreteria,
+                            pagina_devolucion=pagina_devolucion,
+                            pagina_ferreteria=pagina_ferreteria,
+                            pagina_rechazados=pagina_rechazados,
+                            pagina_aprobados=pagina_aprobados)
 
 # -----------------------------
 # Retornar material al stock
@@ -491,12 +733,17 @@ def retornar_a_stock(movimiento_id):
     movimiento = Movimiento.query.get_or_404(movimiento_id)
     material = Material.query.get(movimiento.material_id)
 
-    material.stock += movimiento.cantidad
+    if not reclamar_movimientos(
+        [movimiento.id], Movimiento.visible_en_existencias == True, Movimiento.estado_revision.is_(None)
+    ):
+        db.session.rollback()
+        flash("La devolución ya fue revisada.", "warning")
+        return redirect(url_for('almacenista.existencias'))
+
+    reponer_stock(material.id, movimiento.cantidad, movimiento.id, session.get('user_id'))
     movimiento.visible_en_existencias = False
     movimiento.activo = False  # ← Marcamos el movimiento como inactivo
-    movimiento.observacion_almacenista = actualizar_estado_en_observacion(
-        movimiento.observacion_almacenista, "Retornado a stock"
-    )
+    cambiar_estado_revision(movimiento, REVISION_RETORNADO_STOCK)
 
     db.session.commit()
 
@@ -519,9 +766,7 @@ def enviar_a_ferreteria(movimiento_id):
 
     movimiento.visible_en_existencias = False  # Ya no aparece en la tabla de “en devolución”
     movimiento.activo = True  # Sigue activo para futuras acciones
-    movimiento.observacion_almacenista = actualizar_estado_en_observacion(
-        movimiento.observacion_almacenista, "En revisión en ferretería"
-    )
+    cambiar_estado_revision(movimiento, REVISION_EN_FERRETERIA)
 
     mensaje = f" Devolución de {material.nombre} ({movimiento.cantidad} {material.unidad}) enviada a revisión por ferretería."
     usuario_id = movimiento.solicitado_por_id
@@ -541,14 +786,17 @@ def aprobar_ferreteria(movimiento_id):
     movimiento = Movimiento.query.get_or_404(movimiento_id)
     material = Material.query.get(movimiento.material_id)
 
-    movimiento.observacion_almacenista = actualizar_estado_en_observacion(
-        movimiento.observacion_almacenista, "Aprobado por ferretería"
-    )
+    if not reclamar_movimientos([movimiento.id], Movimiento.estado_revision == REVISION_EN_FERRETERIA):
+        db.session.rollback()
+        flash("La devolución ya fue revisada por ferretería.", "warning")
+        return redirect(url_for('almacenista.existencias'))
+
+    cambiar_estado_revision(movimiento, REVISION_APROBADO_FERRETERIA)
     movimiento.visible_en_existencias = False
     movimiento.activo = False  # Se da por cerrado
 
     if material:
-        material.stock += movimiento.cantidad
+        reponer_stock(material.id, movimiento.cantidad, movimiento.id, session.get('user_id'))
 
     mensaje = (
         f" Ferretería ha estudiado la devolución de {material.nombre} "
@@ -572,9 +820,7 @@ def rechazar_ferreteria(movimiento_id):
     movimiento = Movimiento.query.get_or_404(movimiento_id)
     material = Material.query.get(movimiento.material_id)
 
-    movimiento.observacion_almacenista = actualizar_estado_en_observacion(
-        movimiento.observacion_almacenista, "Rechazado por ferretería"
-    )
+    cambiar_estado_revision(movimiento, REVISION_RECHAZADO_FERRETERIA)
     movimiento.visible_en_existencias = False
     movimiento.activo = False  # Finaliza el ciclo
 
@@ -602,9 +848,7 @@ def descartar_devolucion(movimiento_id):
 
     movimiento.visible_en_existencias = False
     movimiento.activo = False  # ← IMPORTANTE: lo descartamos completamente
-    movimiento.observacion_almacenista = actualizar_estado_en_observacion(
-        movimiento.observacion_almacenista, "Movido a materiales sin uso"
-    )
+    cambiar_estado_revision(movimiento, REVISION_SIN_USO)
 
     # Notificación al ingeniero
     mensaje = f" La devolución de {material.nombre} ({movimiento.cantidad} {material.unidad}) ha sido revisada. El material ha sido marcado como no utilizable y no estará disponible en el stock."
@@ -631,20 +875,5 @@ def vaciar_notificaciones():
 #--------------------------
 @almacenista_bp.route('/fragmento-panel-alertas')
 def fragmento_panel_alertas():
-    datos = obtener_alertas_almacenista()
+    datos = obtener_alertas_almacenista_cacheado()
     return render_template('Almacenista/componentes/_fragmento_panel_alertas.html', **datos)
-
-
-
-@almacenista_bp.route('/eliminar-evidencias-temporal')
-def eliminar_evidencias_temporal():
-    carpeta = os.path.join('static', 'evidencias')
-    if os.path.exists(carpeta):
-        for archivo in os.listdir(carpeta):
-            ruta_archivo = os.path.join(carpeta, archivo)
-            try:
-                os.remove(ruta_archivo)
-            except Exception as e:
-                print(f"Error eliminando {archivo}: {e}")
-    flash('Evidencias eliminadas correctamente.', 'success')
-    return redirect(url_for('almacenista.dashboard'))
\ No newline at end of file
@@ -1,46 +1,97 @@
 import eventlet
 eventlet.monkey_patch()
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
-from flask_socketio import SocketIO, emit
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, g
+from flask_socketio import SocketIO, emit, join_room
 from dotenv import load_dotenv
 import os
 from flask_migrate import Migrate
-from utils import fecha_y_hora_colombia, formatear_numero,configurar_socketio, obtener_materiales_bajo_stock, obtener_alertas_almacenista
+from utils import fecha_y_hora_colombia, formatear_numero,configurar_socketio, opciones_cola_socketio, obtener_materiales_bajo_stock_cacheado, obtener_alertas_almacenista_cacheado, memo_por_request, contar_consultas, invalidar_cache_global, sala_usuario, sala_rol, obtener_alertas_almacenista, obtener_alertas_almacenista_por_separado
 from werkzeug.exceptions import RequestEntityTooLarge
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy import text, insert, func
+import subprocess
+import random
+import json
+import sys
+import time
+import click
+from collections import Counter
 
 # -----------------------------
 # IMPORTAR MODELOS Y db
 # -----------------------------
-from models import db, User, Material, Movimiento, Notificacion
+from models import db, User, Material, Movimiento, Notificacion, SaldoIngeniero, AsientoStock, CorteStock, ResumenMensual, PronosticoMaterial, TareaProgramada, EjecucionTarea, REVISION_EN_FERRETERIA, REVISION_RETORNADO_STOCK, REVISION_APROBADO_FERRETERIA, ORIGEN_INICIAL
+from libro_stock import registrar_asiento, tomar_corte_stock, stock_en_fecha, verificar_libro_stock
+from inventario import reconstruir_saldos, verificar_saldos
+from resumenes import reconstruir_resumenes, verificar_resumenes
+from pronostico import calcular_pronosticos, obtener_sugerencias_reposicion
+from archivos import evidencia_url, foto_url, registrar_archivos
+from busqueda import buscar_materiales, crear_indice_busqueda, RESULTADOS_AUTOCOMPLETAR, RESULTADOS_AUTOCOMPLETAR_MAXIMO
+from estaticos import registrar_estaticos, compilar_estaticos, comprimir_estaticos
+from carga_masiva import leer_filas, importar_materiales, EXPORTACIONES, generar_csv, escribir_xlsx, TAMANO_LOTE
+from notificaciones import contar_no_leidas, ultimas_notificaciones, marcar_leidas, NOTIFICACIONES_MAXIMO
+from tareas import TAREAS, registrar_tareas, reclamar_tarea, ejecutar_tarea, ESTADO_OK
 
 # -----------------------------
 # CONFIGURACIÓN DE LA APP
 # -----------------------------
+load_dotenv()
 app = Flask(__name__)
+# Todos los workers deben compartir la misma SECRET_KEY para leer la cookie de sesión
 app.secret_key = os.environ.get('SECRET_KEY', 'fallback_key')
 
-# SocketIO: inicializar con soporte para eventlet (o gevent si usas gunicorn)
-socketio = SocketIO(app, cors_allowed_origins="*")
+# SocketIO: inicializar con soporte para eventlet (o gevent si usas gunicorn).
+# Con más de un worker, SOCKETIO_MESSAGE_QUEUE (p. ej. redis://...) reparte los
+# eventos emitidos a los clientes conectados en cualquier worker.
+socketio = SocketIO(
+    app,
+    cors_allowed_origins="*",
+    **opciones_cola_socketio(os.environ.get('SOCKETIO_MESSAGE_QUEUE'))
+)
 configurar_socketio(socketio)
 # -----------------------------
 # REGISTRAR FILTROS JINJA
 # -----------------------------
 app.jinja_env.filters['fecha_y_hora_colombia'] = fecha_y_hora_colombia
 app.jinja_env.filters['formatear_numero'] = formatear_numero
+app.jinja_env.globals['evidencia_url'] = evidencia_url
+app.jinja_env.globals['foto_url'] = foto_url
 
 basedir = os.path.abspath(os.path.dirname(__file__))
 
 # Configuración de base de datos
-load_dotenv()
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
-# Carpeta para uploads
-UPLOAD_FOLDER = os.path.join(basedir, 'static', 'uploads')
+# Carpetas para uploads y evidencias (con varios servidores deben apuntar a un volumen compartido)
+UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER', os.path.join(basedir, 'static', 'uploads'))
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+
+EVIDENCIAS_FOLDER = os.environ.get('EVIDENCIAS_FOLDER', os.path.join(basedir, 'static', 'evidencias'))
+os.makedirs(EVIDENCIAS_FOLDER, exist_ok=True)
+app.config['EVIDENCIAS_FOLDER'] = EVIDENCIAS_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 25 * 1024 * 1024  # 25 MB
+registrar_archivos(app)
+
+# Reportes PDF generados en segundo plano (caché en disco compartida entre workers)
+REPORTES_FOLDER = os.environ.get('REPORTES_FOLDER', os.path.join(basedir, 'reportes_generados'))
+os.makedirs(REPORTES_FOLDER, exist_ok=True)
+app.config['REPORTES_FOLDER'] = REPORTES_FOLDER
+app.config['PDF_PROCESOS'] = int(os.environ.get('PDF_PROCESOS', 2))
+
+# Retención que aplican las tareas periódicas (python -m tareas)
+app.config['RETENCION_EVIDENCIAS_DIAS'] = int(os.environ.get('RETENCION_EVIDENCIAS_DIAS', 365))
+app.config['ARCHIVO_NOTIFICACIONES_DIAS'] = int(os.environ.get('ARCHIVO_NOTIFICACIONES_DIAS', 30))
+app.config['RETENCION_NOTIFICACIONES_DIAS'] = int(os.environ.get('RETENCION_NOTIFICACIONES_DIAS', 365))
+
+# Notificaciones que se cargan en la campana de cada página
+app.config['NOTIFICACIONES_MAXIMO'] = int(os.environ.get('NOTIFICACIONES_MAXIMO', NOTIFICACIONES_MAXIMO))
+
+# Estáticos con huella en el nombre, servidos desde /assets con caché inmutable
+ESTATICOS_COMPILADOS = os.environ.get('ESTATICOS_COMPILADOS', os.path.join(basedir, 'static_compilado'))
+app.config['ESTATICOS_COMPILADOS'] = ESTATICOS_COMPILADOS
+registrar_estaticos(app, ESTATICOS_COMPILADOS)
 
 # -----------------------------
 # INICIALIZAR DB Y MIGRACIONES
@@ -63,8 +114,17 @@ app.register_blueprint(main_bp)
 # -----------------------------
 # CONTEXT PROCESSOR
 # -----------------------------
+@app.before_request
+def limpiar_memo_request():
+    # g puede sobrevivir entre requests si ya había un app context activo (CLI, tests)
+    g.pop('_memo_request', None)
+
 @app.context_processor
 def inject_user_data():
+    # Se calcula una sola vez por request aunque se rendericen varios templates
+    return memo_por_request('contexto_usuario', construir_contexto_usuario)
+
+def construir_contexto_usuario():
     contexto = {
         'user': session.get('user'),
         'user_name': session.get('user_name'),
@@ -78,24 +138,33 @@ def inject_user_data():
         usuario = User.query.filter_by(username=session['user']).first()
         if usuario:
             contexto['usuario_actual'] = usuario
-            contexto['notificaciones_no_leidas'] = Notificacion.query.filter_by(
-                usuario_id=usuario.id, leida=False
-            ).order_by(Notificacion.fecha.desc()).all()
-            contexto['notificaciones'] = Notificacion.query.filter_by(
-                usuario_id=usuario.id
-            ).order_by(Notificacion.fecha.desc()).limit(10).all()
+            # Bandeja acotada: COUNT de no leídas y solo las últimas NOTIFICACIONES_MAXIMO
+            contexto['total_no_leidas'] = contar_no_leidas(usuario.id)
+            contexto['notificaciones'] = ultimas_notificaciones(usuario.id, app.config['NOTIFICACIONES_MAXIMO'])
 
-            # Agrega los materiales con bajo stock
-            contexto['materiales_bajo_stock'] = obtener_materiales_bajo_stock()
+            # Agrega los materiales con bajo stock (caché compartida)
+            contexto['materiales_bajo_stock'] = obtener_materiales_bajo_stock_cacheado()
 
             # Solo si es almacenista
             if usuario.rol == 'ALMACENISTA':
-                contexto.update(obtener_alertas_almacenista())
+                contexto.update(obtener_alertas_almacenista_cacheado())
 
     return contexto
 
 # -----------------------------
-# SOCKETIO - Emitir notificación (global)
+# SOCKETIO - Salas por usuario y por rol
+# -----------------------------
+@socketio.on('connect')
+def al_conectar_socket():
+    # La sesión de Flask identifica al usuario: sin sesión no recibe eventos
+    if 'user_id' not in session:
+        return False
+    join_room(sala_usuario(session['user_id']))
+    if session.get('user_role'):
+        join_room(sala_rol(session['user_role']))
+
+# -----------------------------
+# SOCKETIO - Emitir notificación a un usuario
 # -----------------------------
 @app.route('/emitir-notificacion', methods=['POST'])
 def emitir_notificacion():
@@ -114,7 +183,7 @@ def emitir_notificacion():
         'mensaje': mensaje,
         'fecha': noti.fecha.strftime("%d/%m/%Y %I:%M %p"),
         'usuario_id': int(usuario_id)
-    }, broadcast=True)
+    }, to=sala_usuario(usuario_id))
 
     return jsonify({'success': True})
 
@@ -127,9 +196,7 @@ def marcar_notificaciones_leidas():
     if not user_id:
         return jsonify({'error': 'No autorizado'}), 401
 
-    notificaciones = Notificacion.query.filter_by(usuario_id=user_id, leida=False).all()
-    for n in notificaciones:
-        n.leida = True
+    marcar_leidas(user_id)
     db.session.commit()
 
     return jsonify({'success': True})
@@ -143,9 +210,7 @@ def notificaciones_recientes():
     if not user_id:
         return jsonify([])
 
-    notificaciones = Notificacion.query.filter_by(
-        usuario_id=user_id, leida=False
-    ).order_by(Notificacion.fecha.desc()).limit(10).all()
+    notificaciones = ultimas_notificaciones(user_id, app.config['NOTIFICACIONES_MAXIMO'], solo_no_leidas=True)
 
     return jsonify([
         {
@@ -154,6 +219,30 @@ def notificaciones_recientes():
         } for n in notificaciones
     ])
 
+# -----------------------------
+# AUTOCOMPLETAR MATERIALES (AJAX)
+# -----------------------------
+@app.route('/materiales/buscar')
+def autocompletar_materiales():
+    if not session.get('user_id'):
+        return jsonify({'error': 'No autorizado'}), 401
+
+    try:
+        limite = min(int(request.args.get('k', RESULTADOS_AUTOCOMPLETAR)), RESULTADOS_AUTOCOMPLETAR_MAXIMO)
+    except ValueError:
+        limite = RESULTADOS_AUTOCOMPLETAR
+
+    materiales = buscar_materiales(request.args.get('q', '')).limit(max(limite, 1)).all()
+    return jsonify([
+        {
+            'id': m.id,
+            'codigo': m.codigo,
+            'nombre': m.nombre,
+            'unidad': m.unidad,
+            'stock': m.stock
+        } for m in materiales
+    ])
+
 # -----------------------------
 # MANEJAR ERRORES DE ARCHIVO
 # -----------------------------
@@ -171,6 +260,410 @@ def create_db():
         db.create_all()
     print('✅ Base de datos creada correctamente.')
 
+# Consultas calientes -> índices que deben aparecer en su plan de ejecución
+CONSULTAS_CON_INDICE = [
+    ('Solicitudes de retiro pendientes',
+     lambda: Movimiento.query.filter_by(tipo='SOLICITUD', estado='PENDIENTE').order_by(Movimiento.fecha.desc()),
+     ['ix_movimiento_tipo_estado_fecha']),
+    ('Historial del ingeniero',
+     lambda: Movimiento.query.filter_by(solicitado_por_id=1).order_by(Movimiento.fecha.desc()),
+     ['ix_movimiento_solicitante_fecha']),
+    ('Saldo del ingeniero por material',
+     lambda: Movimiento.query.filter_by(solicitado_por_id=1, tipo='SALIDA', estado='AUTORIZADO', material_id=1),
+     ['ix_movimiento_solicitante_tipo_estado_material']),
+    ('Último movimiento',
+     lambda: Movimiento.query.order_by(Movimiento.fecha.desc()).limit(1),
+     ['ix_movimiento_fecha']),
+    ('Contador de notificaciones no leídas',
+     lambda: db.session.query(func.count(Notificacion.id)).filter(Notificacion.usuario_id == 1, Notificacion.leida == False),
+     ['ix_notificacion_usuario_leida_fecha']),
+    ('Últimas notificaciones',
+     lambda: Notificacion.query.filter_by(usuario_id=1).order_by(Notificacion.fecha.desc()).limit(10),
+     ['ix_notificacion_usuario_fecha', 'ix_notificacion_usuario_leida_fecha']),
+]
+
+def plan_de_consulta(consulta):
+    """Devuelve el plan de ejecución (EXPLAIN) de una consulta como texto"""
+    sql = str(consulta.statement.compile(db.engine, compile_kwargs={'literal_binds': True}))
+    if db.engine.dialect.name == 'sqlite':
+        filas = db.session.execute(text(f'EXPLAIN QUERY PLAN {sql}')).fetchall()
+        return '\n'.join(str(fila[-1]) for fila in filas)
+
+    # En Postgres, con tablas pequeñas el planner prefiere el seq scan
+    db.session.execute(text('SET LOCAL enable_seqscan = off'))
+    filas = db.session.execute(text(f'EXPLAIN {sql}')).fetchall()
+    return '\n'.join(fila[0] for fila in filas)
+
+@app.cli.command('verificar-indices')
+def verificar_indices():
+    fallos = 0
+    for nombre, construir, indices in CONSULTAS_CON_INDICE:
+        plan = plan_de_consulta(construir())
+        if any(indice in plan for indice in indices):
+            print(f'✅ {nombre}')
+        else:
+            fallos += 1
+            print(f'❌ {nombre}: no usa {" / ".join(indices)}')
+            print(plan)
+    db.session.rollback()
+
+    if fallos:
+        sys.exit(1)
+    print('✅ Todas las consultas usan sus índices.')
+
+@app.cli.command('reconstruir-saldos')
+def reconstruir_saldos_cmd():
+    total = reconstruir_saldos()
+    db.session.commit()
+    print(f'✅ Saldos reconstruidos desde el historial ({total} registros).')
+    verificar_saldos_cmd.callback()
+
+@app.cli.command('verificar-saldos')
+def verificar_saldos_cmd():
+    diferencias = verificar_saldos()
+    if not diferencias:
+        print('✅ Los saldos coinciden con el historial de movimientos.')
+        return
+
+    for (usuario_id, material_id), esperado, actual in diferencias:
+        print(f'❌ Usuario {usuario_id}, material {material_id}: esperado {tuple(esperado)}, actual {tuple(actual)}')
+    sys.exit(1)
+
+# Listados cuyo número de consultas no debe crecer con el número de filas
+RUTAS_LISTADO = {
+    'ALMACENISTA': ['/almacenista/retiros', '/almacenista/revisar_devoluciones', '/almacenista/existencias', '/almacenista/reportes'],
+    'INGENIERO': ['/ingeniero/dashboard', '/ingeniero/historial-retiros', '/ingeniero/reportes'],
+}
+
+# Movimientos que se siembran para que cada listado tenga filas que mostrar
+COMBINACIONES_LISTADO = [
+    ('SOLICITUD', 'PENDIENTE', None), ('SALIDA', 'AUTORIZADO', None), ('SALIDA', 'RECHAZADO', None),
+    ('DEVOLUCION', 'PENDIENTE', None), ('DEVOLUCION', 'AUTORIZADO', None),
+    ('DEVOLUCION', 'AUTORIZADO', REVISION_EN_FERRETERIA), ('DEVOLUCION', 'RECHAZADO', None),
+]
+
+def _consultas_por_ruta(usuarios):
+    consultas = {}
+    for rol, rutas in RUTAS_LISTADO.items():
+        usuario = usuarios[rol]
+        cliente = app.test_client()
+        with cliente.session_transaction() as sesion:
+            sesion.update(user=usuario.username, user_id=usuario.id, user_name=usuario.nombre,
+                          user_photo=usuario.foto, user_role=usuario.rol)
+
+        for ruta in rutas:
+            invalidar_cache_global()
+            with contar_consultas() as sentencias:
+                respuesta = cliente.get(ruta)
+            consultas[ruta] = (len(sentencias), respuesta.status_code)
+    return consultas
+
+def _sembrar_listados(materiales, ingeniero, almacenista, cantidad):
+    for i in range(cantidad):
+        tipo, estado, revision = COMBINACIONES_LISTADO[i % len(COMBINACIONES_LISTADO)]
+        db.session.add(Movimiento(
+            material_id=materiales[i % len(materiales)].id, tipo=tipo, estado=estado, estado_revision=revision,
+            cantidad=1, solicitado_por_id=ingeniero.id,
+            usuario_id=None if estado == 'PENDIENTE' else almacenista.id
+        ))
+    db.session.commit()
+
+@app.cli.command('contar-consultas')
+@click.option('--pequeno', default=10, show_default=True, help='Movimientos de prueba en la primera medición')
+@click.option('--grande', default=100, show_default=True, help='Movimientos de prueba en la segunda medición')
+def contar_consultas_cmd(pequeno, grande):
+    """Mide las consultas de cada listado con pocos y con muchos movimientos; deben ser las mismas"""
+    usuarios = {rol: User.query.filter_by(rol=rol).first() for rol in RUTAS_LISTADO}
+    faltan = [rol for rol, usuario in usuarios.items() if not usuario]
+    if faltan:
+        print(f'❌ Hace falta al menos un usuario con rol {", ".join(faltan)}.')
+        sys.exit(1)
+
+    marca = int(time.time())
+    materiales = [Material(codigo=f'CONSULTAS-{marca}-{i}', nombre=f'Prueba de consultas {i}',
+                           stock=grande, stock_minimo=0, unidad='UND') for i in range(max(grande // 10, 2))]
+    db.session.add_all(materiales)
+    db.session.commit()
+    ids = [m.id for m in materiales]
+
+    try:
+        _sembrar_listados(materiales, usuarios['INGENIERO'], usuarios['ALMACENISTA'], pequeno)
+        antes = _consultas_por_ruta(usuarios)
+        _sembrar_listados(materiales, usuarios['INGENIERO'], usuarios['ALMACENISTA'], grande - pequeno)
+        despues = _consultas_por_ruta(usuarios)
+    finally:
+        db.session.rollback()
+        AsientoStock.query.filter(AsientoStock.material_id.in_(ids)).delete(synchronize_session=False)
+        ResumenMensual.query.filter(ResumenMensual.material_id.in_(ids)).delete(synchronize_session=False)
+        Movimiento.query.filter(Movimiento.material_id.in_(ids)).delete(synchronize_session=False)
+        SaldoIngeniero.query.filter(SaldoIngeniero.material_id.in_(ids)).delete(synchronize_session=False)
+        Material.query.filter(Material.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+
+    crecen = []
+    for ruta, (consultas, codigo) in despues.items():
+        consultas_antes, codigo_antes = antes[ruta]
+        print(f'{ruta}: {consultas_antes} consultas con {pequeno} movimientos, {consultas} con {grande} '
+              f'(HTTP {codigo_antes} / {codigo})')
+        if consultas > consultas_antes:
+            crecen.append(ruta)
+    if crecen:
+        print(f'❌ El número de consultas crece con las filas en: {", ".join(crecen)}')
+        sys.exit(1)
+    print('✅ Ningún listado hace más consultas con más filas.')
+
+@app.cli.command('benchmark-alertas')
+@click.option('--repeticiones', default=50, show_default=True, help='Ejecuciones de cada versión')
+@click.option('--sembrar', default=0, show_default=True, help='Movimientos de prueba a insertar (se descartan al final)')
+def benchmark_alertas(repeticiones, sembrar):
+    if sembrar:
+        material = Material.query.first()
+        ingeniero = User.query.filter_by(rol='INGENIERO').first()
+        if not material or not ingeniero:
+            print('❌ Para sembrar hace falta al menos un material y un ingeniero.')
+            sys.exit(1)
+        # Como en producción, casi todo el historial ya está procesado: una
+        # de cada 20 filas queda abierta (cuenta en alguna alerta)
+        abiertos = [('SOLICITUD', 'PENDIENTE', None), ('DEVOLUCION', 'PENDIENTE', None),
+                    ('DEVOLUCION', 'AUTORIZADO', None), ('DEVOLUCION', 'AUTORIZADO', REVISION_EN_FERRETERIA)]
+        procesados = [('SALIDA', 'AUTORIZADO', None), ('SOLICITUD', 'RECHAZADO', None),
+                      ('DEVOLUCION', 'AUTORIZADO', REVISION_RETORNADO_STOCK),
+                      ('DEVOLUCION', 'AUTORIZADO', REVISION_APROBADO_FERRETERIA), ('DEVOLUCION', 'RECHAZADO', None)]
+        combinaciones = (abiertos[i // 20 % len(abiertos)] if i % 20 == 0 else procesados[i % len(procesados)]
+                         for i in range(sembrar))
+        db.session.execute(insert(Movimiento), [
+            {'tipo': tipo, 'estado': estado, 'estado_revision': revision, 'cantidad': 1,
+             'material_id': material.id, 'solicitado_por_id': ingeniero.id}
+            for tipo, estado, revision in combinaciones
+        ])
+        print(f'➡️ {sembrar} movimientos de prueba insertados.')
+
+    total = Movimiento.query.count()
+    versiones = [('Por separado', obtener_alertas_almacenista_por_separado),
+                 ('Una consulta', obtener_alertas_almacenista)]
+    resultados = {}
+    for nombre, funcion in versiones:
+        with contar_consultas() as sentencias:
+            resultados[nombre] = funcion()
+        inicio = time.perf_counter()
+        for _ in range(repeticiones):
+            funcion()
+        promedio = (time.perf_counter() - inicio) / repeticiones * 1000
+        print(f'{nombre}: {len(sentencias)} consultas, {promedio:.2f} ms de promedio ({total} movimientos)')
+    db.session.rollback()
+
+    if resultados['Por separado'] != resultados['Una consulta']:
+        print('❌ Las dos versiones no devuelven lo mismo:')
+        print(resultados)
+        sys.exit(1)
+    print('✅ Ambas versiones devuelven los mismos contadores.')
+
+@app.cli.command('compilar-estaticos')
+def compilar_estaticos_cmd():
+    manifiesto = compilar_estaticos(app.static_folder, app.config['ESTATICOS_COMPILADOS'])
+    comprimidos = comprimir_estaticos(app.config['ESTATICOS_COMPILADOS'])
+    print(f'✅ {len(manifiesto)} estáticos con huella, {comprimidos} variantes comprimidas nuevas.')
+
+@app.cli.command('reconstruir-busqueda')
+def reconstruir_busqueda_cmd():
+    if not crear_indice_busqueda():
+        print(f'⚠️ El motor {db.engine.dialect.name} no tiene índice de búsqueda; se usa ILIKE.')
+        return
+    print('✅ Índice de búsqueda de materiales reconstruido.')
+
+@app.cli.command('importar-materiales')
+@click.argument('ruta', type=click.Path(exists=True, dir_okay=False))
+@click.option('--lote', default=TAMANO_LOTE, show_default=True, help='Materiales por commit')
+def importar_materiales_cmd(ruta, lote):
+    with open(ruta, 'rb') as archivo:
+        resultado = importar_materiales(leer_filas(archivo, ruta), tamano_lote=lote)
+
+    print(f'➡️ {resultado.creados} creados, {resultado.actualizados} actualizados, {resultado.reactivados} reactivados.')
+    for fila, motivo in resultado.errores:
+        print(f'❌ Fila {fila}: {motivo}')
+    if resultado.errores:
+        sys.exit(1)
+    print('✅ Importación completa.')
+
+@app.cli.command('exportar')
+@click.argument('tipo', type=click.Choice(sorted(EXPORTACIONES)))
+@click.argument('ruta', type=click.Path(dir_okay=False))
+def exportar_cmd(tipo, ruta):
+    if ruta.lower().endswith('.xlsx'):
+        with escribir_xlsx(EXPORTACIONES[tipo]()) as temporal, open(ruta, 'wb') as destino:
+            destino.write(temporal.read())
+    else:
+        with open(ruta, 'w', encoding='utf-8', newline='') as destino:
+            destino.writelines(generar_csv(EXPORTACIONES[tipo]()))
+    print(f'✅ {tipo} exportados a {ruta}.')
+
+@app.cli.command('estres-stock')
+@click.option('--solicitudes', default=300, show_default=True, help='Solicitudes de 1 unidad a sembrar')
+@click.option('--stock', 'stock_inicial', default=200.0, show_default=True, help='Stock inicial del material de prueba')
+@click.option('--procesos', default=8, show_default=True, help='Procesos que autorizan en paralelo')
+@click.option('--conservar', is_flag=True, help='No borrar los datos de prueba al terminar')
+def estres_stock(solicitudes, stock_inicial, procesos, conservar):
+    """Autoriza las mismas solicitudes desde varios procesos y comprueba que el stock cuadre"""
+    almacenista = User.query.filter_by(rol='ALMACENISTA').first()
+    ingeniero = User.query.filter_by(rol='INGENIERO').first()
+    if not almacenista or not ingeniero:
+        print('❌ Hace falta al menos un almacenista y un ingeniero.')
+        sys.exit(1)
+
+    material = Material(codigo=f'ESTRES-{int(time.time())}', nombre='Prueba de concurrencia',
+                        stock=stock_inicial, stock_minimo=0, unidad='UND')
+    db.session.add(material)
+    db.session.flush()
+    pendientes = [Movimiento(material_id=material.id, tipo='SOLICITUD', cantidad=1, solicitado_por_id=ingeniero.id)
+                  for _ in range(solicitudes)]
+    db.session.add_all(pendientes)
+    db.session.commit()
+    ids = [m.id for m in pendientes]
+    material_id = material.id
+    print(f'➡️ Material {material.codigo}: stock {stock_inicial}, {solicitudes} solicitudes, {procesos} procesos.')
+
+    # Cada proceso recorre todas las solicitudes en un orden distinto
+    inicio = time.perf_counter()
+    hijos = []
+    for n in range(procesos):
+        orden = [str(i) for i in random.Random(n).sample(ids, len(ids))]
+        hijos.append(subprocess.Popen(
+            [sys.executable, '-m', 'stock', str(almacenista.id), almacenista.username, *orden],
+            cwd=basedir, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+        ))
+    respuestas = Counter()
+    for hijo in hijos:
+        salida, errores = hijo.communicate()
+        if hijo.returncode != 0:
+            print(f'❌ Un proceso terminó con error:\n{errores[-2000:]}')
+            sys.exit(1)
+        respuestas.update(json.loads(salida.strip().splitlines()[-1]))
+    duracion = time.perf_counter() - inicio
+    print(f'➡️ {sum(respuestas.values())} peticiones en {duracion:.1f} s, respuestas: {dict(respuestas)}')
+
+    db.session.expire_all()
+    stock_final = db.session.get(Material, material_id).stock
+    autorizadas, total_autorizado = db.session.query(
+        db.func.count(Movimiento.id), db.func.coalesce(db.func.sum(Movimiento.cantidad), 0)
+    ).filter(Movimiento.material_id == material_id, Movimiento.estado == 'AUTORIZADO').one()
+
+    fallos = []
+    if stock_final < 0:
+        fallos.append(f'stock negativo: {stock_final}')
+    if abs(stock_inicial - total_autorizado - stock_final) > 1e-6:
+        fallos.append(f'stock {stock_final} != {stock_inicial} - {total_autorizado} autorizados')
+    fallos += [f'saldo descuadrado: {d}' for d in verificar_saldos()]
+    fallos += [f'libro de stock descuadrado: {d}' for d in verificar_libro_stock()]
+    print(f'➡️ {autorizadas} solicitudes autorizadas, stock final {stock_final}.')
+
+    if not conservar:
+        AsientoStock.query.filter_by(material_id=material_id).delete()
+        CorteStock.query.filter_by(material_id=material_id).delete()
+        ResumenMensual.query.filter_by(material_id=material_id).delete()
+        PronosticoMaterial.query.filter_by(material_id=material_id).delete()
+        Movimiento.query.filter_by(material_id=material_id).delete()
+        SaldoIngeniero.query.filter_by(material_id=material_id).delete()
+        Material.query.filter_by(id=material_id).delete()
+        db.session.commit()
+
+    if fallos:
+        for fallo in fallos:
+            print(f'❌ {fallo}')
+        sys.exit(1)
+    print('✅ El stock se conserva bajo autorizaciones concurrentes.')
+
+@app.cli.command('verificar-libro-stock')
+@click.option('--conciliar', is_flag=True, help='Registrar la diferencia como saldo inicial (BD creada antes del libro)')
+def verificar_libro_stock_cmd(conciliar):
+    diferencias = verificar_libro_stock()
+    if not diferencias:
+        print('✅ El stock de todos los materiales coincide con su libro.')
+        return
+    for material_id, libro, stock in diferencias:
+        print(f'⚠️ Material {material_id}: libro {libro}, stock {stock}')
+    if not conciliar:
+        print(f'❌ {len(diferencias)} materiales no coinciden.')
+        sys.exit(1)
+    for material_id, libro, stock in diferencias:
+        registrar_asiento(material_id, (stock or 0) - libro, ORIGEN_INICIAL)
+    db.session.commit()
+    print(f'✅ {len(diferencias)} materiales conciliados.')
+
+@app.cli.command('tomar-corte-stock')
+def tomar_corte_stock_cmd():
+    hasta = tomar_corte_stock()
+    if hasta is None:
+        print('⚠️ No hay asientos nuevos desde el último corte.')
+        return
+    print(f'✅ Corte de stock registrado hasta el asiento {hasta}.')
+
+@app.cli.command('stock-en-fecha')
+@click.argument('fecha', type=click.DateTime(formats=['%Y-%m-%d', '%Y-%m-%d %H:%M']))
+@click.option('--codigo', help='Código de un solo material')
+def stock_en_fecha_cmd(fecha, codigo):
+    """Stock de los materiales en FECHA (UTC)"""
+    materiales = Material.query.filter_by(codigo=codigo) if codigo else Material.query.filter_by(activo=True)
+    materiales = materiales.order_by(Material.codigo).all()
+    if not materiales:
+        print(f'❌ No se encontró el material {codigo}.')
+        sys.exit(1)
+    saldos = stock_en_fecha(fecha, [m.id for m in materiales] if codigo else None)
+    for material in materiales:
+        print(f'{material.codigo}\t{material.nombre}\t{saldos.get(material.id, 0)}')
+
+@app.cli.command('reconstruir-resumenes')
+def reconstruir_resumenes_cmd():
+    total = reconstruir_resumenes()
+    db.session.commit()
+    print(f'✅ Resúmenes mensuales reconstruidos desde el historial ({total} registros).')
+    verificar_resumenes_cmd.callback()
+
+@app.cli.command('verificar-resumenes')
+def verificar_resumenes_cmd():
+    diferencias = verificar_resumenes()
+    if not diferencias:
+        print('✅ Los resúmenes mensuales coinciden con el historial de movimientos.')
+        return
+
+    for (anio, mes, material_id, tipo, estado), esperado, actual in sorted(diferencias):
+        print(f'❌ {anio}-{mes:02d}, material {material_id}, {tipo} {estado}: esperado {esperado}, actual {actual}')
+    sys.exit(1)
+
+@app.cli.command('calcular-pronosticos')
+def calcular_pronosticos_cmd():
+    inicio = time.perf_counter()
+    total = calcular_pronosticos()
+    print(f'✅ Pronóstico de consumo calculado para {total} materiales en {time.perf_counter() - inicio:.2f} s.')
+    for s in obtener_sugerencias_reposicion():
+        dias = 'sin consumo' if s.dias_hasta_agotar is None else f'{s.dias_hasta_agotar:.0f} días'
+        print(f'➡️ {s.nombre}: stock {s.stock}, {s.consumo_diario:.2f}/día, se agota en {dias}, pedir {s.cantidad_sugerida}')
+
+@app.cli.command('tareas')
+def tareas_cmd():
+    """Programación y última ejecución de cada tarea periódica"""
+    registrar_tareas()
+    programadas = {t.nombre: t for t in TareaProgramada.query}
+    for nombre in TAREAS:
+        tarea = programadas[nombre]
+        ultima = EjecucionTarea.query.filter_by(tarea=nombre).order_by(EjecucionTarea.inicio.desc()).first()
+        en_curso = f', en curso en {tarea.bloqueada_por}' if tarea.bloqueada_por else ''
+        print(f'➡️ {nombre}: próxima {tarea.proxima:%Y-%m-%d %H:%M}{en_curso}')
+        if ultima:
+            print(f'   última {ultima.inicio:%Y-%m-%d %H:%M} {ultima.estado} en {ultima.duracion:.2f} s {ultima.detalle or ""}')
+
+@app.cli.command('ejecutar-tarea')
+@click.argument('nombre', type=click.Choice(list(TAREAS)))
+def ejecutar_tarea_cmd(nombre):
+    registrar_tareas()
+    if not reclamar_tarea(nombre, forzar=True):
+        print(f'⚠️ La tarea {nombre} se está ejecutando en otro proceso.')
+        sys.exit(1)
+    ejecucion = ejecutar_tarea(nombre)
+    if ejecucion.estado != ESTADO_OK:
+        print(f'❌ {nombre}: {ejecucion.detalle}')
+        sys.exit(1)
+    print(f'✅ {nombre} en {ejecucion.duracion:.2f} s: {ejecucion.detalle}')
+
 @app.cli.command('create-admin')
 def create_admin():
     username = 'admin'
@@ -230,10 +723,6 @@ def login():
 def logout():
     session.clear()
     return redirect(url_for('home'))
-# -----------------------------
-
-# Crear carpeta evidencias si no existe
-os.makedirs('evidencias', exist_ok=True)
 
 # -----------------------------
 # INICIAR APP CON SOCKETIO
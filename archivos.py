@@ -0,0 +1,169 @@
+# archivos.py
+
+from flask import current_app, url_for, send_from_directory
+from werkzeug.utils import secure_filename
+import subprocess
+import threading
+import hashlib
+import queue
+import uuid
+import sys
+import os
+
+# -----------------------------
+# ALMACENAMIENTO POR CONTENIDO
+# -----------------------------
+# Cada archivo subido se guarda como <carpeta>/<sha[:2]>/<sha256>.<ext>; dos
+# subidas con el mismo contenido comparten archivo. En la BD se guarda la ruta
+# relativa a la carpeta (p. ej. "3f/3fa2...c9.jpg"); los nombres antiguos sin
+# subcarpeta siguen funcionando igual.
+TAMANO_BLOQUE = 64 * 1024
+EXTENSIONES_IMAGEN = {'png', 'jpg', 'jpeg', 'gif'}
+
+# Variantes reducidas de las imágenes: <base>.<variante>.jpg junto al original
+VARIANTES = {
+    'web': (480, 480),
+    'pdf': (1000, 1000),
+}
+
+def extension(nombre):
+    return nombre.rsplit('.', 1)[1].lower() if '.' in nombre else ''
+
+def es_imagen(nombre):
+    return extension(nombre) in EXTENSIONES_IMAGEN
+
+def guardar_subida(archivo, carpeta):
+    """
+    Escribe el FileStorage en bloques mientras calcula su SHA-256 y lo mueve a
+    su ruta por contenido. Devuelve el nombre relativo a la carpeta.
+    """
+    ext = extension(secure_filename(archivo.filename))
+    temporal = os.path.join(carpeta, f'.subida-{uuid.uuid4().hex}.tmp')
+    sha = hashlib.sha256()
+
+    try:
+        with open(temporal, 'wb') as destino:
+            while True:
+                bloque = archivo.stream.read(TAMANO_BLOQUE)
+                if not bloque:
+                    break
+                sha.update(bloque)
+                destino.write(bloque)
+
+        digest = sha.hexdigest()
+        nombre = f'{digest[:2]}/{digest}.{ext}' if ext else f'{digest[:2]}/{digest}'
+        ruta = os.path.join(carpeta, nombre)
+
+        if os.path.exists(ruta):
+            # Contenido repetido: se reutiliza el archivo existente (y se marca
+            # como reciente para que la retención no lo tome por huérfano)
+            os.remove(temporal)
+            os.utime(ruta)
+        else:
+            os.makedirs(os.path.dirname(ruta), exist_ok=True)
+            os.replace(temporal, ruta)
+    finally:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+
+    if es_imagen(nombre) and not all(os.path.exists(ruta_variante(ruta, v)) for v in VARIANTES):
+        encolar_variantes(ruta)
+    return nombre
+
+# -----------------------------
+# VARIANTES
+# -----------------------------
+def ruta_variante(ruta, variante):
+    return f'{os.path.splitext(ruta)[0]}.{variante}.jpg'
+
+def nombre_servible(carpeta, nombre, variante=None):
+    """La variante si ya existe en disco; si no (o no es imagen), el original"""
+    if variante and es_imagen(nombre):
+        reducida = ruta_variante(nombre, variante)
+        if os.path.exists(os.path.join(carpeta, reducida)):
+            return reducida
+    return nombre
+
+def generar_variante(original, destino, tamano):
+    """Copia reducida en JPEG; se reutiliza mientras el original no cambie"""
+    if os.path.exists(destino) and os.path.getmtime(destino) >= os.path.getmtime(original):
+        return
+    from PIL import Image, ImageOps
+
+    os.makedirs(os.path.dirname(destino), exist_ok=True)
+    with Image.open(original) as imagen:
+        # En JPEG decodifica directamente a menor escala sin cargar la foto completa
+        imagen.draft('RGB', tamano)
+        imagen = ImageOps.exif_transpose(imagen)
+        imagen.thumbnail(tamano)
+        temporal = f'{destino}.tmp'
+        imagen.convert('RGB').save(temporal, 'JPEG', quality=80, optimize=True)
+    os.replace(temporal, destino)
+
+def generar_variantes(original):
+    for variante, tamano in VARIANTES.items():
+        generar_variante(original, ruta_variante(original, variante), tamano)
+
+# Pillow usa CPU; las variantes se generan en un proceso aparte
+# (python -m archivos) para no bloquear el worker eventlet
+_cola = queue.Queue()
+_hilo = None
+_hilo_lock = threading.Lock()
+
+def encolar_variantes(ruta):
+    global _hilo
+    with _hilo_lock:
+        if _hilo is None:
+            _hilo = threading.Thread(target=_atender_cola, daemon=True)
+            _hilo.start()
+    _cola.put(os.path.abspath(ruta))
+
+def _atender_cola():
+    while True:
+        ruta = _cola.get()
+        try:
+            proceso = subprocess.run(
+                [sys.executable, '-m', 'archivos', ruta],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                capture_output=True, text=True
+            )
+            if proceso.returncode != 0:
+                print(f"Error generando variantes de {ruta}: {proceso.stderr}")
+        except Exception as e:
+            print(f"Error generando variantes de {ruta}: {e}")
+
+# -----------------------------
+# SERVIR ARCHIVOS SUBIDOS
+# -----------------------------
+# Se sirven desde la carpeta configurada (UPLOAD_FOLDER / EVIDENCIAS_FOLDER),
+# que puede estar fuera de static/ (p. ej. un volumen compartido).
+def servir_evidencia(nombre):
+    return send_from_directory(current_app.config['EVIDENCIAS_FOLDER'], nombre)
+
+def servir_foto(nombre):
+    return send_from_directory(current_app.config['UPLOAD_FOLDER'], nombre)
+
+def registrar_archivos(app):
+    app.add_url_rule('/evidencias/<path:nombre>', 'evidencia', servir_evidencia)
+    app.add_url_rule('/uploads/<path:nombre>', 'foto', servir_foto)
+
+# -----------------------------
+# URLS PARA PLANTILLAS
+# -----------------------------
+def evidencia_url(nombre, variante=None):
+    nombre = nombre_servible(current_app.config['EVIDENCIAS_FOLDER'], nombre, variante)
+    return url_for('evidencia', nombre=nombre)
+
+def foto_url(nombre, variante=None):
+    if not nombre:
+        # La foto por defecto viene con la aplicación, no está en UPLOAD_FOLDER
+        return url_for('static', filename='uploads/default.png')
+    nombre = nombre_servible(current_app.config['UPLOAD_FOLDER'], nombre, variante)
+    return url_for('foto', nombre=nombre)
+
+# -----------------------------
+# PROCESO HIJO
+# -----------------------------
+if __name__ == '__main__':
+    for ruta in sys.argv[1:]:
+        generar_variantes(ruta)
@@ -0,0 +1,129 @@
+# busqueda.py
+
+from models import db, Material
+from sqlalchemy import text, func, or_, Integer, Float
+import re
+
+# -----------------------------
+# ÍNDICE DE BÚSQUEDA DEL CATÁLOGO
+# -----------------------------
+# SQLite: tabla virtual FTS5 (material_fts) con contenido externo en material,
+# sincronizada por triggers en cada INSERT/UPDATE/DELETE. Búsqueda por prefijo
+# de palabra y orden por bm25.
+# Postgres: índices GIN de trigramas (pg_trgm) sobre las columnas buscadas; el
+# ILIKE '%q%' los usa y el orden se hace por similitud.
+# Si el índice no existe (p. ej. BD creada con create_all) se usa ILIKE normal.
+RESULTADOS_AUTOCOMPLETAR = 10
+RESULTADOS_AUTOCOMPLETAR_MAXIMO = 50
+
+# Peso de cada columna en bm25: codigo, nombre, descripcion, unidad
+PESOS_BM25 = (10.0, 5.0, 1.0, 1.0)
+
+SQL_FTS_SQLITE = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS material_fts USING fts5(
+        codigo, nombre, descripcion, unidad,
+        content='material', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS material_fts_insert AFTER INSERT ON material BEGIN
+        INSERT INTO material_fts(rowid, codigo, nombre, descripcion, unidad)
+        VALUES (new.id, new.codigo, new.nombre, new.descripcion, new.unidad);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS material_fts_delete AFTER DELETE ON material BEGIN
+        INSERT INTO material_fts(material_fts, rowid, codigo, nombre, descripcion, unidad)
+        VALUES ('delete', old.id, old.codigo, old.nombre, old.descripcion, old.unidad);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS material_fts_update AFTER UPDATE OF codigo, nombre, descripcion, unidad ON material BEGIN
+        INSERT INTO material_fts(material_fts, rowid, codigo, nombre, descripcion, unidad)
+        VALUES ('delete', old.id, old.codigo, old.nombre, old.descripcion, old.unidad);
+        INSERT INTO material_fts(rowid, codigo, nombre, descripcion, unidad)
+        VALUES (new.id, new.codigo, new.nombre, new.descripcion, new.unidad);
+    END""",
+]
+
+SQL_TRGM_POSTGRES = ["CREATE EXTENSION IF NOT EXISTS pg_trgm"] + [
+    f"CREATE INDEX IF NOT EXISTS ix_material_{columna}_trgm ON material USING gin ({columna} gin_trgm_ops)"
+    for columna in ('codigo', 'nombre', 'descripcion', 'unidad')
+]
+
+_indice_disponible = {}
+
+def indice_disponible():
+    """Si el índice del dialecto actual existe (se consulta una vez por motor)"""
+    motor = db.engine
+    if motor not in _indice_disponible:
+        if motor.dialect.name == 'sqlite':
+            sql = "SELECT 1 FROM sqlite_master WHERE name = 'material_fts'"
+        elif motor.dialect.name == 'postgresql':
+            sql = "SELECT 1 FROM pg_indexes WHERE indexname = 'ix_material_nombre_trgm'"
+        else:
+            sql = None
+        _indice_disponible[motor] = bool(sql and db.session.execute(text(sql)).first())
+    return _indice_disponible[motor]
+
+def crear_indice_busqueda():
+    """Crea (si falta) y reconstruye el índice de búsqueda del catálogo"""
+    dialecto = db.engine.dialect.name
+    if dialecto == 'sqlite':
+        for sql in SQL_FTS_SQLITE:
+            db.session.execute(text(sql))
+        db.session.execute(text("INSERT INTO material_fts(material_fts) VALUES ('rebuild')"))
+    elif dialecto == 'postgresql':
+        for sql in SQL_TRGM_POSTGRES:
+            db.session.execute(text(sql))
+    else:
+        return False
+    db.session.commit()
+    _indice_disponible.pop(db.engine, None)
+    return True
+
+# -----------------------------
+# CONSULTAS
+# -----------------------------
+def _consulta_fts(texto):
+    """'tubo pvc' -> '"tubo"* "pvc"*' (todas las palabras, por prefijo)"""
+    palabras = re.findall(r'\w+', texto)
+    return ' '.join(f'"{p}"*' for p in palabras)
+
+def buscar_materiales(texto, solo_activos=True):
+    """
+    Query de Material que coincide con el texto, ordenada por relevancia.
+    Sin texto devuelve todos los materiales (activos) por nombre.
+    """
+    consulta = Material.query
+    if solo_activos:
+        consulta = consulta.filter(Material.activo == True)
+
+    texto = (texto or '').strip()
+    if not texto:
+        return consulta.order_by(Material.nombre)
+
+    dialecto = db.engine.dialect.name
+    if indice_disponible() and dialecto == 'sqlite':
+        consulta_fts = _consulta_fts(texto)
+        if not consulta_fts:
+            return consulta.filter(db.false())
+        coincidencias = text(
+            "SELECT rowid AS id, bm25(material_fts, :p_codigo, :p_nombre, :p_descripcion, :p_unidad) AS rango "
+            "FROM material_fts WHERE material_fts MATCH :consulta"
+        ).bindparams(
+            consulta=consulta_fts, p_codigo=PESOS_BM25[0], p_nombre=PESOS_BM25[1],
+            p_descripcion=PESOS_BM25[2], p_unidad=PESOS_BM25[3]
+        ).columns(id=Integer, rango=Float).subquery()
+        return consulta.join(coincidencias, coincidencias.c.id == Material.id).order_by(coincidencias.c.rango, Material.nombre)
+
+    filtro = or_(
+        Material.codigo.icontains(texto, autoescape=True),
+        Material.nombre.icontains(texto, autoescape=True),
+        Material.descripcion.icontains(texto, autoescape=True),
+        Material.unidad.icontains(texto, autoescape=True)
+    )
+    consulta = consulta.filter(filtro)
+    if indice_disponible() and dialecto == 'postgresql':
+        rango = func.greatest(
+            func.similarity(Material.codigo, texto),
+            func.similarity(Material.nombre, texto),
+            func.word_similarity(texto, Material.nombre)
+        )
+        return consulta.order_by(rango.desc(), Material.nombre)
+    return consulta.order_by(Material.nombre)
@@ -0,0 +1,264 @@
+# carga_masiva.py
+
+from models import db, Material, Movimiento, User, ORIGEN_IMPORTACION
+from utils import fecha_y_hora_colombia
+from libro_stock import origen_stock
+from stock import fijar_stock
+from sqlalchemy.orm import aliased
+from sqlalchemy.exc import IntegrityError
+from collections import namedtuple
+import itertools
+import tempfile
+import codecs
+import csv
+import io
+
+# -----------------------------
+# IMPORTACIÓN DE MATERIALES
+# -----------------------------
+# El archivo se lee fila a fila (CSV o XLSX) y se aplica por lotes de
+# TAMANO_LOTE materiales con un commit por lote. Un código existente se
+# actualiza; si estaba eliminado (activo=False) se reactiva como en el
+# formulario de nuevo material. Solo se escriben las columnas que trae el
+# encabezado: un archivo con codigo;nombre corrige nombres sin tocar el stock.
+# El stock de un material existente se fija con fijar_stock (UPDATE
+# condicional) para no pisar una autorización que lo descuente a la vez.
+CAMPOS_MATERIAL = ['codigo', 'nombre', 'descripcion', 'unidad', 'stock', 'stock_minimo']
+TAMANO_LOTE = 500
+TAMANO_LECTURA = 1000  # filas por yield_per en las exportaciones
+TAMANO_BLOQUE = 64 * 1024
+
+ResultadoImportacion = namedtuple('ResultadoImportacion', ['creados', 'actualizados', 'reactivados', 'errores'])
+
+def reactivar_material(material, datos):
+    """Reutiliza un material eliminado (activo=False) con los datos nuevos"""
+    for campo, valor in datos.items():
+        setattr(material, campo, valor)
+    material.activo = True
+
+def leer_filas(archivo, nombre_archivo):
+    """Itera las filas del archivo como dicts {columna: valor} (la fila 1 es el encabezado)"""
+    if nombre_archivo.lower().endswith('.xlsx'):
+        return _leer_filas_xlsx(archivo)
+    return _leer_filas_csv(archivo)
+
+def detectar_codificacion(archivo):
+    """
+    UTF-8 si todo el archivo lo es; si no, cp1252 (CSV de Excel en español).
+    Se revisa antes de importar nada para no fallar a mitad de la carga,
+    cuando ya hay lotes confirmados.
+    """
+    decodificador = codecs.getincrementaldecoder('utf-8-sig')()
+    codificacion = 'utf-8-sig'
+    try:
+        while True:
+            bloque = archivo.read(TAMANO_BLOQUE)
+            decodificador.decode(bloque, final=not bloque)
+            if not bloque:
+                break
+    except UnicodeDecodeError:
+        codificacion = 'cp1252'
+    archivo.seek(0)
+    return codificacion
+
+def _leer_filas_csv(archivo):
+    texto = io.TextIOWrapper(archivo, encoding=detectar_codificacion(archivo), newline='')
+    encabezado = texto.readline()
+    # Excel en español exporta con ';'
+    delimitador = ';' if encabezado.count(';') > encabezado.count(',') else ','
+    yield from csv.DictReader(itertools.chain([encabezado], texto), delimiter=delimitador)
+
+def _leer_filas_xlsx(archivo):
+    from openpyxl import load_workbook
+
+    libro = load_workbook(archivo, read_only=True, data_only=True)
+    try:
+        filas = libro.active.iter_rows(values_only=True)
+        encabezado = [str(c).strip() if c is not None else '' for c in next(filas, [])]
+        for fila in filas:
+            yield dict(zip(encabezado, fila))
+    finally:
+        libro.close()
+
+def validar_fila(fila):
+    """
+    Normaliza una fila del archivo. Devuelve solo las columnas presentes en el
+    encabezado. Lanza ValueError con el motivo si no es válida.
+    """
+    fila = {str(k).strip().lower(): v for k, v in fila.items() if k}
+    texto = lambda campo: str(fila.get(campo) if fila.get(campo) is not None else '').strip()
+
+    datos = {'codigo': texto('codigo')}
+    if not datos['codigo']:
+        raise ValueError('falta el código')
+    if 'nombre' in fila:
+        datos['nombre'] = texto('nombre')
+        if not datos['nombre']:
+            raise ValueError('falta el nombre')
+    for campo in ('descripcion', 'unidad'):
+        if campo in fila:
+            datos[campo] = texto(campo) or None
+
+    try:
+        if 'stock' in fila:
+            datos['stock'] = float(texto('stock').replace(',', '.') or 0)
+        if 'stock_minimo' in fila:
+            datos['stock_minimo'] = int(float(texto('stock_minimo').replace(',', '.') or 0))
+    except ValueError:
+        raise ValueError('stock y stock_minimo deben ser números')
+    if datos.get('stock', 0) < 0 or datos.get('stock_minimo', 0) < 0:
+        raise ValueError('stock y stock_minimo no pueden ser negativos')
+    return datos
+
+def importar_materiales(filas, tamano_lote=TAMANO_LOTE, usuario_id=None):
+    contadores = {'creados': 0, 'actualizados': 0, 'reactivados': 0}
+    errores = []
+    lote = []
+
+    with origen_stock(ORIGEN_IMPORTACION, usuario_id):
+        for numero, fila in enumerate(filas, start=2):
+            try:
+                lote.append((numero, validar_fila(fila)))
+            except ValueError as e:
+                errores.append((numero, str(e)))
+                continue
+            if len(lote) >= tamano_lote:
+                _aplicar_lote(lote, contadores, errores, usuario_id)
+                lote = []
+
+        if lote:
+            _aplicar_lote(lote, contadores, errores, usuario_id)
+    return ResultadoImportacion(errores=errores, **contadores)
+
+def _aplicar_lote(lote, contadores, errores, usuario_id=None):
+    try:
+        parciales, errores_lote = _upsert(lote, usuario_id)
+        db.session.commit()
+    except IntegrityError:
+        # Se repite fila por fila para saber cuál falló
+        db.session.rollback()
+        parciales = {'creados': 0, 'actualizados': 0, 'reactivados': 0}
+        errores_lote = []
+        for numero, datos in lote:
+            try:
+                parciales_fila, errores_fila = _upsert([(numero, datos)], usuario_id)
+                db.session.commit()
+            except IntegrityError as e:
+                db.session.rollback()
+                errores_lote.append((numero, f'no se pudo guardar: {e.orig}'))
+                continue
+            for clave, valor in parciales_fila.items():
+                parciales[clave] += valor
+            errores_lote += errores_fila
+
+    for clave, valor in parciales.items():
+        contadores[clave] += valor
+    errores += errores_lote
+
+def _upsert(lote, usuario_id=None):
+    parciales = {'creados': 0, 'actualizados': 0, 'reactivados': 0}
+    errores = []
+    stocks = []
+    nuevos = set()  # códigos creados en este lote (aún sin flush)
+    codigos = {datos['codigo'] for _, datos in lote}
+    existentes = {m.codigo: m for m in Material.query.filter(Material.codigo.in_(codigos))}
+
+    for numero, datos in lote:
+        material = existentes.get(datos['codigo'])
+        if material is None:
+            if not datos.get('nombre'):
+                errores.append((numero, 'falta el nombre para crear el material'))
+                continue
+            material = Material(**datos)
+            db.session.add(material)
+            existentes[datos['codigo']] = material
+            nuevos.add(datos['codigo'])
+            parciales['creados'] += 1
+            continue
+        if datos['codigo'] in nuevos:
+            # Código repetido en el archivo: el material aún no está en la BD
+            for campo, valor in datos.items():
+                setattr(material, campo, valor)
+            parciales['actualizados'] += 1
+            continue
+
+        # Sin modificar `datos`: el lote se repite fila por fila si falla
+        datos = dict(datos)
+        if 'stock' in datos:
+            stocks.append((numero, material, datos.pop('stock')))
+        if material.activo is False:
+            reactivar_material(material, datos)
+            parciales['reactivados'] += 1
+        else:
+            for campo, valor in datos.items():
+                setattr(material, campo, valor)
+            parciales['actualizados'] += 1
+    db.session.flush()
+
+    for numero, material, stock in stocks:
+        if not fijar_stock(material.id, stock, ORIGEN_IMPORTACION, usuario_id):
+            errores.append((numero, 'el stock cambió mientras se importaba, vuelva a importar la fila'))
+    return parciales, errores
+
+# -----------------------------
+# EXPORTACIÓN
+# -----------------------------
+# Consultas de columnas leídas con yield_per: la memoria no crece con el
+# tamaño del catálogo ni del historial.
+def filas_materiales():
+    yield CAMPOS_MATERIAL + ['activo']
+    consulta = db.session.query(*(getattr(Material, c) for c in CAMPOS_MATERIAL), Material.activo)
+    for fila in consulta.order_by(Material.id).yield_per(TAMANO_LECTURA):
+        yield list(fila)
+
+def filas_movimientos():
+    yield ['id', 'fecha', 'hora', 'tipo', 'estado', 'estado_revision', 'codigo', 'material', 'cantidad',
+           'solicitado_por', 'procesado_por', 'observacion', 'observacion_almacenista']
+
+    solicitante = aliased(User)
+    procesador = aliased(User)
+    consulta = db.session.query(
+        Movimiento.id, Movimiento.fecha, Movimiento.tipo, Movimiento.estado, Movimiento.estado_revision,
+        Material.codigo, Material.nombre, Movimiento.cantidad,
+        solicitante.nombre, procesador.nombre,
+        Movimiento.observacion, Movimiento.observacion_almacenista
+    ).join(Material, Movimiento.material_id == Material.id) \
+     .join(solicitante, Movimiento.solicitado_por_id == solicitante.id) \
+     .outerjoin(procesador, Movimiento.usuario_id == procesador.id) \
+     .order_by(Movimiento.id)
+
+    for (mov_id, fecha, *resto) in consulta.yield_per(TAMANO_LECTURA):
+        local = fecha_y_hora_colombia(fecha)
+        yield [mov_id, local['fecha'], local['hora'], *resto]
+
+EXPORTACIONES = {
+    'materiales': filas_materiales,
+    'movimientos': filas_movimientos,
+}
+
+def generar_csv(filas):
+    """Convierte las filas en trozos de texto CSV para una respuesta en streaming"""
+    # BOM para que Excel reconozca UTF-8 (leer_filas lo descarta al importar)
+    yield '\ufeff'
+    bufer = io.StringIO()
+    escritor = csv.writer(bufer)
+    for numero, fila in enumerate(filas, start=1):
+        escritor.writerow(fila)
+        if numero % TAMANO_LECTURA == 0:
+            yield bufer.getvalue()
+            bufer.seek(0)
+            bufer.truncate()
+    yield bufer.getvalue()
+
+def escribir_xlsx(filas):
+    """Libro en modo write_only (las filas van a disco); devuelve el archivo temporal"""
+    from openpyxl import Workbook
+
+    libro = Workbook(write_only=True)
+    hoja = libro.create_sheet()
+    for fila in filas:
+        hoja.append(fila)
+    temporal = tempfile.TemporaryFile()
+    libro.save(temporal)
+    temporal.seek(0)
+    return temporal
@@ -0,0 +1,93 @@
+# catalogo.py
+
+from models import db, Material
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from collections import namedtuple
+import threading
+import time
+
+# -----------------------------
+# CATÁLOGO DE MATERIALES EN MEMORIA
+# -----------------------------
+# Copia de solo lectura de los materiales activos, compartida por todo el
+# proceso. Se lee con una consulta de columnas (sin hidratar objetos ORM) y se
+# reconstruye cuando cambia la versión: cada commit que toca Material la
+# incrementa. Con varios workers, los cambios hechos en otro proceso se ven al
+# vencer el TTL.
+CATALOGO_TTL_SEGUNDOS = 30
+
+class MaterialCatalogo(namedtuple('MaterialCatalogo', [
+    'id', 'codigo', 'nombre', 'descripcion', 'stock', 'stock_minimo', 'unidad', 'en_devolucion'
+])):
+    __slots__ = ()
+
+    @property
+    def stock_bajo(self):
+        return (self.stock or 0) < (self.stock_minimo or 0)
+
+# materiales: tupla ordenada por id; por_id: {id: MaterialCatalogo}
+Catalogo = namedtuple('Catalogo', ['version', 'materiales', 'por_id', 'vence'])
+
+_version = 0
+_catalogo = None
+_catalogo_lock = threading.Lock()
+
+def _leer_catalogo(version):
+    filas = db.session.query(*(getattr(Material, campo) for campo in MaterialCatalogo._fields)).filter(
+        Material.activo == True
+    ).order_by(Material.id)
+    materiales = tuple(MaterialCatalogo(*fila) for fila in filas)
+    return Catalogo(
+        version,
+        materiales,
+        {m.id: m for m in materiales},
+        time.monotonic() + CATALOGO_TTL_SEGUNDOS
+    )
+
+def obtener_catalogo():
+    global _catalogo
+    catalogo = _catalogo
+    if catalogo is None or catalogo.version != _version or catalogo.vence <= time.monotonic():
+        with _catalogo_lock:
+            if _catalogo is catalogo:
+                _catalogo = _leer_catalogo(_version)
+            catalogo = _catalogo
+    return catalogo
+
+def materiales_activos():
+    return obtener_catalogo().materiales
+
+def invalidar_catalogo():
+    global _version
+    with _catalogo_lock:
+        _version += 1
+
+# -----------------------------
+# INVALIDACIÓN AL CONFIRMAR CAMBIOS
+# -----------------------------
+@event.listens_for(Session, 'after_flush')
+def _detectar_cambios_material(sesion, flush_context):
+    for obj in list(sesion.new) + list(sesion.dirty) + list(sesion.deleted):
+        if isinstance(obj, Material):
+            sesion.info['invalidar_catalogo'] = True
+            return
+
+@event.listens_for(Session, 'do_orm_execute')
+def _detectar_cambios_masivos_material(orm_execute_state):
+    if orm_execute_state.is_update or orm_execute_state.is_delete or orm_execute_state.is_insert:
+        mapper = orm_execute_state.bind_mapper
+        if mapper is not None and issubclass(mapper.class_, Material):
+            orm_execute_state.session.info['invalidar_catalogo'] = True
+
+@event.listens_for(Session, 'after_commit')
+def _invalidar_catalogo_tras_commit(sesion):
+    if sesion.info.pop('invalidar_catalogo', False):
+        invalidar_catalogo()
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _invalidar_catalogo_tras_rollback(sesion, transaccion_previa):
+    # Si el catálogo se leyó desde esta sesión después del flush, pudo quedar
+    # con datos que ya no existen
+    if sesion.info.pop('invalidar_catalogo', False):
+        invalidar_catalogo()
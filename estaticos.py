@@ -0,0 +1,194 @@
+# estaticos.py
+
+from flask import request, send_file, url_for, abort
+import posixpath
+import mimetypes
+import hashlib
+import json
+import sys
+import re
+import os
+
+# -----------------------------
+# ESTÁTICOS CON HUELLA
+# -----------------------------
+# Al desplegar se copia cada archivo de static/ a ESTATICOS_COMPILADOS con el hash
+# de su contenido en el nombre (style.css -> style.3fa2b1c9d0e1.css) y se guarda
+# el manifiesto. Como la URL cambia con el contenido, se sirven con caché
+# inmutable de un año. En ese mismo paso se generan las variantes .br / .gz.
+CACHE_INMUTABLE = 'public, max-age=31536000, immutable'
+ARCHIVO_MANIFIESTO = 'manifest.json'
+
+# Contenido subido por usuarios: no es un asset de la aplicación
+CARPETAS_EXCLUIDAS = {'evidencias', 'uploads'}
+# Formatos que ganan con compresión (png, mp3, woff ya vienen comprimidos)
+EXTENSIONES_COMPRIMIBLES = {'.css', '.js', '.svg', '.json', '.txt', '.ttf', '.otf', '.eot', '.ico', '.map'}
+CODIFICACIONES = [('br', '.br'), ('gzip', '.gz')]
+
+_manifiesto = {}   # 'style.css' -> 'style.3fa2b1c9d0e1.css'
+_originales = {}   # 'style.3fa2b1c9d0e1.css' -> 'style.css'
+_carpeta_compilada = None
+
+def _con_huella(nombre, contenido):
+    base, ext = posixpath.splitext(nombre)
+    return f'{base}.{hashlib.sha256(contenido).hexdigest()[:12]}{ext}'
+
+def _listar_estaticos(carpeta):
+    for raiz, carpetas, archivos in os.walk(carpeta):
+        carpetas[:] = [c for c in carpetas if c not in CARPETAS_EXCLUIDAS and not c.startswith('.')]
+        for archivo in archivos:
+            if archivo.startswith('.'):
+                continue
+            ruta = os.path.join(raiz, archivo)
+            yield os.path.relpath(ruta, carpeta).replace(os.sep, '/'), ruta
+
+_URL_CSS = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+
+def _reescribir_css(nombre, contenido, manifiesto):
+    """Apunta los url(...) relativos del CSS a los nombres con huella"""
+    carpeta_css = posixpath.dirname(nombre)
+
+    def reemplazar(coincidencia):
+        comilla, url = coincidencia.groups()
+        if re.match(r'^([a-z]+:|/|#)', url):
+            return coincidencia.group(0)
+        ruta = url.partition('?')[0]
+        destino = posixpath.normpath(posixpath.join(carpeta_css, ruta))
+        if destino not in manifiesto:
+            return coincidencia.group(0)
+        nueva = posixpath.relpath(manifiesto[destino], carpeta_css or '.')
+        return f'url({comilla}{nueva}{comilla})'
+
+    return _URL_CSS.sub(reemplazar, contenido.decode('utf-8')).encode('utf-8')
+
+def _escribir(ruta, contenido):
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    temporal = f'{ruta}.{os.getpid()}.tmp'
+    with open(temporal, 'wb') as f:
+        f.write(contenido)
+    os.replace(temporal, ruta)
+
+def compilar_estaticos(carpeta, destino):
+    """Copia los estáticos con huella a destino y escribe el manifiesto"""
+    manifiesto = {}
+    hojas_css = []
+    for nombre, ruta in _listar_estaticos(carpeta):
+        if nombre.endswith('.css'):
+            hojas_css.append((nombre, ruta))
+            continue
+        with open(ruta, 'rb') as f:
+            contenido = f.read()
+        manifiesto[nombre] = _con_huella(nombre, contenido)
+        if not os.path.exists(os.path.join(destino, manifiesto[nombre])):
+            _escribir(os.path.join(destino, manifiesto[nombre]), contenido)
+
+    # El CSS va al final: su huella depende de las URLs ya reescritas
+    for nombre, ruta in hojas_css:
+        with open(ruta, 'rb') as f:
+            contenido = _reescribir_css(nombre, f.read(), manifiesto)
+        manifiesto[nombre] = _con_huella(nombre, contenido)
+        if not os.path.exists(os.path.join(destino, manifiesto[nombre])):
+            _escribir(os.path.join(destino, manifiesto[nombre]), contenido)
+
+    _escribir(os.path.join(destino, ARCHIVO_MANIFIESTO), json.dumps(manifiesto, indent=1).encode('utf-8'))
+    return manifiesto
+
+def comprimir_estaticos(destino):
+    """Genera las variantes .br (Brotli) y .gz (zopfli) que aún no existan"""
+    import brotli
+    import zopfli.gzip
+
+    with open(os.path.join(destino, ARCHIVO_MANIFIESTO), encoding='utf-8') as f:
+        manifiesto = json.load(f)
+
+    # Primero los archivos pequeños (CSS, SVG); las fuentes tardan más
+    rutas = [
+        os.path.join(destino, nombre) for nombre in manifiesto.values()
+        if posixpath.splitext(nombre)[1].lower() in EXTENSIONES_COMPRIMIBLES
+    ]
+    generados = 0
+    for ruta in sorted(rutas, key=os.path.getsize):
+        with open(ruta, 'rb') as f:
+            contenido = f.read()
+        if not os.path.exists(f'{ruta}.br'):
+            _escribir(f'{ruta}.br', brotli.compress(contenido, quality=11))
+            generados += 1
+        if not os.path.exists(f'{ruta}.gz'):
+            _escribir(f'{ruta}.gz', zopfli.gzip.compress(contenido))
+            generados += 1
+    return generados
+
+# -----------------------------
+# INTEGRACIÓN CON FLASK
+# -----------------------------
+# Los estáticos se compilan y comprimen al construir la imagen o el slug
+# (`python -m estaticos`, ver bin/post_compile), así el resultado viaja con el
+# código a cada servidor; al importar la aplicación solo se lee el manifiesto. Si no existe (o en modo debug, para ver los
+# cambios al momento) se compila aquí, sin comprimir: mientras falten las
+# variantes .br / .gz se sirve el archivo sin comprimir.
+def registrar_estaticos(app, destino):
+    global _carpeta_compilada
+    _carpeta_compilada = destino
+
+    manifiesto = None if app.debug else leer_manifiesto(destino)
+    if manifiesto is None:
+        os.makedirs(destino, exist_ok=True)
+        manifiesto = compilar_estaticos(app.static_folder, destino)
+    cargar_manifiesto(manifiesto)
+
+    app.add_url_rule('/assets/<path:nombre>', 'estatico_con_huella', servir_estatico)
+    app.jinja_env.globals['estatico'] = estatico
+
+def leer_manifiesto(destino):
+    try:
+        with open(os.path.join(destino, ARCHIVO_MANIFIESTO), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def cargar_manifiesto(manifiesto):
+    _manifiesto.clear()
+    _manifiesto.update(manifiesto)
+    _originales.clear()
+    _originales.update({huella: nombre for nombre, huella in manifiesto.items()})
+
+def estatico(nombre):
+    """Reemplazo de url_for('static', filename=...) con URL cacheable para siempre"""
+    if nombre in _manifiesto:
+        return url_for('estatico_con_huella', nombre=_manifiesto[nombre])
+    return url_for('static', filename=nombre)
+
+def servir_estatico(nombre):
+    if nombre not in _originales:
+        abort(404)
+
+    ruta = os.path.join(_carpeta_compilada, nombre)
+    codificacion = None
+    if posixpath.splitext(nombre)[1].lower() in EXTENSIONES_COMPRIMIBLES:
+        for cod, ext in CODIFICACIONES:
+            if request.accept_encodings[cod] and os.path.exists(ruta + ext):
+                ruta, codificacion = ruta + ext, cod
+                break
+
+    respuesta = send_file(
+        ruta,
+        mimetype=mimetypes.guess_type(nombre)[0] or 'application/octet-stream',
+        max_age=31536000,
+        conditional=True
+    )
+    respuesta.headers['Cache-Control'] = CACHE_INMUTABLE
+    respuesta.headers['Vary'] = 'Accept-Encoding'
+    if codificacion:
+        respuesta.headers['Content-Encoding'] = codificacion
+    return respuesta
+
+# -----------------------------
+# COMPILAR AL CONSTRUIR
+# -----------------------------
+# python -m estaticos ORIGEN DESTINO: no importa la aplicación, así que corre en
+# el paso de build sin base de datos ni variables de entorno
+if __name__ == '__main__':
+    origen, destino = sys.argv[1:3]
+    manifiesto = compilar_estaticos(origen, destino)
+    comprimidos = comprimir_estaticos(destino)
+    print(f'{len(manifiesto)} estáticos con huella, {comprimidos} variantes comprimidas nuevas.')
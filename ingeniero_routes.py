@@ -1,19 +1,21 @@
 # ingeniero_routes.py
 
-from flask import Blueprint, render_template, request, redirect, url_for, session, flash, make_response
+from flask import Blueprint, render_template, request, redirect, url_for, session, flash, current_app, jsonify, send_file, abort
 from models import db, User, Material, Movimiento,Notificacion
-from datetime import datetime, timezone
+from datetime import datetime
 from functools import wraps
-from utils import fecha_y_hora_colombia, emitir_notificacion, obtener_alertas_ingeniero
+from utils import fecha_y_hora_colombia, emitir_notificacion, obtener_alertas_ingeniero, paginar_movimientos, CARGA_MOVIMIENTOS, CARGA_MOVIMIENTOS_CON_MATERIAL
+from inventario import obtener_saldos_ingeniero, obtener_saldo, reconstruir_saldos, SALDO_VACIO
 import os
-from werkzeug.utils import secure_filename
-from weasyprint import HTML
-from sqlalchemy import func
+from reportes_pdf import clave_reporte, clave_pertenece, ruta_reporte, estado_reporte, encolar_reporte, ESTADO_LISTO, url_archivo
+from archivos import guardar_subida, es_imagen, ruta_variante
+from catalogo import materiales_activos
+from resumenes import descontar_de_resumenes, mes_de
+from collections import namedtuple
 import requests
 
 ingeniero_bp = Blueprint('ingeniero', __name__, url_prefix='/ingeniero')
 
-UPLOAD_FOLDER = os.path.join('static', 'evidencias')
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'pdf'}
 
 def allowed_file(filename):
@@ -53,6 +55,7 @@ def dashboard():
 
     ultimos_movimientos = (
         Movimiento.query
+        .options(*CARGA_MOVIMIENTOS_CON_MATERIAL)
         .join(Material)
         .filter(Movimiento.solicitado_por_id == usuario.id, Material.activo == True)
         .order_by(Movimiento.fecha.desc())
@@ -74,8 +77,7 @@ def dashboard():
 @ingeniero_required
 def existencias():
     sync_user_session()
-    materiales = Material.query.filter_by(activo=True).all()
-    return render_template('Ingeniero/existencias_ingeniero.html', materiales=materiales)
+    return render_template('Ingeniero/existencias_ingeniero.html', materiales=materiales_activos())
 
 # -----------------------------
 # Solicitar retiro
@@ -84,7 +86,6 @@ def existencias():
 @ingeniero_required
 def solicitar_retiro():
     sync_user_session()
-    materiales = Material.query.filter_by(activo=True).all()
 
     if request.method == 'POST':
         material_id = request.form.get('material_id')
@@ -108,22 +109,23 @@ def solicitar_retiro():
         db.session.add(movimiento)
         db.session.commit()
 
-        almacenista = User.query.filter_by(rol='ALMACENISTA').first()
         material = Material.query.get(int(material_id))
 
-        if almacenista and material:
+        if material:
             mensaje = (
                 f" Nueva solicitud de retiro: {material.nombre} "
                 f"({cantidad} {material.unidad}) solicitada por {usuario.nombre}."
             )
             if observacion:
                 mensaje += f"\n📝 Observación: {observacion}"
-            emitir_notificacion(tipo_usuario='almacenista', usuario_id=almacenista.id, mensaje=mensaje)
+            # A la sala del rol: la recibe cualquier almacenista conectado
+            emitir_notificacion(tipo_usuario='almacenista', mensaje=mensaje)
 
         flash(' Solicitud de retiro enviada.', 'success')
         return redirect(url_for('ingeniero.solicitar_retiro'))
 
-    return render_template('Ingeniero/solicitar_retiro.html', materiales=materiales)
+    # Los materiales se consultan por AJAX en /materiales/buscar mientras se escribe
+    return render_template('Ingeniero/solicitar_retiro.html')
 
 # -----------------------------
 # Historial de retiros
@@ -138,21 +140,21 @@ def historial_retiros():
         flash('Usuario no encontrado.', 'error')
         return redirect(url_for('ingeniero.dashboard'))
 
-    movimientos = (
+    pagina = paginar_movimientos(
         Movimiento.query
+        .options(*CARGA_MOVIMIENTOS_CON_MATERIAL)
         .join(Material)  # Unimos con la tabla Material
         .filter(
             Movimiento.solicitado_por_id == usuario.id,
             Material.activo == True  # Solo materiales activos
         )
-        .order_by(Movimiento.fecha.desc())
-        .all()
     )
+    movimientos = pagina.items
 
     for mov in movimientos:
         mov.fecha_local = fecha_y_hora_colombia(mov.fecha)
 
-    return render_template('Ingeniero/historial_retiros.html', movimientos=movimientos)
+    return render_template('Ingeniero/historial_retiros.html', movimientos=movimientos, pagina=pagina)
 
 # -----------------------------
 # Reportes de obra
@@ -167,43 +169,46 @@ def reportes():
         flash('Usuario no encontrado.', 'error')
         return redirect(url_for('ingeniero.dashboard'))
 
-    aprobados = (
+    pagina_aprobados = paginar_movimientos(
         Movimiento.query
+        .options(*CARGA_MOVIMIENTOS_CON_MATERIAL)
         .join(Material)
         .filter(
             Movimiento.solicitado_por_id == usuario.id,
             Movimiento.tipo == 'SALIDA',
             Movimiento.estado == 'AUTORIZADO',
             Material.activo == True
-        )
-        .order_by(Movimiento.fecha.desc())
-        .all()
+        ),
+        'cursor_aprobados'
     )
+    aprobados = pagina_aprobados.items
 
-    rechazados = (
+    pagina_rechazados = paginar_movimientos(
         Movimiento.query
+        .options(*CARGA_MOVIMIENTOS_CON_MATERIAL)
         .join(Material)
         .filter(
             Movimiento.solicitado_por_id == usuario.id,
             Movimiento.tipo == 'SALIDA',
             Movimiento.estado == 'RECHAZADO',
             Material.activo == True
-        )
-        .order_by(Movimiento.fecha.desc())
-        .all()
+        ),
+        'cursor_rechazados'
     )
+    rechazados = pagina_rechazados.items
 
-    devoluciones = (
+    pagina_devoluciones = paginar_movimientos(
         Movimiento.query
+        .options(*CARGA_MOVIMIENTOS_CON_MATERIAL)
         .join(Material)
         .filter(
             Movimiento.solicitado_por_id == usuario.id,
             Movimiento.tipo == 'DEVOLUCION',
             Material.activo == True
-        )
-        .order_by(Movimiento.fecha.desc())
-        .all()
+        ),
+        'cursor_devoluciones'
     )
+    devoluciones = pagina_devoluciones.items
 
     for mov in aprobados + rechazados + devoluciones:
         mov.fecha_local = fecha_y_hora_colombia(mov.fecha)
@@ -212,7 +217,10 @@ def reportes():
         'Ingeniero/reportes_ingeniero.html',
         aprobados=aprobados,
         rechazados=rechazados,
-        devoluciones=devoluciones
+        devoluciones=devoluciones,
+        pagina_aprobados=pagina_aprobados,
+        pagina_rechazados=pagina_rechazados,
+        pagina_devoluciones=pagina_devoluciones
     )
 
 # -----------------------------
@@ -227,10 +235,15 @@ def borrar_historial_retiros():
         flash('Usuario no encontrado.', 'error')
         return redirect(url_for('login'))
 
-    Movimiento.query.filter(
+    historial = Movimiento.query.filter(
         Movimiento.solicitado_por_id == usuario.id,
         Movimiento.tipo.in_(['SALIDA', 'SOLICITUD', 'DEVOLUCION'])
-    ).delete(synchronize_session=False)
+    )
+    # El borrado masivo no pasa por el flush: restar su aporte a los
+    # resúmenes mensuales antes de borrar y recalcular después los saldos
+    descontar_de_resumenes(historial)
+    historial.delete(synchronize_session=False)
+    reconstruir_saldos(usuario.id)
 
     db.session.commit()
     flash('Historial de retiros, solicitudes y devoluciones borrado.', 'success')
@@ -249,57 +262,40 @@ def historial_devoluciones():
         flash('Usuario no encontrado.', 'error')
         return redirect(url_for('ingeniero.dashboard'))
 
-    devoluciones = (
+    pagina = paginar_movimientos(
         Movimiento.query
+        .options(*CARGA_MOVIMIENTOS_CON_MATERIAL)
         .join(Material)
         .filter(
             Movimiento.solicitado_por_id == usuario.id,
             Movimiento.tipo == 'DEVOLUCION',
             Material.activo == True
         )
-        .order_by(Movimiento.fecha.desc())
-        .all()
     )
+    devoluciones = pagina.items
 
     for dev in devoluciones:
         dev.fecha_local = fecha_y_hora_colombia(dev.fecha)
 
-    return render_template('historial_devoluciones.html', devoluciones=devoluciones)
+    return render_template('historial_devoluciones.html', devoluciones=devoluciones, pagina=pagina)
 
 # -----------------------------
 # Realizar devolución con evidencia
 # -----------------------------
+MaterialDevolucion = namedtuple('MaterialDevolucion', ['id', 'nombre', 'total_retirado', 'disponible_para_devolver'])
+
 @ingeniero_bp.route('/realizar-devolucion', methods=['GET', 'POST'])
 def realizar_devolucion():
     usuario_id = session.get('user_id')
 
     if request.method == 'GET':
-        materiales = Material.query.filter_by(activo=True).all()  #  Solo materiales activos
-
-        for material in materiales:
-            total_retirado = db.session.query(func.sum(Movimiento.cantidad)).filter(
-                Movimiento.material_id == material.id,
-                Movimiento.tipo == 'SALIDA',
-                Movimiento.estado == 'AUTORIZADO',
-                Movimiento.solicitado_por_id == usuario_id
-            ).scalar() or 0
-
-            total_devuelto = db.session.query(func.sum(Movimiento.cantidad)).filter(
-                Movimiento.material_id == material.id,
-                Movimiento.tipo == 'DEVOLUCION',
-                Movimiento.estado == 'AUTORIZADO',
-                Movimiento.solicitado_por_id == usuario_id
-            ).scalar() or 0
-
-            total_dev_pendientes = db.session.query(func.sum(Movimiento.cantidad)).filter(
-                Movimiento.material_id == material.id,
-                Movimiento.tipo == 'DEVOLUCION',
-                Movimiento.estado == 'PENDIENTE',
-                Movimiento.solicitado_por_id == usuario_id
-            ).scalar() or 0
-
-            material.total_retirado = total_retirado
-            material.disponible_para_devolver = max(total_retirado - (total_devuelto + total_dev_pendientes), 0)
+        saldos = obtener_saldos_ingeniero(usuario_id)
+        materiales = []
+        for material in materiales_activos():  #  Solo materiales activos
+            saldo = saldos.get(material.id, SALDO_VACIO)
+            materiales.append(MaterialDevolucion(
+                material.id, material.nombre, saldo.retirado, saldo.disponible_para_devolver
+            ))
 
         return render_template('Ingeniero/realizar_devolucion.html', materiales=materiales)
     
@@ -316,21 +312,9 @@ def realizar_devolucion():
 
     material = Material.query.get_or_404(material_id)
 
-    total_retirado = db.session.query(func.sum(Movimiento.cantidad)).filter(
-        Movimiento.material_id == material_id,
-        Movimiento.tipo == 'SALIDA',
-        Movimiento.estado == 'AUTORIZADO',
-        Movimiento.solicitado_por_id == usuario_id
-    ).scalar() or 0
-
-    total_devuelto = db.session.query(func.sum(Movimiento.cantidad)).filter(
-        Movimiento.material_id == material_id,
-        Movimiento.tipo == 'DEVOLUCION',
-        Movimiento.estado == 'AUTORIZADO',
-        Movimiento.solicitado_por_id == usuario_id
-    ).scalar() or 0
-
-    disponible_para_devolver = total_retirado - total_devuelto
+    saldo = obtener_saldo(usuario_id, material.id)
+    total_retirado = saldo.retirado
+    disponible_para_devolver = saldo.retirado - saldo.devuelto
 
     if total_retirado == 0:
         flash('⚠ No has retirado este material, la devolución será evaluada por el almacenista.', 'warning')
@@ -342,12 +326,7 @@ def realizar_devolucion():
 
     nombre_archivo = None
     if evidencia and evidencia.filename:
-        filename = secure_filename(evidencia.filename)
-        datos_fecha = fecha_y_hora_colombia(datetime.now(timezone.utc))
-        timestamp = f"{datos_fecha['fecha'].replace('/', '-')}_{datos_fecha['hora'].replace(':', '-').replace(' ', '')}"
-        nombre_archivo = f"{timestamp}_{filename}"
-        ruta_evidencia = os.path.join('static', 'evidencias', nombre_archivo)
-        evidencia.save(ruta_evidencia)
+        nombre_archivo = guardar_subida(evidencia, current_app.config['EVIDENCIAS_FOLDER'])
 
     movimiento = Movimiento(
         tipo='DEVOLUCION',
@@ -362,20 +341,18 @@ def realizar_devolucion():
     db.session.add(movimiento)
     db.session.commit()
     usuario = db.session.get(User, usuario_id)
-    almacenista = User.query.filter_by(rol='ALMACENISTA').first()
 
-    if almacenista:
-        mensaje = (
-            f"↩ Nueva solicitud de devolución: {material.nombre} "
-            f"({cantidad} {material.unidad}) solicitada por {usuario.nombre}."
-        )
-        if observacion:
-            mensaje += f"\n Observación: {observacion}"
-        try:
-            emitir_notificacion(tipo_usuario='almacenista', usuario_id=almacenista.id, mensaje=mensaje)
+    mensaje = (
+        f"↩ Nueva solicitud de devolución: {material.nombre} "
+        f"({cantidad} {material.unidad}) solicitada por {usuario.nombre}."
+    )
+    if observacion:
+        mensaje += f"\n Observación: {observacion}"
+    try:
+        emitir_notificacion(tipo_usuario='almacenista', mensaje=mensaje)
 
-        except Exception as e:
-            print(f"Error al emitir notificación: {e}")
+    except Exception as e:
+        print(f"Error al emitir notificación: {e}")
 
     flash(' Solicitud de devolución enviada correctamente.', 'success')
     return redirect(url_for('ingeniero.reportes'))
@@ -390,48 +367,93 @@ def generar_pdf():
     if not ACTIVAR_PDF_INGENIERO:
         return "Esta funcionalidad está temporalmente inactiva.", 404
 
+    sync_user_session()
+    usuario = User.query.filter_by(username=session.get('user')).first()
+    carpeta = current_app.config['REPORTES_FOLDER']
+    clave = clave_reporte(usuario)
+
+    # Sin cambios desde el último reporte: se sirve el PDF en caché
+    if estado_reporte(carpeta, clave) == ESTADO_LISTO:
+        return redirect(url_for('ingeniero.descargar_pdf', clave=clave))
+
+    html, miniaturas = renderizar_reporte_html(usuario)
+    encolar_reporte(
+        carpeta, clave, html,
+        raices=[current_app.static_folder, current_app.config['EVIDENCIAS_FOLDER']],
+        miniaturas=miniaturas,
+        procesos=current_app.config['PDF_PROCESOS']
+    )
+    return render_template(
+        'Ingeniero/generando_reporte.html',
+        url_estado=url_for('ingeniero.estado_pdf', clave=clave),
+        url_descarga=url_for('ingeniero.descargar_pdf', clave=clave)
+    )
+
+@ingeniero_bp.route('/estado-pdf/<clave>')
+@ingeniero_required
+def estado_pdf(clave):
+    if not clave_pertenece(clave, session.get('user_id')):
+        abort(404)
+    return jsonify({
+        'estado': estado_reporte(current_app.config['REPORTES_FOLDER'], clave),
+        'url_descarga': url_for('ingeniero.descargar_pdf', clave=clave)
+    })
+
+@ingeniero_bp.route('/descargar-pdf/<clave>')
+@ingeniero_required
+def descargar_pdf(clave):
+    if not clave_pertenece(clave, session.get('user_id')):
+        abort(404)
+    ruta = ruta_reporte(current_app.config['REPORTES_FOLDER'], clave)
+    if not os.path.exists(ruta):
+        flash('⚠️ El reporte ya no está disponible, genéralo de nuevo.', 'warning')
+        return redirect(url_for('ingeniero.reportes'))
+
+    return send_file(
+        ruta,
+        mimetype='application/pdf',
+        download_name=f"reporte_{session.get('user_name')}.pdf",
+        max_age=0
+    )
+
+def renderizar_reporte_html(usuario):
+    """
+    HTML del reporte y las miniaturas de evidencia que necesita.
+    Las imágenes van por file:// (ver reportes_pdf.url_fetcher_restringido).
+    """
     from datetime import datetime
     from collections import Counter
-    import base64
-    import os
     from utils import fecha_y_hora_colombia
 
-    def convertir_a_base64(ruta):
-        ruta_completa = os.path.join('static', ruta)
-        try:
-            with open(ruta_completa, 'rb') as f:
-                return base64.b64encode(f.read()).decode('utf-8')
-        except Exception as e:
-            print(f"Error al convertir {ruta} a base64:", e)
-            return None
-
-    sync_user_session()
-    usuario = User.query.filter_by(username=session.get('user')).first()
+    carpeta_evidencias = current_app.config['EVIDENCIAS_FOLDER']
+    miniaturas = []
 
     # Obtener movimientos
-    aprobados = Movimiento.query.filter_by(
+    aprobados = Movimiento.query.options(*CARGA_MOVIMIENTOS).filter_by(
         solicitado_por_id=usuario.id,
         tipo='SALIDA',
         estado='AUTORIZADO'
     ).order_by(Movimiento.fecha.desc()).all()
 
-    rechazados = Movimiento.query.filter(
+    rechazados = Movimiento.query.options(*CARGA_MOVIMIENTOS).filter(
         Movimiento.solicitado_por_id == usuario.id,
         Movimiento.estado == 'RECHAZADO',
         Movimiento.tipo.in_(['SOLICITUD', 'SALIDA'])
     ).order_by(Movimiento.fecha.desc()).all()
 
-    devoluciones = Movimiento.query.filter_by(
+    devoluciones = Movimiento.query.options(*CARGA_MOVIMIENTOS).filter_by(
         solicitado_por_id=usuario.id,
         tipo='DEVOLUCION'
     ).order_by(Movimiento.fecha.desc()).all()
 
     for mov in aprobados + rechazados + devoluciones:
         mov.fecha_colombia = fecha_y_hora_colombia(mov.fecha)
-        if mov.evidencia:
-            mov.evidencia_base64 = convertir_a_base64(os.path.join('evidencias', mov.evidencia))
-        else:
-            mov.evidencia_base64 = None
+        mov.evidencia_url = None
+        original = os.path.join(carpeta_evidencias, mov.evidencia) if mov.evidencia else None
+        if original and es_imagen(mov.evidencia) and os.path.exists(original):
+            miniatura = ruta_variante(original, 'pdf')
+            miniaturas.append((original, miniatura))
+            mov.evidencia_url = url_archivo(miniatura)
 
     # Estadísticas
     materiales = [mov.material.nombre for mov in aprobados]
@@ -446,14 +468,11 @@ def generar_pdf():
         "Enero", "Febrero", "Marzo", "Abril", "Mayo", "Junio",
         "Julio", "Agosto", "Septiembre", "Octubre", "Noviembre", "Diciembre"
     ]
-    mes_actual = meses_es[datetime.now().month - 1]
-    anio_actual = datetime.now().year
-
-    # Logo en base64
-    logo_base64 = convertir_a_base64("civistockresponsive.png")
-    logo_portada_base64 = convertir_a_base64("logo_civistock.png")
+    # El mes de la portada es el de Colombia, el mismo que entra en clave_reporte
+    anio_actual, mes = mes_de(ahora_utc)
+    mes_actual = meses_es[mes - 1]
 
-    rendered = render_template(
+    html = render_template(
         'Ingeniero/pdf_reporte_ingeniero.html',
         usuario=usuario,
         movimientos_aprobados=aprobados,
@@ -466,16 +485,10 @@ def generar_pdf():
         mes_actual=mes_actual,
         anio_actual=anio_actual,
         fecha_hora_actual=fecha_hora_actual,
-        logo_base64=logo_base64,
-        logo_portada_base64=logo_portada_base64
+        logo_url=url_archivo(os.path.join(current_app.static_folder, 'civistockresponsive.png')),
+        logo_portada_url=url_archivo(os.path.join(current_app.static_folder, 'logo_civistock.png'))
     )
-
-    pdf = HTML(string=rendered).write_pdf()
-
-    response = make_response(pdf)
-    response.headers['Content-Type'] = 'application/pdf'
-    response.headers['Content-Disposition'] = f'inline; filename=reporte_{usuario.nombre}.pdf'
-    return response
+    return html, miniaturas
 
 #-------------------------------
 # VACIAR NOTIFICACIONES
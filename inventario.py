@@ -0,0 +1,221 @@
+# inventario.py
+
+from models import db, Movimiento, SaldoIngeniero
+from sqlalchemy import func, case, and_, inspect, event, update, insert
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
+from collections import namedtuple, defaultdict
+
+# -----------------------------
+# SALDOS POR INGENIERO Y MATERIAL
+# -----------------------------
+class Saldo(namedtuple('Saldo', ['retirado', 'devuelto', 'pendiente'])):
+    __slots__ = ()
+
+    @property
+    def disponible_para_devolver(self):
+        return max(self.retirado - (self.devuelto + self.pendiente), 0)
+
+SALDO_VACIO = Saldo(0, 0, 0)
+
+def obtener_saldos_ingeniero(usuario_id, material_ids=None):
+    """
+    Retirado / devuelto / devolución pendiente de cada material del ingeniero,
+    leído de la tabla materializada saldo_ingeniero.
+    Devuelve {material_id: Saldo}; los materiales sin movimientos no aparecen.
+    """
+    consulta = SaldoIngeniero.query.filter_by(usuario_id=usuario_id)
+    if material_ids is not None:
+        consulta = consulta.filter(SaldoIngeniero.material_id.in_(material_ids))
+
+    return {
+        s.material_id: Saldo(s.retirado, s.devuelto, s.pendiente)
+        for s in consulta
+    }
+
+def obtener_saldo(usuario_id, material_id):
+    saldo = db.session.get(SaldoIngeniero, (usuario_id, material_id))
+    if not saldo:
+        return SALDO_VACIO
+    return Saldo(saldo.retirado, saldo.devuelto, saldo.pendiente)
+
+# -----------------------------
+# CÁLCULO DESDE EL HISTORIAL
+# -----------------------------
+def _suma_si(*condiciones):
+    return func.coalesce(func.sum(case((and_(*condiciones), Movimiento.cantidad), else_=0)), 0)
+
+def calcular_saldos_desde_historial(usuario_id=None):
+    """
+    Recalcula los saldos agregando todo el historial de movimientos en una
+    sola consulta agrupada. Devuelve {(usuario_id, material_id): Saldo}.
+    """
+    consulta = db.session.query(
+        Movimiento.solicitado_por_id,
+        Movimiento.material_id,
+        _suma_si(Movimiento.tipo == 'SALIDA', Movimiento.estado == 'AUTORIZADO'),
+        _suma_si(Movimiento.tipo == 'DEVOLUCION', Movimiento.estado == 'AUTORIZADO'),
+        _suma_si(Movimiento.tipo == 'DEVOLUCION', Movimiento.estado == 'PENDIENTE'),
+    ).filter(
+        Movimiento.tipo.in_(['SALIDA', 'DEVOLUCION']),
+        Movimiento.estado.in_(['AUTORIZADO', 'PENDIENTE'])
+    )
+    if usuario_id is not None:
+        consulta = consulta.filter(Movimiento.solicitado_por_id == usuario_id)
+
+    return {
+        (usuario, material): Saldo(retirado, devuelto, pendiente)
+        for usuario, material, retirado, devuelto, pendiente
+        in consulta.group_by(Movimiento.solicitado_por_id, Movimiento.material_id)
+    }
+
+def reconstruir_saldos(usuario_id=None):
+    """Reemplaza la tabla de saldos (o los de un usuario) por lo que dice el historial"""
+    borrar = SaldoIngeniero.query
+    if usuario_id is not None:
+        borrar = borrar.filter_by(usuario_id=usuario_id)
+    borrar.delete(synchronize_session=False)
+
+    saldos = calcular_saldos_desde_historial(usuario_id)
+    if saldos:
+        db.session.execute(insert(SaldoIngeniero), [
+            {
+                'usuario_id': usuario,
+                'material_id': material,
+                'retirado': saldo.retirado,
+                'devuelto': saldo.devuelto,
+                'pendiente': saldo.pendiente
+            }
+            for (usuario, material), saldo in saldos.items()
+        ])
+    return len(saldos)
+
+def verificar_saldos(tolerancia=1e-6):
+    """Compara la tabla materializada con el historial. Devuelve las diferencias."""
+    esperados = calcular_saldos_desde_historial()
+    actuales = {
+        (s.usuario_id, s.material_id): Saldo(s.retirado, s.devuelto, s.pendiente)
+        for s in SaldoIngeniero.query
+    }
+
+    diferencias = []
+    for clave in esperados.keys() | actuales.keys():
+        esperado = esperados.get(clave, SALDO_VACIO)
+        actual = actuales.get(clave, SALDO_VACIO)
+        if any(abs(a - e) > tolerancia for a, e in zip(actual, esperado)):
+            diferencias.append((clave, esperado, actual))
+    return diferencias
+
+# -----------------------------
+# MANTENIMIENTO EN LA MISMA TRANSACCIÓN
+# -----------------------------
+# Cada movimiento aporta a una sola columna del saldo según tipo/estado.
+# Al hacer flush se resta el aporte anterior y se suma el nuevo.
+def _aporte(tipo, estado, cantidad):
+    cantidad = cantidad or 0
+    estado = estado or 'PENDIENTE'  # default de la columna
+    if tipo == 'SALIDA' and estado == 'AUTORIZADO':
+        return (cantidad, 0, 0)
+    if tipo == 'DEVOLUCION' and estado == 'AUTORIZADO':
+        return (0, cantidad, 0)
+    if tipo == 'DEVOLUCION' and estado == 'PENDIENTE':
+        return (0, 0, cantidad)
+    return (0, 0, 0)
+
+_CAMPOS_SALDO = ('tipo', 'estado', 'cantidad', 'solicitado_por_id', 'material_id')
+
+def _valores(movimiento, anteriores):
+    estado = inspect(movimiento)
+    valores = {}
+    for campo in _CAMPOS_SALDO:
+        historial = estado.attrs[campo].load_history()
+        if anteriores:
+            valores[campo] = (historial.deleted or historial.unchanged or historial.added or [None])[0]
+        else:
+            valores[campo] = (historial.added or historial.unchanged or [None])[0]
+    return valores
+
+def _acumular(deltas, valores, signo):
+    aporte = _aporte(valores['tipo'], valores['estado'], valores['cantidad'])
+    if not any(aporte) or valores['solicitado_por_id'] is None:
+        return
+    clave = (valores['solicitado_por_id'], valores['material_id'])
+    deltas[clave] = tuple(d + signo * a for d, a in zip(deltas[clave], aporte))
+
+# Cargar el valor anterior aunque el atributo esté expirado al modificarlo,
+# para poder restar el aporte previo del movimiento
+def _conservar_valor_anterior(objetivo, valor, anterior, iniciador):
+    return valor
+
+for _campo in _CAMPOS_SALDO:
+    event.listen(getattr(Movimiento, _campo), 'set', _conservar_valor_anterior, active_history=True, retval=True)
+
+@event.listens_for(Session, 'before_flush')
+def _calcular_deltas_saldo(sesion, flush_context, instancias):
+    deltas = sesion.info.setdefault('deltas_saldo', defaultdict(lambda: (0, 0, 0)))
+    with sesion.no_autoflush:
+        for obj in sesion.new:
+            if isinstance(obj, Movimiento):
+                _acumular(deltas, _valores(obj, anteriores=False), +1)
+        for obj in sesion.deleted:
+            if isinstance(obj, Movimiento):
+                _acumular(deltas, _valores(obj, anteriores=True), -1)
+        for obj in sesion.dirty:
+            if isinstance(obj, Movimiento) and sesion.is_modified(obj):
+                _acumular(deltas, _valores(obj, anteriores=True), -1)
+                _acumular(deltas, _valores(obj, anteriores=False), +1)
+
+def sumar_en_fila(conexion, tabla, clave, incrementos):
+    """
+    Suma `incrementos` ({columna: delta}) a la fila `clave` ({columna: valor}
+    de la clave primaria) y la crea si no existe, en una sola sentencia
+    INSERT ... ON CONFLICT DO UPDATE. Con UPDATE y luego INSERT, dos
+    transacciones que crean la misma fila a la vez insertan las dos y una
+    falla por clave duplicada.
+    """
+    dialecto = conexion.dialect.name
+    if dialecto == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as insertar
+    elif dialecto == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as insertar
+    else:
+        return _sumar_en_fila_con_reintento(conexion, tabla, clave, incrementos)
+
+    sentencia = insertar(tabla).values(**clave, **incrementos)
+    conexion.execute(sentencia.on_conflict_do_update(
+        index_elements=list(clave),
+        set_={c: tabla.c[c] + sentencia.excluded[c] for c in incrementos}
+    ))
+
+def _sumar_en_fila_con_reintento(conexion, tabla, clave, incrementos):
+    # Motores sin ON CONFLICT: si otra transacción creó la fila entre el
+    # UPDATE y el INSERT, el INSERT falla dentro del savepoint y se repite el UPDATE
+    condicion = [tabla.c[c] == v for c, v in clave.items()]
+    sumar = update(tabla).where(*condicion).values({c: tabla.c[c] + d for c, d in incrementos.items()})
+    if conexion.execute(sumar).rowcount:
+        return
+    try:
+        with conexion.begin_nested():
+            conexion.execute(insert(tabla).values(**clave, **incrementos))
+    except IntegrityError:
+        conexion.execute(sumar)
+
+@event.listens_for(Session, 'after_flush')
+def _aplicar_deltas_saldo(sesion, flush_context):
+    deltas = sesion.info.pop('deltas_saldo', None)
+    if not deltas:
+        return
+
+    conexion = sesion.connection()
+    for (usuario_id, material_id), (retirado, devuelto, pendiente) in deltas.items():
+        if not (retirado or devuelto or pendiente):
+            continue
+        sumar_en_fila(
+            conexion, SaldoIngeniero.__table__,
+            {'usuario_id': usuario_id, 'material_id': material_id},
+            {'retirado': retirado, 'devuelto': devuelto, 'pendiente': pendiente}
+        )
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _descartar_deltas_saldo(sesion, transaccion_previa):
+    sesion.info.pop('deltas_saldo', None)
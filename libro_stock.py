@@ -0,0 +1,128 @@
+# libro_stock.py
+
+from models import db, Material, AsientoStock, CorteStock, ORIGEN_ALTA, ORIGEN_AJUSTE
+from sqlalchemy import event, insert, func, inspect
+from sqlalchemy.orm import Session
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+# -----------------------------
+# LIBRO DE STOCK
+# -----------------------------
+# Cada cambio de Material.stock deja un asiento con la diferencia y su origen.
+# Los UPDATE atómicos de stock.py insertan el suyo; los cambios hechos sobre el
+# objeto Material (alta, reactivación, importación) se detectan al hacer flush.
+# La suma de los asientos de un material es su stock actual.
+def registrar_asiento(material_id, cantidad, origen, movimiento_id=None, usuario_id=None, conexion=None):
+    (conexion or db.session).execute(insert(AsientoStock.__table__).values(
+        material_id=material_id,
+        cantidad=cantidad,
+        origen=origen,
+        movimiento_id=movimiento_id,
+        usuario_id=usuario_id,
+        fecha=datetime.utcnow()
+    ))
+
+@contextmanager
+def origen_stock(origen, usuario_id=None):
+    """Origen con el que se registran los cambios de stock hechos sobre objetos Material"""
+    info = db.session.info
+    anterior = info.get('origen_stock')
+    info['origen_stock'] = (origen, usuario_id)
+    try:
+        yield
+    finally:
+        if anterior is None:
+            info.pop('origen_stock', None)
+        else:
+            info['origen_stock'] = anterior
+
+# Cargar el stock anterior aunque el atributo esté expirado al modificarlo
+def _conservar_valor_anterior(objetivo, valor, anterior, iniciador):
+    return valor
+
+event.listen(Material.stock, 'set', _conservar_valor_anterior, active_history=True, retval=True)
+
+@event.listens_for(Session, 'after_flush')
+def _registrar_cambios_stock(sesion, flush_context):
+    origen, usuario_id = sesion.info.get('origen_stock', (None, None))
+    cambios = []
+    for obj in sesion.new:
+        if isinstance(obj, Material) and obj.stock:
+            cambios.append((obj.id, obj.stock, origen or ORIGEN_ALTA))
+    for obj in sesion.dirty:
+        if isinstance(obj, Material):
+            historial = inspect(obj).attrs.stock.history
+            if historial.has_changes():
+                anterior = (historial.deleted or [0])[0] or 0
+                nuevo = (historial.added or [0])[0] or 0
+                if nuevo != anterior:
+                    cambios.append((obj.id, nuevo - anterior, origen or ORIGEN_AJUSTE))
+
+    if cambios:
+        conexion = sesion.connection()
+        for material_id, cantidad, origen_cambio in cambios:
+            registrar_asiento(material_id, cantidad, origen_cambio, usuario_id=usuario_id, conexion=conexion)
+
+# -----------------------------
+# CORTES Y STOCK EN UNA FECHA
+# -----------------------------
+# Un corte guarda el stock de cada material sumando los asientos hasta un id.
+# El stock en una fecha es el del último corte anterior más los asientos
+# posteriores a ese corte, así que solo se suman los asientos de un periodo.
+# El corte deja fuera los asientos de los últimos minutos: en Postgres un id
+# bajo puede confirmarse después que uno alto si su transacción tarda.
+MARGEN_CORTE = timedelta(minutes=5)
+
+def tomar_corte_stock():
+    """Registra un corte nuevo. Devuelve su hasta_asiento_id o None si no hubo asientos nuevos"""
+    limite = datetime.utcnow() - MARGEN_CORTE
+    anterior = db.session.query(func.max(CorteStock.hasta_asiento_id)).scalar() or 0
+    hasta = db.session.query(func.max(AsientoStock.id)).filter(AsientoStock.fecha <= limite).scalar()
+    if hasta is None or hasta <= anterior:
+        return None
+
+    saldos = dict(db.session.query(CorteStock.material_id, CorteStock.stock).filter(
+        CorteStock.hasta_asiento_id == anterior
+    ))
+    nuevos = db.session.query(AsientoStock.material_id, func.sum(AsientoStock.cantidad)).filter(
+        AsientoStock.id > anterior, AsientoStock.id <= hasta
+    ).group_by(AsientoStock.material_id)
+    for material_id, cantidad in nuevos:
+        saldos[material_id] = saldos.get(material_id, 0) + cantidad
+
+    db.session.execute(insert(CorteStock.__table__), [
+        {'hasta_asiento_id': hasta, 'material_id': material_id, 'fecha': limite, 'stock': stock}
+        for material_id, stock in saldos.items()
+    ])
+    db.session.commit()
+    return hasta
+
+def stock_en_fecha(fecha, material_ids=None):
+    """{material_id: stock} al momento indicado (UTC)"""
+    corte = db.session.query(CorteStock.hasta_asiento_id).filter(
+        CorteStock.fecha <= fecha
+    ).order_by(CorteStock.hasta_asiento_id.desc()).limit(1).scalar() or 0
+
+    base = db.session.query(CorteStock.material_id, CorteStock.stock).filter(CorteStock.hasta_asiento_id == corte)
+    cola = db.session.query(AsientoStock.material_id, func.sum(AsientoStock.cantidad)).filter(
+        AsientoStock.id > corte, AsientoStock.fecha <= fecha
+    ).group_by(AsientoStock.material_id)
+    if material_ids is not None:
+        base = base.filter(CorteStock.material_id.in_(material_ids))
+        cola = cola.filter(AsientoStock.material_id.in_(material_ids))
+
+    saldos = dict(base)
+    for material_id, cantidad in cola:
+        saldos[material_id] = saldos.get(material_id, 0) + cantidad
+    return saldos
+
+def verificar_libro_stock(tolerancia=1e-6):
+    """Materiales cuyo stock no coincide con la suma de sus asientos: [(id, libro, stock)]"""
+    libro = dict(db.session.query(AsientoStock.material_id, func.sum(AsientoStock.cantidad)).group_by(AsientoStock.material_id))
+    diferencias = []
+    for material_id, stock in db.session.query(Material.id, Material.stock):
+        esperado = libro.get(material_id, 0)
+        if abs((stock or 0) - esperado) > tolerancia:
+            diferencias.append((material_id, esperado, stock))
+    return diferencias
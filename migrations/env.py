@@ -51,6 +51,18 @@ def get_metadata():
     return target_db.metadata
 
 
+# Objetos de búsqueda que crea busqueda.py fuera de los modelos (`flask
+# reconstruir-busqueda`): la tabla FTS5 material_fts con sus tablas internas en
+# SQLite y los índices de trigramas ix_material_*_trgm en Postgres. Sin este
+# filtro `flask db migrate` / `flask db check` proponen borrarlos.
+def include_object(object, name, type_, reflected, compare_to):
+    if type_ == 'table' and name.startswith('material_fts'):
+        return False
+    if type_ == 'index' and name.startswith('ix_material_') and name.endswith('_trgm'):
+        return False
+    return True
+
+
 def run_migrations_offline():
     """Run migrations in 'offline' mode.
 
@@ -65,7 +77,8 @@ def run_migrations_offline():
     """
     url = config.get_main_option("sqlalchemy.url")
     context.configure(
-        url=url, target_metadata=get_metadata(), literal_binds=True
+        url=url, target_metadata=get_metadata(), literal_binds=True,
+        include_object=include_object
     )
 
     with context.begin_transaction():
@@ -93,6 +106,8 @@ def run_migrations_online():
     conf_args = current_app.extensions['migrate'].configure_args
     if conf_args.get("process_revision_directives") is None:
         conf_args["process_revision_directives"] = process_revision_directives
+    if conf_args.get("include_object") is None:
+        conf_args["include_object"] = include_object
 
     connectable = get_engine()
 
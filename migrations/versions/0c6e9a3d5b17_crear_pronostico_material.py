@@ -0,0 +1,39 @@
+"""crear pronostico material
+
+Revision ID: 0c6e9a3d5b17
+Revises: f2b8d4a61c93
+Create Date: 2026-10-17 21:03:52.781406
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0c6e9a3d5b17'
+down_revision = 'f2b8d4a61c93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('pronostico_material',
+    sa.Column('material_id', sa.Integer(), nullable=False),
+    sa.Column('consumo_promedio', sa.Float(), nullable=False),
+    sa.Column('consumo_diario', sa.Float(), nullable=False),
+    sa.Column('stock', sa.Float(), nullable=False),
+    sa.Column('dias_hasta_agotar', sa.Float(), nullable=True),
+    sa.Column('cantidad_sugerida', sa.Float(), nullable=False),
+    sa.Column('calculado', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['material_id'], ['material.id'], name='fk_pronostico_material'),
+    sa.PrimaryKeyConstraint('material_id')
+    )
+    with op.batch_alter_table('pronostico_material', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_pronostico_material_dias_hasta_agotar'), ['dias_hasta_agotar'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('pronostico_material', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_pronostico_material_dias_hasta_agotar'))
+
+    op.drop_table('pronostico_material')
@@ -0,0 +1,37 @@
+"""crear notificacion archivada
+
+Revision ID: 3f9c2d7e8a15
+Revises: b7e31f0a9c42
+Create Date: 2026-10-17 23:02:44.918263
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9c2d7e8a15'
+down_revision = 'b7e31f0a9c42'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('notificacion_archivada',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('usuario_id', sa.Integer(), nullable=False),
+    sa.Column('mensaje', sa.String(length=300), nullable=False),
+    sa.Column('nivel', sa.String(length=10), nullable=False),
+    sa.Column('fecha', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['usuario_id'], ['user.id'], name='fk_notificacion_archivada_usuario'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('notificacion_archivada', schema=None) as batch_op:
+        batch_op.create_index('ix_notificacion_archivada_usuario_fecha', ['usuario_id', 'fecha'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('notificacion_archivada', schema=None) as batch_op:
+        batch_op.drop_index('ix_notificacion_archivada_usuario_fecha')
+
+    op.drop_table('notificacion_archivada')
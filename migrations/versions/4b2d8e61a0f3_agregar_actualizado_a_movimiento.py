@@ -0,0 +1,29 @@
+"""agregar actualizado a movimiento
+
+Revision ID: 4b2d8e61a0f3
+Revises: e81b5c6f0d27
+Create Date: 2026-10-17 14:05:18.226541
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4b2d8e61a0f3'
+down_revision = 'e81b5c6f0d27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('movimiento', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('actualizado', sa.DateTime(), nullable=True))
+
+    # Los movimientos existentes se consideran modificados en su fecha de creación
+    op.execute("UPDATE movimiento SET actualizado = fecha")
+
+
+def downgrade():
+    with op.batch_alter_table('movimiento', schema=None) as batch_op:
+        batch_op.drop_column('actualizado')
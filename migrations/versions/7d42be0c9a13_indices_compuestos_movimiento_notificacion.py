@@ -0,0 +1,42 @@
+"""indices compuestos en movimiento y notificacion
+
+Revision ID: 7d42be0c9a13
+Revises: c3f1a9d27e54
+Create Date: 2026-10-17 10:04:18.219604
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d42be0c9a13'
+down_revision = 'c3f1a9d27e54'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('movimiento', schema=None) as batch_op:
+        batch_op.create_index('ix_movimiento_tipo_estado_fecha', ['tipo', 'estado', 'fecha'], unique=False)
+        batch_op.create_index('ix_movimiento_solicitante_fecha', ['solicitado_por_id', 'fecha'], unique=False)
+        batch_op.create_index('ix_movimiento_solicitante_tipo_estado_material', ['solicitado_por_id', 'tipo', 'estado', 'material_id'], unique=False)
+        batch_op.create_index('ix_movimiento_material_id', ['material_id'], unique=False)
+        batch_op.create_index('ix_movimiento_fecha', ['fecha'], unique=False)
+
+    with op.batch_alter_table('notificacion', schema=None) as batch_op:
+        batch_op.create_index('ix_notificacion_usuario_leida_fecha', ['usuario_id', 'leida', 'fecha'], unique=False)
+        batch_op.create_index('ix_notificacion_usuario_fecha', ['usuario_id', 'fecha'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('notificacion', schema=None) as batch_op:
+        batch_op.drop_index('ix_notificacion_usuario_fecha')
+        batch_op.drop_index('ix_notificacion_usuario_leida_fecha')
+
+    with op.batch_alter_table('movimiento', schema=None) as batch_op:
+        batch_op.drop_index('ix_movimiento_fecha')
+        batch_op.drop_index('ix_movimiento_material_id')
+        batch_op.drop_index('ix_movimiento_solicitante_tipo_estado_material')
+        batch_op.drop_index('ix_movimiento_solicitante_fecha')
+        batch_op.drop_index('ix_movimiento_tipo_estado_fecha')
@@ -0,0 +1,28 @@
+"""crear version cache
+
+Revision ID: 8e4a1c7b2d96
+Revises: 3f9c2d7e8a15
+Create Date: 2026-10-17 23:41:09.532107
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e4a1c7b2d96'
+down_revision = '3f9c2d7e8a15'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('version_cache',
+    sa.Column('nombre', sa.String(length=50), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('nombre')
+    )
+
+
+def downgrade():
+    op.drop_table('version_cache')
@@ -0,0 +1,66 @@
+"""indice de busqueda de materiales (FTS5 / pg_trgm)
+
+Revision ID: 9a4c61e2f7b8
+Revises: 4b2d8e61a0f3
+Create Date: 2026-10-17 15:22:40.118392
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a4c61e2f7b8'
+down_revision = '4b2d8e61a0f3'
+branch_labels = None
+depends_on = None
+
+
+# Copia de busqueda.SQL_FTS_SQLITE / SQL_TRGM_POSTGRES en el momento de la migración
+SQL_FTS_SQLITE = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS material_fts USING fts5(
+        codigo, nombre, descripcion, unidad,
+        content='material', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS material_fts_insert AFTER INSERT ON material BEGIN
+        INSERT INTO material_fts(rowid, codigo, nombre, descripcion, unidad)
+        VALUES (new.id, new.codigo, new.nombre, new.descripcion, new.unidad);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS material_fts_delete AFTER DELETE ON material BEGIN
+        INSERT INTO material_fts(material_fts, rowid, codigo, nombre, descripcion, unidad)
+        VALUES ('delete', old.id, old.codigo, old.nombre, old.descripcion, old.unidad);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS material_fts_update AFTER UPDATE OF codigo, nombre, descripcion, unidad ON material BEGIN
+        INSERT INTO material_fts(material_fts, rowid, codigo, nombre, descripcion, unidad)
+        VALUES ('delete', old.id, old.codigo, old.nombre, old.descripcion, old.unidad);
+        INSERT INTO material_fts(rowid, codigo, nombre, descripcion, unidad)
+        VALUES (new.id, new.codigo, new.nombre, new.descripcion, new.unidad);
+    END""",
+    # Indexar los materiales existentes
+    "INSERT INTO material_fts(material_fts) VALUES ('rebuild')",
+]
+
+COLUMNAS_TRGM = ('codigo', 'nombre', 'descripcion', 'unidad')
+
+
+def upgrade():
+    dialecto = op.get_bind().dialect.name
+    if dialecto == 'sqlite':
+        for sql in SQL_FTS_SQLITE:
+            op.execute(sql)
+    elif dialecto == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for columna in COLUMNAS_TRGM:
+            op.execute(f'CREATE INDEX IF NOT EXISTS ix_material_{columna}_trgm ON material USING gin ({columna} gin_trgm_ops)')
+
+
+def downgrade():
+    dialecto = op.get_bind().dialect.name
+    if dialecto == 'sqlite':
+        for trigger in ('material_fts_insert', 'material_fts_delete', 'material_fts_update'):
+            op.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+        op.execute('DROP TABLE IF EXISTS material_fts')
+    elif dialecto == 'postgresql':
+        for columna in COLUMNAS_TRGM:
+            op.execute(f'DROP INDEX IF EXISTS ix_material_{columna}_trgm')
@@ -0,0 +1,45 @@
+"""crear tablas de tareas periodicas
+
+Revision ID: b7e31f0a9c42
+Revises: 0c6e9a3d5b17
+Create Date: 2026-10-17 22:10:18.395027
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e31f0a9c42'
+down_revision = '0c6e9a3d5b17'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('tarea_programada',
+    sa.Column('nombre', sa.String(length=50), nullable=False),
+    sa.Column('proxima', sa.DateTime(), nullable=False),
+    sa.Column('bloqueada_hasta', sa.DateTime(), nullable=True),
+    sa.Column('bloqueada_por', sa.String(length=100), nullable=True),
+    sa.PrimaryKeyConstraint('nombre')
+    )
+    op.create_table('ejecucion_tarea',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('tarea', sa.String(length=50), nullable=False),
+    sa.Column('inicio', sa.DateTime(), nullable=False),
+    sa.Column('duracion', sa.Float(), nullable=False),
+    sa.Column('estado', sa.String(length=10), nullable=False),
+    sa.Column('detalle', sa.String(length=500), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('ejecucion_tarea', schema=None) as batch_op:
+        batch_op.create_index('ix_ejecucion_tarea_tarea_inicio', ['tarea', 'inicio'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('ejecucion_tarea', schema=None) as batch_op:
+        batch_op.drop_index('ix_ejecucion_tarea_tarea_inicio')
+
+    op.drop_table('ejecucion_tarea')
+    op.drop_table('tarea_programada')
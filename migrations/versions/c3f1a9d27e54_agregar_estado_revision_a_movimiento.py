@@ -0,0 +1,53 @@
+"""agregar estado_revision a movimiento
+
+Revision ID: c3f1a9d27e54
+Revises: 51b7b98f23dd
+Create Date: 2026-10-17 09:12:41.532870
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3f1a9d27e54'
+down_revision = '51b7b98f23dd'
+branch_labels = None
+depends_on = None
+
+
+# Texto que actualizar_estado_en_observacion agregaba a la observación -> nuevo estado
+ESTADOS_DESDE_OBSERVACION = [
+    ('estado: en revisión en ferretería', 'EN_FERRETERIA'),
+    ('estado: aprobado por ferretería', 'APROBADO_FERRETERIA'),
+    ('estado: rechazado por ferretería', 'RECHAZADO_FERRETERIA'),
+    ('estado: movido a materiales sin uso', 'SIN_USO'),
+    ('estado: retornado a stock', 'RETORNADO_STOCK'),
+]
+
+
+def upgrade():
+    with op.batch_alter_table('movimiento', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('estado_revision', sa.String(length=30), nullable=True))
+        batch_op.create_index(batch_op.f('ix_movimiento_estado_revision'), ['estado_revision'], unique=False)
+
+    # Backfill a partir del texto de la observación del almacenista
+    movimiento = sa.table(
+        'movimiento',
+        sa.column('tipo', sa.String),
+        sa.column('observacion_almacenista', sa.Text),
+        sa.column('estado_revision', sa.String),
+    )
+    for texto, estado in ESTADOS_DESDE_OBSERVACION:
+        op.execute(
+            movimiento.update()
+            .where(movimiento.c.tipo == 'DEVOLUCION')
+            .where(sa.func.lower(movimiento.c.observacion_almacenista).like(f'%{texto}%'))
+            .values(estado_revision=estado)
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('movimiento', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_movimiento_estado_revision'))
+        batch_op.drop_column('estado_revision')
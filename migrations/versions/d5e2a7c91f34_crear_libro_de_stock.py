@@ -0,0 +1,66 @@
+"""crear libro de stock
+
+Revision ID: d5e2a7c91f34
+Revises: 9a4c61e2f7b8
+Create Date: 2026-10-17 18:42:10.503127
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from datetime import datetime
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5e2a7c91f34'
+down_revision = '9a4c61e2f7b8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('asiento_stock',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('material_id', sa.Integer(), nullable=False),
+    sa.Column('cantidad', sa.Float(), nullable=False),
+    sa.Column('origen', sa.String(length=20), nullable=False),
+    sa.Column('movimiento_id', sa.Integer(), nullable=True),
+    sa.Column('usuario_id', sa.Integer(), nullable=True),
+    sa.Column('fecha', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['material_id'], ['material.id'], name='fk_asiento_material'),
+    sa.ForeignKeyConstraint(['movimiento_id'], ['movimiento.id'], name='fk_asiento_movimiento', ondelete='SET NULL'),
+    sa.ForeignKeyConstraint(['usuario_id'], ['user.id'], name='fk_asiento_usuario'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('asiento_stock', schema=None) as batch_op:
+        batch_op.create_index('ix_asiento_stock_material_fecha', ['material_id', 'fecha'], unique=False)
+        batch_op.create_index(batch_op.f('ix_asiento_stock_fecha'), ['fecha'], unique=False)
+
+    op.create_table('corte_stock',
+    sa.Column('hasta_asiento_id', sa.Integer(), nullable=False),
+    sa.Column('material_id', sa.Integer(), nullable=False),
+    sa.Column('fecha', sa.DateTime(), nullable=False),
+    sa.Column('stock', sa.Float(), nullable=False),
+    sa.ForeignKeyConstraint(['material_id'], ['material.id'], name='fk_corte_material'),
+    sa.PrimaryKeyConstraint('hasta_asiento_id', 'material_id')
+    )
+    with op.batch_alter_table('corte_stock', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_corte_stock_fecha'), ['fecha'], unique=False)
+
+    # El stock actual de cada material abre el libro
+    op.get_bind().execute(sa.text("""
+        INSERT INTO asiento_stock (material_id, cantidad, origen, fecha)
+        SELECT id, stock, 'INICIAL', :fecha FROM material
+        WHERE stock IS NOT NULL AND stock <> 0
+    """), {'fecha': datetime.utcnow()})
+
+
+def downgrade():
+    with op.batch_alter_table('corte_stock', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_corte_stock_fecha'))
+
+    op.drop_table('corte_stock')
+    with op.batch_alter_table('asiento_stock', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_asiento_stock_fecha'))
+        batch_op.drop_index('ix_asiento_stock_material_fecha')
+
+    op.drop_table('asiento_stock')
@@ -0,0 +1,45 @@
+"""crear tabla saldo_ingeniero
+
+Revision ID: e81b5c6f0d27
+Revises: 7d42be0c9a13
+Create Date: 2026-10-17 11:37:52.804113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e81b5c6f0d27'
+down_revision = '7d42be0c9a13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('saldo_ingeniero',
+    sa.Column('usuario_id', sa.Integer(), nullable=False),
+    sa.Column('material_id', sa.Integer(), nullable=False),
+    sa.Column('retirado', sa.Float(), nullable=False),
+    sa.Column('devuelto', sa.Float(), nullable=False),
+    sa.Column('pendiente', sa.Float(), nullable=False),
+    sa.ForeignKeyConstraint(['material_id'], ['material.id'], name='fk_saldo_material'),
+    sa.ForeignKeyConstraint(['usuario_id'], ['user.id'], name='fk_saldo_usuario'),
+    sa.PrimaryKeyConstraint('usuario_id', 'material_id')
+    )
+
+    # Cargar los saldos a partir del historial existente
+    op.execute("""
+        INSERT INTO saldo_ingeniero (usuario_id, material_id, retirado, devuelto, pendiente)
+        SELECT solicitado_por_id, material_id,
+               SUM(CASE WHEN tipo = 'SALIDA' AND estado = 'AUTORIZADO' THEN cantidad ELSE 0 END),
+               SUM(CASE WHEN tipo = 'DEVOLUCION' AND estado = 'AUTORIZADO' THEN cantidad ELSE 0 END),
+               SUM(CASE WHEN tipo = 'DEVOLUCION' AND estado = 'PENDIENTE' THEN cantidad ELSE 0 END)
+        FROM movimiento
+        WHERE tipo IN ('SALIDA', 'DEVOLUCION') AND estado IN ('AUTORIZADO', 'PENDIENTE')
+        GROUP BY solicitado_por_id, material_id
+    """)
+
+
+def downgrade():
+    op.drop_table('saldo_ingeniero')
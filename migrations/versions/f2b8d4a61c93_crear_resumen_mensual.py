@@ -0,0 +1,55 @@
+"""crear resumen mensual
+
+Revision ID: f2b8d4a61c93
+Revises: d5e2a7c91f34
+Create Date: 2026-10-17 20:15:37.264918
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from collections import defaultdict
+import pytz
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2b8d4a61c93'
+down_revision = 'd5e2a7c91f34'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    resumen = op.create_table('resumen_mensual',
+    sa.Column('anio', sa.Integer(), nullable=False),
+    sa.Column('mes', sa.Integer(), nullable=False),
+    sa.Column('material_id', sa.Integer(), nullable=False),
+    sa.Column('tipo', sa.String(length=20), nullable=False),
+    sa.Column('estado', sa.String(length=20), nullable=False),
+    sa.Column('movimientos', sa.Integer(), nullable=False),
+    sa.Column('cantidad', sa.Float(), nullable=False),
+    sa.ForeignKeyConstraint(['material_id'], ['material.id'], name='fk_resumen_material'),
+    sa.PrimaryKeyConstraint('anio', 'mes', 'material_id', 'tipo', 'estado')
+    )
+
+    # Llenar con el historial existente (meses del calendario de Colombia)
+    zona = pytz.timezone('America/Bogota')
+    totales = defaultdict(lambda: [0, 0])
+    filas = op.get_bind().execute(sa.text(
+        'SELECT fecha, material_id, tipo, estado, cantidad FROM movimiento '
+        'WHERE fecha IS NOT NULL AND material_id IS NOT NULL AND tipo IS NOT NULL'
+    ).columns(fecha=sa.DateTime()))
+    for fecha, material_id, tipo, estado, cantidad in filas:
+        local = pytz.utc.localize(fecha).astimezone(zona)
+        total = totales[(local.year, local.month, material_id, tipo, estado or 'PENDIENTE')]
+        total[0] += 1
+        total[1] += cantidad or 0
+    if totales:
+        op.bulk_insert(resumen, [
+            {'anio': anio, 'mes': mes, 'material_id': material_id, 'tipo': tipo, 'estado': estado,
+             'movimientos': movimientos, 'cantidad': cantidad}
+            for (anio, mes, material_id, tipo, estado), (movimientos, cantidad) in totales.items()
+        ])
+
+
+def downgrade():
+    op.drop_table('resumen_mensual')
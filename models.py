@@ -37,8 +37,36 @@ class Material(db.Model):
         return f'<Material {self.nombre}>'
 
 
+# Estados del ciclo de revisión de una devolución ya autorizada.
+# NULL significa que el almacenista aún no la ha revisado.
+REVISION_EN_FERRETERIA = 'EN_FERRETERIA'
+REVISION_APROBADO_FERRETERIA = 'APROBADO_FERRETERIA'
+REVISION_RECHAZADO_FERRETERIA = 'RECHAZADO_FERRETERIA'
+REVISION_SIN_USO = 'SIN_USO'
+REVISION_RETORNADO_STOCK = 'RETORNADO_STOCK'
+
+# Texto que se agrega a observacion_almacenista para cada estado
+ETIQUETAS_REVISION = {
+    REVISION_EN_FERRETERIA: 'En revisión en ferretería',
+    REVISION_APROBADO_FERRETERIA: 'Aprobado por ferretería',
+    REVISION_RECHAZADO_FERRETERIA: 'Rechazado por ferretería',
+    REVISION_SIN_USO: 'Movido a materiales sin uso',
+    REVISION_RETORNADO_STOCK: 'Retornado a stock',
+}
+
+
 class Movimiento(db.Model):
     __tablename__ = 'movimiento'
+    __table_args__ = (
+        # Bandejas del almacenista y contadores: filter_by(tipo=..., estado=...) ordenado por fecha
+        db.Index('ix_movimiento_tipo_estado_fecha', 'tipo', 'estado', 'fecha'),
+        # Historial por ingeniero ordenado por fecha desc
+        db.Index('ix_movimiento_solicitante_fecha', 'solicitado_por_id', 'fecha'),
+        # Saldos por ingeniero y material (retirado / devuelto / pendiente)
+        db.Index('ix_movimiento_solicitante_tipo_estado_material', 'solicitado_por_id', 'tipo', 'estado', 'material_id'),
+        db.Index('ix_movimiento_material_id', 'material_id'),
+        db.Index('ix_movimiento_fecha', 'fecha'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
 
@@ -61,13 +89,109 @@ class Movimiento(db.Model):
     evidencia = db.Column(db.String(200))
     evidencia_almacenista = db.Column(db.String(200))
     visible_en_existencias = db.Column(db.Boolean, default=True)
+    estado_revision = db.Column(db.String(30), nullable=True, index=True)
+    # Última modificación (clave de los reportes PDF en caché)
+    actualizado = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     def __repr__(self):
         return f'<Movimiento {self.tipo} de {self.cantidad}>'
 
+
+
+class SaldoIngeniero(db.Model):
+    """Saldo materializado de un material en poder de un ingeniero"""
+    __tablename__ = 'saldo_ingeniero'
+
+    usuario_id = db.Column(db.Integer, db.ForeignKey('user.id', name='fk_saldo_usuario'), primary_key=True)
+    material_id = db.Column(db.Integer, db.ForeignKey('material.id', name='fk_saldo_material'), primary_key=True)
+    retirado = db.Column(db.Float, nullable=False, default=0)
+    devuelto = db.Column(db.Float, nullable=False, default=0)
+    pendiente = db.Column(db.Float, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<SaldoIngeniero {self.usuario_id}/{self.material_id}>'
+
+
+class ResumenMensual(db.Model):
+    """Movimientos y cantidad por mes (calendario de Colombia), material, tipo y estado"""
+    __tablename__ = 'resumen_mensual'
+
+    anio = db.Column(db.Integer, primary_key=True)
+    mes = db.Column(db.Integer, primary_key=True)
+    material_id = db.Column(db.Integer, db.ForeignKey('material.id', name='fk_resumen_material'), primary_key=True)
+    tipo = db.Column(db.String(20), primary_key=True)
+    estado = db.Column(db.String(20), primary_key=True)
+    movimientos = db.Column(db.Integer, nullable=False, default=0)
+    cantidad = db.Column(db.Float, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<ResumenMensual {self.anio}-{self.mes} {self.material_id} {self.tipo}/{self.estado}>'
+
+
+class PronosticoMaterial(db.Model):
+    """Consumo estimado y reposición sugerida de un material (lo calcula `flask calcular-pronosticos`)"""
+    __tablename__ = 'pronostico_material'
+
+    material_id = db.Column(db.Integer, db.ForeignKey('material.id', name='fk_pronostico_material'), primary_key=True)
+    consumo_promedio = db.Column(db.Float, nullable=False, default=0)   # por día, media de la ventana
+    consumo_diario = db.Column(db.Float, nullable=False, default=0)     # por día, suavizado exponencial
+    stock = db.Column(db.Float, nullable=False, default=0)              # stock al calcular
+    dias_hasta_agotar = db.Column(db.Float, nullable=True, index=True)  # None si no hay consumo
+    cantidad_sugerida = db.Column(db.Float, nullable=False, default=0)
+    calculado = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f'<PronosticoMaterial {self.material_id}>'
+
+
+# Origen de cada cambio de stock registrado en el libro
+ORIGEN_INICIAL = 'INICIAL'          # stock que ya existía al crear el libro
+ORIGEN_ALTA = 'ALTA'                # material creado o reactivado
+ORIGEN_AUTORIZACION = 'AUTORIZACION'
+ORIGEN_RETORNO = 'RETORNO'          # devolución retornada a stock
+ORIGEN_AJUSTE = 'AJUSTE'            # edición manual del stock
+ORIGEN_IMPORTACION = 'IMPORTACION'
+
+
+class AsientoStock(db.Model):
+    """Cambio de stock de un material. Solo se insertan filas, nunca se modifican"""
+    __tablename__ = 'asiento_stock'
+    __table_args__ = (
+        db.Index('ix_asiento_stock_material_fecha', 'material_id', 'fecha'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    material_id = db.Column(db.Integer, db.ForeignKey('material.id', name='fk_asiento_material'), nullable=False)
+    cantidad = db.Column(db.Float, nullable=False)  # positiva entra, negativa sale
+    origen = db.Column(db.String(20), nullable=False)
+    movimiento_id = db.Column(db.Integer, db.ForeignKey('movimiento.id', name='fk_asiento_movimiento', ondelete='SET NULL'))
+    usuario_id = db.Column(db.Integer, db.ForeignKey('user.id', name='fk_asiento_usuario'))
+    fecha = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+    def __repr__(self):
+        return f'<AsientoStock {self.origen} {self.cantidad} de {self.material_id}>'
+
+
+class CorteStock(db.Model):
+    """Stock de cada material que resulta de sumar los asientos hasta hasta_asiento_id"""
+    __tablename__ = 'corte_stock'
+
+    hasta_asiento_id = db.Column(db.Integer, primary_key=True)
+    material_id = db.Column(db.Integer, db.ForeignKey('material.id', name='fk_corte_material'), primary_key=True)
+    fecha = db.Column(db.DateTime, nullable=False, index=True)
+    stock = db.Column(db.Float, nullable=False)
+
+    def __repr__(self):
+        return f'<CorteStock {self.hasta_asiento_id}/{self.material_id}>'
+
     
 class Notificacion(db.Model):
     __tablename__ = 'notificacion'
+    __table_args__ = (
+        # No leídas del usuario y últimas notificaciones del usuario
+        db.Index('ix_notificacion_usuario_leida_fecha', 'usuario_id', 'leida', 'fecha'),
+        db.Index('ix_notificacion_usuario_fecha', 'usuario_id', 'fecha'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     mensaje = db.Column(db.String(300), nullable=False)
@@ -80,4 +204,61 @@ class Notificacion(db.Model):
     usuario = db.relationship('User', backref='notificaciones')
 
     def __repr__(self):
-        return f'<Notificacion {self.nivel}> - {self.usuario.nombre}>'
\ No newline at end of file
+        return f'<Notificacion {self.nivel}> - {self.usuario.nombre}>'
+
+
+class NotificacionArchivada(db.Model):
+    """Notificación leída antigua, fuera de la tabla que se consulta en cada página"""
+    __tablename__ = 'notificacion_archivada'
+    __table_args__ = (
+        db.Index('ix_notificacion_archivada_usuario_fecha', 'usuario_id', 'fecha'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)  # el mismo id que tenía en notificacion
+    usuario_id = db.Column(db.Integer, db.ForeignKey('user.id', name='fk_notificacion_archivada_usuario'), nullable=False)
+    mensaje = db.Column(db.String(300), nullable=False)
+    nivel = db.Column(db.String(10), nullable=False)
+    fecha = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f'<NotificacionArchivada {self.id}>'
+
+class TareaProgramada(db.Model):
+    """Próxima ejecución y bloqueo de una tarea periódica (ver tareas.py)"""
+    __tablename__ = 'tarea_programada'
+
+    nombre = db.Column(db.String(50), primary_key=True)
+    proxima = db.Column(db.DateTime, nullable=False)
+    bloqueada_hasta = db.Column(db.DateTime, nullable=True)
+    bloqueada_por = db.Column(db.String(100), nullable=True)
+
+    def __repr__(self):
+        return f'<TareaProgramada {self.nombre}>'
+
+
+class EjecucionTarea(db.Model):
+    __tablename__ = 'ejecucion_tarea'
+    __table_args__ = (
+        db.Index('ix_ejecucion_tarea_tarea_inicio', 'tarea', 'inicio'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    tarea = db.Column(db.String(50), nullable=False)
+    inicio = db.Column(db.DateTime, nullable=False)
+    duracion = db.Column(db.Float, nullable=False)  # segundos
+    estado = db.Column(db.String(10), nullable=False)
+    detalle = db.Column(db.String(500))
+
+    def __repr__(self):
+        return f'<EjecucionTarea {self.tarea} {self.estado}>'
+
+
+class VersionCache(db.Model):
+    """Se incrementa al confirmar cambios de inventario; cada worker compara su caché con ella"""
+    __tablename__ = 'version_cache'
+
+    nombre = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<VersionCache {self.nombre} {self.version}>'
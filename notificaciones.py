@@ -0,0 +1,64 @@
+# notificaciones.py
+
+from models import db, Notificacion, NotificacionArchivada
+from sqlalchemy import insert, func
+from datetime import datetime, timedelta
+
+# -----------------------------
+# BANDEJA DE NOTIFICACIONES
+# -----------------------------
+# Cada página muestra el número de no leídas (COUNT sobre el índice
+# usuario/leida/fecha) y solo las últimas `maximo`, nunca la bandeja completa.
+NOTIFICACIONES_MAXIMO = 10
+
+def contar_no_leidas(usuario_id):
+    return db.session.query(func.count(Notificacion.id)).filter(
+        Notificacion.usuario_id == usuario_id,
+        Notificacion.leida == False
+    ).scalar()
+
+def ultimas_notificaciones(usuario_id, maximo=NOTIFICACIONES_MAXIMO, solo_no_leidas=False):
+    consulta = Notificacion.query.filter(Notificacion.usuario_id == usuario_id)
+    if solo_no_leidas:
+        consulta = consulta.filter(Notificacion.leida == False)
+    return consulta.order_by(Notificacion.fecha.desc()).limit(maximo).all()
+
+def marcar_leidas(usuario_id):
+    return Notificacion.query.filter(
+        Notificacion.usuario_id == usuario_id,
+        Notificacion.leida == False
+    ).update({'leida': True}, synchronize_session=False)
+
+# -----------------------------
+# ARCHIVO
+# -----------------------------
+# Las notificaciones leídas con más de `dias` pasan a notificacion_archivada
+# (sin la columna leida ni relaciones) por lotes, cada uno en su transacción,
+# para que la tabla que se consulta en cada página no crezca sin límite. Las
+# no leídas nunca se archivan.
+TAMANO_LOTE_ARCHIVO = 1000
+
+def archivar_notificaciones(dias, tamano_lote=TAMANO_LOTE_ARCHIVO):
+    """Mueve al archivo las leídas más antiguas que `dias`. Devuelve cuántas"""
+    limite = datetime.utcnow() - timedelta(days=dias)
+    columnas = ('id', 'usuario_id', 'mensaje', 'nivel', 'fecha')
+    archivadas = 0
+    while True:
+        ids = [i for (i,) in db.session.query(Notificacion.id).filter(
+            Notificacion.leida == True,
+            Notificacion.fecha < limite
+        ).order_by(Notificacion.id).limit(tamano_lote)]
+        if not ids:
+            return archivadas
+        db.session.execute(insert(NotificacionArchivada.__table__).from_select(
+            columnas,
+            db.session.query(*(getattr(Notificacion, c) for c in columnas)).filter(Notificacion.id.in_(ids))
+        ))
+        Notificacion.query.filter(Notificacion.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        archivadas += len(ids)
+
+def purgar_archivo(dias):
+    """Borra del archivo las notificaciones más antiguas que `dias`"""
+    limite = datetime.utcnow() - timedelta(days=dias)
+    return NotificacionArchivada.query.filter(NotificacionArchivada.fecha < limite).delete(synchronize_session=False)
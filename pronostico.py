@@ -0,0 +1,109 @@
+# pronostico.py
+
+from models import db, Material, Movimiento, PronosticoMaterial
+from utils import obtener_cacheado
+from sqlalchemy import insert
+from collections import namedtuple
+from datetime import datetime, timedelta
+import math
+
+# -----------------------------
+# CONSUMO Y REPOSICIÓN
+# -----------------------------
+# El consumo de cada material sale de sus retiros autorizados (SALIDA /
+# AUTORIZADO) de las últimas VENTANA_SEMANAS semanas, agrupados por semana.
+# Con esa serie se calcula la media y un suavizado exponencial (da más peso a
+# las semanas recientes), los días hasta agotar el stock y la cantidad a pedir
+# para cubrir el tiempo de reposición más DIAS_COBERTURA sin bajar del mínimo.
+# El cálculo es un trabajo por lotes (`flask calcular-pronosticos`) que guarda
+# el resultado en pronostico_material; el dashboard solo lee esa tabla.
+VENTANA_SEMANAS = 12
+ALFA_SUAVIZADO = 0.3
+DIAS_REPOSICION = 7     # lo que tarda en llegar un pedido
+DIAS_COBERTURA = 30     # días de consumo que debe cubrir el pedido
+TAMANO_LECTURA = 1000
+SUGERENCIAS_EN_PANEL = 8
+
+def consumo_semanal(ahora):
+    """{material_id: [cantidad por semana]} de la más antigua a la más reciente"""
+    desde = ahora - timedelta(weeks=VENTANA_SEMANAS)
+    filas = db.session.query(Movimiento.material_id, Movimiento.fecha, Movimiento.cantidad).filter(
+        Movimiento.tipo == 'SALIDA',
+        Movimiento.estado == 'AUTORIZADO',
+        Movimiento.fecha > desde,
+        Movimiento.fecha < ahora
+    )
+    semanas = {}
+    for material_id, fecha, cantidad in filas.yield_per(TAMANO_LECTURA):
+        serie = semanas.setdefault(material_id, [0.0] * VENTANA_SEMANAS)
+        serie[VENTANA_SEMANAS - 1 - (ahora - fecha).days // 7] += cantidad or 0
+    return semanas
+
+def suavizado_exponencial(serie, alfa=ALFA_SUAVIZADO):
+    # Parte de la media para que una semana inicial atípica no domine
+    nivel = sum(serie) / len(serie)
+    for valor in serie:
+        nivel = alfa * valor + (1 - alfa) * nivel
+    return nivel
+
+def pronosticar(serie, stock, stock_minimo):
+    """(consumo_promedio, consumo_diario, dias_hasta_agotar, cantidad_sugerida)"""
+    stock = max(stock or 0, 0)
+    promedio = sum(serie) / (len(serie) * 7)
+    diario = suavizado_exponencial(serie) / 7
+    dias = stock / diario if diario > 0 else None
+    objetivo = diario * (DIAS_REPOSICION + DIAS_COBERTURA) + (stock_minimo or 0)
+    sugerida = math.ceil(objetivo - stock) if objetivo > stock else 0
+    return promedio, diario, dias, sugerida
+
+def calcular_pronosticos(ahora=None):
+    """Recalcula pronostico_material para todos los materiales activos. Devuelve cuántos"""
+    ahora = ahora or datetime.utcnow()
+    semanas = consumo_semanal(ahora)
+    sin_consumo = [0.0] * VENTANA_SEMANAS
+    filas = []
+    for material_id, stock, stock_minimo in db.session.query(Material.id, Material.stock, Material.stock_minimo).filter(
+        Material.activo == True
+    ):
+        promedio, diario, dias, sugerida = pronosticar(semanas.get(material_id, sin_consumo), stock, stock_minimo)
+        filas.append({
+            'material_id': material_id,
+            'consumo_promedio': promedio,
+            'consumo_diario': diario,
+            'stock': stock or 0,
+            'dias_hasta_agotar': dias,
+            'cantidad_sugerida': sugerida,
+            'calculado': ahora
+        })
+
+    PronosticoMaterial.query.delete(synchronize_session=False)
+    if filas:
+        db.session.execute(insert(PronosticoMaterial.__table__), filas)
+    db.session.commit()
+    return len(filas)
+
+# -----------------------------
+# SUGERENCIAS PARA EL DASHBOARD
+# -----------------------------
+SugerenciaReposicion = namedtuple('SugerenciaReposicion', [
+    'id', 'nombre', 'unidad', 'stock', 'consumo_diario', 'dias_hasta_agotar', 'cantidad_sugerida', 'calculado'
+])
+
+def obtener_sugerencias_reposicion(limite=SUGERENCIAS_EN_PANEL):
+    """Materiales con pedido sugerido, los que se agotan antes primero"""
+    filas = db.session.query(
+        Material.id, Material.nombre, Material.unidad, PronosticoMaterial.stock,
+        PronosticoMaterial.consumo_diario, PronosticoMaterial.dias_hasta_agotar,
+        PronosticoMaterial.cantidad_sugerida, PronosticoMaterial.calculado
+    ).select_from(PronosticoMaterial).join(Material).filter(
+        Material.activo == True,
+        PronosticoMaterial.cantidad_sugerida > 0
+    ).order_by(
+        PronosticoMaterial.dias_hasta_agotar.is_(None),
+        PronosticoMaterial.dias_hasta_agotar,
+        Material.nombre
+    ).limit(limite)
+    return [SugerenciaReposicion(*fila) for fila in filas]
+
+def obtener_sugerencias_reposicion_cacheado():
+    return obtener_cacheado('sugerencias_reposicion', obtener_sugerencias_reposicion)
@@ -0,0 +1,204 @@
+# reportes_pdf.py
+
+from models import db, Movimiento
+from sqlalchemy import func
+from archivos import generar_variante, VARIANTES
+from resumenes import mes_de
+from datetime import datetime
+import subprocess
+import threading
+import queue
+import sys
+import hashlib
+import pathlib
+import json
+import glob
+import os
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+
+# -----------------------------
+# GENERACIÓN DE PDF FUERA DEL WORKER
+# -----------------------------
+# WeasyPrint usa CPU durante segundos; si se ejecuta dentro del worker eventlet
+# bloquea todas las peticiones y sockets. Cada reporte se renderiza en un proceso
+# aparte (python -m reportes_pdf) y el resultado queda en disco, así cualquier
+# worker puede servirlo. Unos pocos hilos limitan los procesos simultáneos.
+VERSION_REPORTE = 2  # subir al cambiar la plantilla del PDF para invalidar la caché
+
+ESTADO_PENDIENTE = 'pendiente'
+ESTADO_LISTO = 'listo'
+ESTADO_ERROR = 'error'
+
+_cola = queue.Queue()
+_hilos = []
+_hilos_lock = threading.Lock()
+_en_curso = set()
+
+def _iniciar_hilos(procesos):
+    with _hilos_lock:
+        while len(_hilos) < procesos:
+            hilo = threading.Thread(target=_atender_cola, daemon=True)
+            hilo.start()
+            _hilos.append(hilo)
+
+def _atender_cola():
+    while True:
+        clave, trabajo, destino = _cola.get()
+        ruta_trabajo = f'{destino}.{os.getpid()}.json'
+        try:
+            with open(ruta_trabajo, 'w', encoding='utf-8') as f:
+                json.dump(trabajo, f)
+            proceso = subprocess.run(
+                [sys.executable, '-m', 'reportes_pdf', ruta_trabajo, destino],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                capture_output=True, text=True
+            )
+            if proceso.returncode != 0 and not os.path.exists(_ruta_error(destino)):
+                with open(_ruta_error(destino), 'w', encoding='utf-8') as f:
+                    f.write(proceso.stderr)
+        except Exception as e:
+            print(f"Error al generar el reporte {clave}: {e}")
+        finally:
+            if os.path.exists(ruta_trabajo):
+                os.remove(ruta_trabajo)
+            _en_curso.discard(clave)
+
+def _escribir_pdf(trabajo, destino):
+    """Se ejecuta en el proceso hijo. Escribe el PDF o un archivo .error"""
+    # Temporal propio del proceso: otro worker o el programador pueden estar
+    # generando la misma clave a la vez
+    temporal = f'{destino}.{os.getpid()}.tmp'
+    try:
+        from weasyprint import HTML
+        # Variantes 'pdf' que el worker de subidas aún no haya generado
+        for original, miniatura in trabajo['miniaturas']:
+            generar_variante(original, miniatura, VARIANTES['pdf'])
+        HTML(string=trabajo['html'], url_fetcher=url_fetcher_restringido(trabajo['raices'])).write_pdf(temporal)
+        os.replace(temporal, destino)
+    except Exception as e:
+        with open(_ruta_error(destino), 'w', encoding='utf-8') as f:
+            f.write(str(e))
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        raise
+
+def _ruta_error(destino):
+    return destino[:-len('.pdf')] + '.error'
+
+# -----------------------------
+# CLAVE DEL REPORTE
+# -----------------------------
+def clave_reporte(usuario):
+    """
+    Cambia cuando el ingeniero tiene un movimiento nuevo, modificado o borrado,
+    cuando cambia su nombre o al empezar un mes (la portada lleva el mes y
+    la fecha de generación). Formato: <usuario_id>_<hash>.
+    """
+    ultimo, total = db.session.query(
+        func.max(Movimiento.actualizado), func.count(Movimiento.id)
+    ).filter(Movimiento.solicitado_por_id == usuario.id).one()
+
+    anio, mes = mes_de(datetime.utcnow())
+    huella = f'{VERSION_REPORTE}|{anio}-{mes:02d}|{usuario.nombre}|{ultimo.isoformat() if ultimo else "-"}|{total}'
+    return f'{usuario.id}_{hashlib.sha256(huella.encode("utf-8")).hexdigest()[:20]}'
+
+def clave_pertenece(clave, usuario_id):
+    prefijo, _, huella = clave.partition('_')
+    return prefijo == str(usuario_id) and len(huella) == 20 and all(c in '0123456789abcdef' for c in huella)
+
+def ruta_reporte(carpeta, clave):
+    return os.path.join(carpeta, f'{clave}.pdf')
+
+# -----------------------------
+# TRABAJOS
+# -----------------------------
+def estado_reporte(carpeta, clave):
+    destino = ruta_reporte(carpeta, clave)
+    if os.path.exists(destino):
+        return ESTADO_LISTO
+    if os.path.exists(_ruta_error(destino)):
+        return ESTADO_ERROR
+    return ESTADO_PENDIENTE
+
+def encolar_reporte(carpeta, clave, html, raices, miniaturas=(), procesos=2):
+    """
+    Encola el render si el PDF no está en caché ni en curso.
+    raices: carpetas de las que WeasyPrint puede leer archivos.
+    miniaturas: pares (original, miniatura) a generar antes del render.
+    """
+    destino = ruta_reporte(carpeta, clave)
+    if os.path.exists(destino) or clave in _en_curso:
+        return
+
+    # Un reintento después de un error vuelve a generar
+    if os.path.exists(_ruta_error(destino)):
+        os.remove(_ruta_error(destino))
+
+    _iniciar_hilos(procesos)
+    _en_curso.add(clave)
+    trabajo = {
+        'html': html,
+        'raices': [os.path.realpath(r) for r in raices],
+        'miniaturas': [list(par) for par in miniaturas]
+    }
+    _cola.put((clave, trabajo, destino))
+
+    _borrar_reportes_anteriores(carpeta, clave)
+
+def generar_reporte(carpeta, clave, html, raices, miniaturas=()):
+    """Render síncrono (para procesos que no atienden peticiones, p. ej. el programador de tareas)"""
+    destino = ruta_reporte(carpeta, clave)
+    if os.path.exists(destino):
+        return
+    _escribir_pdf({
+        'html': html,
+        'raices': [os.path.realpath(r) for r in raices],
+        'miniaturas': [list(par) for par in miniaturas]
+    }, destino)
+    _borrar_reportes_anteriores(carpeta, clave)
+
+def _borrar_reportes_anteriores(carpeta, clave):
+    """
+    Los PDF (y .error) del mismo usuario con otra clave ya no se volverán a
+    servir. Los .json / .tmp no se tocan: pueden ser de un render en curso.
+    """
+    usuario_id = clave.partition('_')[0]
+    for extension in ('pdf', 'error'):
+        for ruta in glob.glob(os.path.join(carpeta, f'{usuario_id}_*.{extension}')):
+            if os.path.basename(ruta).startswith(f'{clave}.'):
+                continue
+            try:
+                os.remove(ruta)
+            except OSError:
+                pass
+
+# -----------------------------
+# RECURSOS DEL PDF
+# -----------------------------
+# Las imágenes se referencian por file:// en lugar de incrustarlas en base64;
+# WeasyPrint las lee una a una y solo dentro de las carpetas permitidas.
+def url_archivo(ruta):
+    return pathlib.Path(os.path.abspath(ruta)).as_uri()
+
+def url_fetcher_restringido(raices):
+    from weasyprint import default_url_fetcher
+
+    def fetcher(url, *args, **kwargs):
+        if url.startswith('data:'):
+            return default_url_fetcher(url, *args, **kwargs)
+        if not url.startswith('file:'):
+            raise ValueError(f'Recurso externo no permitido en el reporte: {url}')
+        ruta = os.path.realpath(url2pathname(urlparse(url).path))
+        if not any(ruta == raiz or ruta.startswith(raiz + os.sep) for raiz in raices):
+            raise ValueError(f'Ruta fuera de las carpetas permitidas: {ruta}')
+        return default_url_fetcher(url, *args, **kwargs)
+    return fetcher
+
+# -----------------------------
+# PROCESO HIJO
+# -----------------------------
+if __name__ == '__main__':
+    ruta_trabajo, destino = sys.argv[1:3]
+    with open(ruta_trabajo, encoding='utf-8') as f:
+        _escribir_pdf(json.load(f), destino)
@@ -0,0 +1,125 @@
+# resumenes.py
+
+from models import db, Movimiento, ResumenMensual
+from utils import inicio_del_dia_utc
+from inventario import sumar_en_fila
+from sqlalchemy import event, insert, inspect
+from sqlalchemy.orm import Session
+from collections import defaultdict
+from datetime import date
+import pytz
+
+# -----------------------------
+# RESÚMENES MENSUALES
+# -----------------------------
+# resumen_mensual acumula, por mes, material, tipo y estado, cuántos
+# movimientos hay y la cantidad total. Se mantiene en la misma transacción que
+# el movimiento (como los saldos de inventario) y se puede reconstruir desde el
+# historial con `flask reconstruir-resumenes`. Los meses son del calendario de
+# Colombia, igual que las fechas que se muestran.
+ZONA_REPORTES = pytz.timezone('America/Bogota')
+TAMANO_LECTURA = 1000
+
+def mes_de(fecha_utc):
+    local = pytz.utc.localize(fecha_utc).astimezone(ZONA_REPORTES)
+    return local.year, local.month
+
+def rango_del_mes(anio, mes):
+    """[inicio, fin) del mes en UTC, para filtrar Movimiento.fecha con el índice"""
+    siguiente = date(anio + 1, 1, 1) if mes == 12 else date(anio, mes + 1, 1)
+    return inicio_del_dia_utc(date(anio, mes, 1)), inicio_del_dia_utc(siguiente)
+
+def _clave(fecha, material_id, tipo, estado):
+    return (*mes_de(fecha), material_id, tipo, estado or 'PENDIENTE')
+
+def _acumular(deltas, fecha, material_id, tipo, estado, cantidad, signo):
+    if fecha is None or material_id is None or tipo is None:
+        return
+    clave = _clave(fecha, material_id, tipo, estado)
+    movimientos, total = deltas[clave]
+    deltas[clave] = (movimientos + signo, total + signo * (cantidad or 0))
+
+def _aplicar(conexion, deltas):
+    for (anio, mes, material_id, tipo, estado), (movimientos, cantidad) in deltas.items():
+        if not (movimientos or cantidad):
+            continue
+        sumar_en_fila(
+            conexion, ResumenMensual.__table__,
+            {'anio': anio, 'mes': mes, 'material_id': material_id, 'tipo': tipo, 'estado': estado},
+            {'movimientos': movimientos, 'cantidad': cantidad}
+        )
+
+# -----------------------------
+# MANTENIMIENTO EN LA MISMA TRANSACCIÓN
+# -----------------------------
+_CAMPOS_RESUMEN = ('fecha', 'material_id', 'tipo', 'estado', 'cantidad')
+
+def _conservar_valor_anterior(objetivo, valor, anterior, iniciador):
+    return valor
+
+for _campo in _CAMPOS_RESUMEN:
+    event.listen(getattr(Movimiento, _campo), 'set', _conservar_valor_anterior, active_history=True, retval=True)
+
+def _valores_anteriores(movimiento):
+    estado = inspect(movimiento)
+    return [(estado.attrs[c].history.deleted or estado.attrs[c].history.unchanged or [None])[0] for c in _CAMPOS_RESUMEN]
+
+@event.listens_for(Session, 'after_flush')
+def _actualizar_resumenes(sesion, flush_context):
+    deltas = defaultdict(lambda: (0, 0))
+    for obj in sesion.new:
+        if isinstance(obj, Movimiento):
+            _acumular(deltas, *(getattr(obj, c) for c in _CAMPOS_RESUMEN), +1)
+    for obj in sesion.deleted:
+        if isinstance(obj, Movimiento):
+            _acumular(deltas, *_valores_anteriores(obj), -1)
+    for obj in sesion.dirty:
+        if isinstance(obj, Movimiento) and any(inspect(obj).attrs[c].history.has_changes() for c in _CAMPOS_RESUMEN):
+            _acumular(deltas, *_valores_anteriores(obj), -1)
+            _acumular(deltas, *(getattr(obj, c) for c in _CAMPOS_RESUMEN), +1)
+    if deltas:
+        _aplicar(sesion.connection(), deltas)
+
+def descontar_de_resumenes(consulta):
+    """Resta el aporte de los movimientos de la consulta antes de un borrado masivo"""
+    deltas = defaultdict(lambda: (0, 0))
+    columnas = consulta.with_entities(*(getattr(Movimiento, c) for c in _CAMPOS_RESUMEN))
+    for fila in columnas.yield_per(TAMANO_LECTURA):
+        _acumular(deltas, *fila, -1)
+    _aplicar(db.session.connection(), deltas)
+
+# -----------------------------
+# RECONSTRUCCIÓN
+# -----------------------------
+def calcular_resumenes_desde_historial():
+    deltas = defaultdict(lambda: (0, 0))
+    columnas = db.session.query(*(getattr(Movimiento, c) for c in _CAMPOS_RESUMEN))
+    for fila in columnas.yield_per(TAMANO_LECTURA):
+        _acumular(deltas, *fila, +1)
+    return deltas
+
+def reconstruir_resumenes():
+    ResumenMensual.query.delete(synchronize_session=False)
+    resumenes = calcular_resumenes_desde_historial()
+    if resumenes:
+        db.session.execute(insert(ResumenMensual.__table__), [
+            {'anio': anio, 'mes': mes, 'material_id': material_id, 'tipo': tipo, 'estado': estado,
+             'movimientos': movimientos, 'cantidad': cantidad}
+            for (anio, mes, material_id, tipo, estado), (movimientos, cantidad) in resumenes.items()
+        ])
+    return len(resumenes)
+
+def verificar_resumenes(tolerancia=1e-6):
+    """Diferencias entre la tabla y el historial: [(clave, esperado, actual)]"""
+    esperados = calcular_resumenes_desde_historial()
+    actuales = {
+        (r.anio, r.mes, r.material_id, r.tipo, r.estado): (r.movimientos, r.cantidad)
+        for r in ResumenMensual.query
+    }
+    diferencias = []
+    for clave in esperados.keys() | actuales.keys():
+        esperado = esperados.get(clave, (0, 0))
+        actual = actuales.get(clave, (0, 0))
+        if esperado[0] != actual[0] or abs(esperado[1] - actual[1]) > tolerancia:
+            diferencias.append((clave, esperado, actual))
+    return diferencias
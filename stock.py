@@ -0,0 +1,125 @@
+# stock.py
+
+from models import db, Material, Movimiento, ORIGEN_AUTORIZACION, ORIGEN_RETORNO, ORIGEN_AJUSTE
+from libro_stock import registrar_asiento
+from sqlalchemy import select, update
+from sqlalchemy.orm.util import identity_key
+from datetime import datetime
+import json
+import sys
+
+# -----------------------------
+# CAMBIOS DE STOCK ATÓMICOS
+# -----------------------------
+# El stock nunca se lee, se modifica en Python y se vuelve a escribir: con
+# varios workers (o greenlets) dos peticiones leerían el mismo valor y una de
+# las restas se perdería. Cada cambio es un UPDATE condicional que la base de
+# datos aplica sobre el valor vigente:
+#   UPDATE material SET stock = stock - :q WHERE id = :id AND stock >= :q
+# Se hacen con update(Material) para que la caché y el catálogo se invaliden, y
+# cada uno deja su asiento en el libro de stock.
+INTENTOS_FIJAR_STOCK = 5
+
+def _expirar(material_id, columna):
+    # El objeto cargado en la sesión (si lo hay) relee el valor nuevo al usarlo
+    material = db.session.identity_map.get(identity_key(Material, material_id))
+    if material is not None:
+        db.session.expire(material, [columna])
+
+def _sumar(material_id, columna, cantidad, *condiciones):
+    resultado = db.session.execute(
+        update(Material)
+        .where(Material.id == material_id, *condiciones)
+        .values({columna: db.func.coalesce(getattr(Material, columna), 0) + cantidad})
+        .execution_options(synchronize_session=False)
+    )
+    _expirar(material_id, columna)
+    return resultado.rowcount == 1
+
+def descontar_stock(material_id, cantidad, movimiento_id=None, usuario_id=None):
+    """Resta del stock solo si alcanza y el material está activo. Devuelve False si no"""
+    if not _sumar(material_id, 'stock', -cantidad, Material.activo == True, Material.stock >= cantidad):
+        return False
+    registrar_asiento(material_id, -cantidad, ORIGEN_AUTORIZACION, movimiento_id, usuario_id)
+    return True
+
+def reponer_stock(material_id, cantidad, movimiento_id=None, usuario_id=None):
+    if not _sumar(material_id, 'stock', cantidad):
+        return False
+    registrar_asiento(material_id, cantidad, ORIGEN_RETORNO, movimiento_id, usuario_id)
+    return True
+
+def fijar_stock(material_id, stock, origen=ORIGEN_AJUSTE, usuario_id=None):
+    """
+    Reemplaza el stock (ajuste manual) y registra la diferencia. El UPDATE
+    exige que el stock siga siendo el leído; si otra petición lo cambió entre
+    medias se vuelve a leer.
+    """
+    for _ in range(INTENTOS_FIJAR_STOCK):
+        actual = db.session.execute(select(Material.stock).where(Material.id == material_id)).scalar_one_or_none()
+        resultado = db.session.execute(
+            update(Material)
+            .where(Material.id == material_id, db.func.coalesce(Material.stock, 0) == (actual or 0))
+            .values(stock=stock)
+            .execution_options(synchronize_session=False)
+        )
+        if resultado.rowcount == 1:
+            _expirar(material_id, 'stock')
+            if stock != (actual or 0):
+                registrar_asiento(material_id, stock - (actual or 0), origen, usuario_id=usuario_id)
+            return True
+    return False
+
+def sumar_en_devolucion(material_id, cantidad):
+    return _sumar(material_id, 'en_devolucion', cantidad)
+
+def reclamar_movimientos(ids, *condiciones):
+    """
+    Toma los movimientos que todavía cumplen las condiciones (p. ej. siguen
+    PENDIENTE) con un UPDATE condicional. La fila queda bloqueada hasta el
+    commit, así que de dos peticiones sobre el mismo movimiento solo una lo
+    reclama; la otra ve 0 filas. Devuelve cuántos se reclamaron.
+    """
+    resultado = db.session.execute(
+        update(Movimiento)
+        .where(Movimiento.id.in_(ids), *condiciones)
+        .values(actualizado=datetime.utcnow())
+        # Sin sincronizar: los objetos en sesión conservan el estado anterior
+        # para que el flush calcule bien los saldos de inventario
+        .execution_options(synchronize_session=False)
+    )
+    return resultado.rowcount
+
+# -----------------------------
+# PRUEBA DE CONCURRENCIA
+# -----------------------------
+# `flask estres-stock` lanza varios procesos que autorizan las mismas
+# solicitudes en distinto orden a través de la ruta real. Cada proceso
+# imprime un resumen JSON con los códigos de respuesta obtenidos.
+def autorizar_en_proceso(almacenista_id, username, ids):
+    from app import app
+
+    cliente = app.test_client()
+    with cliente.session_transaction() as sesion:
+        sesion['user'] = username
+        sesion['user_id'] = almacenista_id
+        sesion['user_role'] = 'ALMACENISTA'
+
+    respuestas = {}
+    for movimiento_id in ids:
+        try:
+            codigo = cliente.post(
+                f'/almacenista/retiros/autorizar/{movimiento_id}',
+                data={'observacion_almacenista': 'Prueba de concurrencia'}
+            ).status_code
+        except Exception as e:
+            codigo = type(e).__name__
+        respuestas[str(codigo)] = respuestas.get(str(codigo), 0) + 1
+    return respuestas
+
+# -----------------------------
+# PROCESO HIJO
+# -----------------------------
+if __name__ == '__main__':
+    ids = [int(i) for i in sys.argv[3:]]
+    print(json.dumps(autorizar_en_proceso(int(sys.argv[1]), sys.argv[2], ids)))
@@ -0,0 +1,273 @@
+# tareas.py
+
+from flask import current_app
+from models import db, User, Movimiento, TareaProgramada, EjecucionTarea
+from resumenes import verificar_resumenes, reconstruir_resumenes
+from pronostico import calcular_pronosticos
+from libro_stock import tomar_corte_stock
+from notificaciones import archivar_notificaciones as archivar_leidas, purgar_archivo
+from reportes_pdf import clave_reporte, estado_reporte, generar_reporte, ESTADO_LISTO
+from archivos import VARIANTES
+from sqlalchemy import update, or_, func, case
+from sqlalchemy.exc import IntegrityError
+from collections import namedtuple
+from datetime import datetime, timedelta
+import socket
+import time
+import sys
+import os
+
+# -----------------------------
+# PROGRAMADOR DE TAREAS
+# -----------------------------
+# Tareas de mantenimiento periódicas. Corren en un proceso aparte
+# (`python -m tareas`, ver Procfile) para no ocupar los workers web. La tabla
+# tarea_programada guarda cuándo toca cada una y quién la tiene tomada: se
+# reclama con un UPDATE condicional, así que aunque haya varios programadores
+# (o alguien lance `flask ejecutar-tarea`) cada tarea corre en uno solo. Si el
+# proceso muere, el bloqueo vence a los `bloqueo` segundos. Cada ejecución
+# queda en ejecucion_tarea con su duración.
+Tarea = namedtuple('Tarea', ['funcion', 'intervalo', 'bloqueo'])
+
+REVISION_SEGUNDOS = 30
+IDENTIDAD = f'{socket.gethostname()}:{os.getpid()}'
+ESTADO_OK = 'OK'
+ESTADO_ERROR = 'ERROR'
+
+def registrar_tareas():
+    """Crea la fila de programación de las tareas que aún no la tienen y quita las que ya no existen"""
+    existentes = {nombre for (nombre,) in db.session.query(TareaProgramada.nombre)}
+    if existentes - TAREAS.keys():
+        TareaProgramada.query.filter(TareaProgramada.nombre.notin_(list(TAREAS))).delete(synchronize_session=False)
+        db.session.commit()
+    for nombre in TAREAS.keys() - existentes:
+        try:
+            db.session.add(TareaProgramada(nombre=nombre, proxima=datetime.utcnow()))
+            db.session.commit()
+        except IntegrityError:
+            # Otro programador la creó a la vez
+            db.session.rollback()
+
+def reclamar_tarea(nombre, forzar=False):
+    """Toma la tarea si le toca (o si forzar) y nadie la tiene. Devuelve True si la tomó"""
+    tarea = TAREAS[nombre]
+    ahora = datetime.utcnow()
+    condiciones = [
+        TareaProgramada.nombre == nombre,
+        or_(TareaProgramada.bloqueada_hasta.is_(None), TareaProgramada.bloqueada_hasta < ahora)
+    ]
+    if not forzar:
+        condiciones.append(TareaProgramada.proxima <= ahora)
+    resultado = db.session.execute(
+        update(TareaProgramada)
+        .where(*condiciones)
+        .values(
+            proxima=ahora + tarea.intervalo,
+            bloqueada_hasta=ahora + tarea.bloqueo,
+            bloqueada_por=IDENTIDAD
+        )
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return resultado.rowcount == 1
+
+def ejecutar_tarea(nombre):
+    """Corre una tarea ya reclamada, registra la ejecución y libera el bloqueo"""
+    inicio = datetime.utcnow()
+    cronometro = time.perf_counter()
+    try:
+        detalle = TAREAS[nombre].funcion()
+        db.session.commit()
+        estado = ESTADO_OK
+    except Exception as e:
+        db.session.rollback()
+        detalle = f'{type(e).__name__}: {e}'
+        estado = ESTADO_ERROR
+
+    ejecucion = EjecucionTarea(
+        tarea=nombre,
+        inicio=inicio,
+        duracion=time.perf_counter() - cronometro,
+        estado=estado,
+        detalle=(detalle or '')[:500]
+    )
+    db.session.add(ejecucion)
+    db.session.execute(
+        update(TareaProgramada)
+        .where(TareaProgramada.nombre == nombre, TareaProgramada.bloqueada_por == IDENTIDAD)
+        .values(bloqueada_hasta=None, bloqueada_por=None)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return ejecucion
+
+def ejecutar_pendientes():
+    ejecuciones = []
+    for nombre in TAREAS:
+        if reclamar_tarea(nombre):
+            ejecuciones.append(ejecutar_tarea(nombre))
+    return ejecuciones
+
+def programador():
+    registrar_tareas()
+    while True:
+        for ejecucion in ejecutar_pendientes():
+            print(f'{ejecucion.inicio:%Y-%m-%d %H:%M:%S} {ejecucion.tarea}: {ejecucion.estado} '
+                  f'en {ejecucion.duracion:.2f} s {ejecucion.detalle or ""}', flush=True)
+        # La sesión no debe quedar abierta entre revisiones
+        db.session.remove()
+        time.sleep(REVISION_SEGUNDOS)
+
+# -----------------------------
+# RETENCIÓN DE EVIDENCIAS
+# -----------------------------
+# Una evidencia se borra cuando todos los movimientos que la usan (el mismo
+# archivo puede estar en varios, ver archivos.py) tienen más de
+# RETENCION_EVIDENCIAS_DIAS y ninguno sigue PENDIENTE; esos movimientos quedan
+# "Sin evidencia". Los archivos que ningún movimiento referencia (subidas
+# abandonadas, historial borrado) se borran pasado un día de margen.
+MARGEN_HUERFANOS = timedelta(days=1)
+TAMANO_LOTE_EVIDENCIAS = 500
+
+def _nombre_original(relativo):
+    """Nombre de la evidencia original de un archivo (el mismo si no es una variante)"""
+    for variante in VARIANTES:
+        sufijo = f'.{variante}.jpg'
+        if relativo.endswith(sufijo):
+            return relativo[:-len(sufijo)]
+    return os.path.splitext(relativo)[0]
+
+def _borrar_archivo(ruta):
+    try:
+        os.remove(ruta)
+        return True
+    except OSError:
+        return False
+
+def retener_evidencias():
+    carpeta = current_app.config['EVIDENCIAS_FOLDER']
+    ahora = datetime.utcnow()
+    limite = ahora - timedelta(days=current_app.config['RETENCION_EVIDENCIAS_DIAS'])
+
+    referencias = db.session.query(
+        Movimiento.evidencia,
+        func.max(Movimiento.fecha),
+        func.sum(case((Movimiento.estado == 'PENDIENTE', 1), else_=0))
+    ).filter(Movimiento.evidencia.isnot(None)).group_by(Movimiento.evidencia).all()
+    vencidas = [nombre for nombre, ultima, pendientes in referencias if ultima and ultima < limite and not pendientes]
+    vigentes = {os.path.splitext(nombre)[0] for nombre, _, _ in referencias} - {os.path.splitext(n)[0] for n in vencidas}
+
+    # Primero se quitan de la BD: si el commit falla no se pierde ningún archivo.
+    # El UPDATE repite las condiciones: un movimiento confirmado después de la
+    # consulta puede reutilizar el mismo archivo (ver guardar_subida)
+    for i in range(0, len(vencidas), TAMANO_LOTE_EVIDENCIAS):
+        Movimiento.query.filter(
+            Movimiento.evidencia.in_(vencidas[i:i + TAMANO_LOTE_EVIDENCIAS]),
+            Movimiento.fecha < limite,
+            Movimiento.estado != 'PENDIENTE'
+        ).update({'evidencia': None, 'actualizado': ahora}, synchronize_session=False)
+    db.session.commit()
+
+    # Y esos archivos reutilizados no se borran del disco
+    for i in range(0, len(vencidas), TAMANO_LOTE_EVIDENCIAS):
+        vigentes.update(os.path.splitext(nombre)[0] for (nombre,) in db.session.query(Movimiento.evidencia).filter(
+            Movimiento.evidencia.in_(vencidas[i:i + TAMANO_LOTE_EVIDENCIAS])
+        ).distinct())
+
+    borrados = 0
+    margen = time.time() - MARGEN_HUERFANOS.total_seconds()
+    for raiz, _, archivos in os.walk(carpeta):
+        for archivo in archivos:
+            ruta = os.path.join(raiz, archivo)
+            relativo = os.path.relpath(ruta, carpeta).replace(os.sep, '/')
+            if archivo.startswith('.') and not archivo.startswith('.subida-'):
+                continue
+            if _nombre_original(relativo) in vigentes:
+                continue
+            if os.path.getmtime(ruta) < margen and _borrar_archivo(ruta):
+                borrados += 1
+    return f'{len(vencidas)} evidencias vencidas, {borrados} archivos borrados'
+
+# -----------------------------
+# NOTIFICACIONES
+# -----------------------------
+def archivar_notificaciones():
+    archivadas = archivar_leidas(current_app.config['ARCHIVO_NOTIFICACIONES_DIAS'])
+    purgadas = purgar_archivo(current_app.config['RETENCION_NOTIFICACIONES_DIAS'])
+    return f'{archivadas} notificaciones archivadas, {purgadas} borradas del archivo'
+
+# -----------------------------
+# RESÚMENES Y CORTES
+# -----------------------------
+def refrescar_resumenes():
+    diferencias = verificar_resumenes()
+    if not diferencias:
+        return 'sin diferencias'
+    total = reconstruir_resumenes()
+    return f'{len(diferencias)} diferencias, {total} resúmenes reconstruidos'
+
+def refrescar_pronosticos():
+    return f'{calcular_pronosticos()} materiales'
+
+def corte_stock():
+    hasta = tomar_corte_stock()
+    return f'corte hasta el asiento {hasta}' if hasta else 'sin asientos nuevos'
+
+# -----------------------------
+# CALENTAR CACHÉ DE REPORTES
+# -----------------------------
+# Deja generados los PDF de los ingenieros con movimientos recientes, para que
+# al pedirlos se sirvan de la caché en disco sin esperar el render.
+def calentar_reportes():
+    from ingeniero_routes import renderizar_reporte_html
+
+    carpeta = current_app.config['REPORTES_FOLDER']
+    desde = datetime.utcnow() - TAREAS['calentar_reportes'].intervalo
+    activos = db.session.query(Movimiento.solicitado_por_id).filter(Movimiento.actualizado >= desde).distinct()
+    generados = fallidos = 0
+    for usuario in User.query.filter(User.id.in_(activos.scalar_subquery())):
+        clave = clave_reporte(usuario)
+        if estado_reporte(carpeta, clave) == ESTADO_LISTO:
+            continue
+        with current_app.test_request_context():
+            html, miniaturas = renderizar_reporte_html(usuario)
+        try:
+            generar_reporte(
+                carpeta, clave, html,
+                raices=[current_app.static_folder, current_app.config['EVIDENCIAS_FOLDER']],
+                miniaturas=miniaturas
+            )
+            generados += 1
+        except Exception:
+            # Queda el .error del reporte; al pedirlo desde la web se reintenta
+            fallidos += 1
+    return f'{generados} reportes generados, {fallidos} con error'
+
+TAREAS = {
+    'retener_evidencias': Tarea(retener_evidencias, timedelta(days=1), timedelta(hours=1)),
+    'archivar_notificaciones': Tarea(archivar_notificaciones, timedelta(days=1), timedelta(minutes=30)),
+    'refrescar_resumenes': Tarea(refrescar_resumenes, timedelta(days=1), timedelta(hours=1)),
+    'refrescar_pronosticos': Tarea(refrescar_pronosticos, timedelta(hours=1), timedelta(minutes=30)),
+    'corte_stock': Tarea(corte_stock, timedelta(days=1), timedelta(minutes=30)),
+    'calentar_reportes': Tarea(calentar_reportes, timedelta(hours=6), timedelta(hours=1)),
+}
+
+# -----------------------------
+# PROCESO DEL PROGRAMADOR
+# -----------------------------
+# python -m tareas             -> revisa las tareas cada REVISION_SEGUNDOS
+# python -m tareas NOMBRE ...  -> ejecuta esas tareas una vez
+if __name__ == '__main__':
+    from app import app
+
+    with app.app_context():
+        if len(sys.argv) > 1:
+            registrar_tareas()
+            for nombre in sys.argv[1:]:
+                if reclamar_tarea(nombre, forzar=True):
+                    ejecucion = ejecutar_tarea(nombre)
+                    print(f'{nombre}: {ejecucion.estado} en {ejecucion.duracion:.2f} s {ejecucion.detalle or ""}')
+                else:
+                    print(f'{nombre}: en curso en otro proceso')
+        else:
+            programador()
@@ -1,10 +1,20 @@
-from models import Movimiento, db, Notificacion, Material, User
-from sqlalchemy import func
+from models import Movimiento, db, Notificacion, Material, User, VersionCache, REVISION_EN_FERRETERIA
+from inventario import sumar_en_fila
+from sqlalchemy import func, event, or_, and_
+from sqlalchemy.orm import Session, joinedload, selectinload, contains_eager, configure_mappers
 from datetime import datetime
+from contextlib import contextmanager
 import pytz
 from flask_socketio import SocketIO
+from socketio import PubSubManager
 from datetime import datetime
-from flask import session
+from flask import session, g, request, has_request_context
+from collections import namedtuple
+import threading
+import time
+import base64
+import binascii
+import queue
 
 #para fecha
 def fecha_y_hora_colombia(fecha_utc):
@@ -23,6 +33,11 @@ def fecha_y_hora_colombia(fecha_utc):
         "hora": fecha_local.strftime("%I:%M %p")
     }
 
+def inicio_del_dia_utc(dia):
+    """Medianoche del día (calendario de Colombia) en UTC sin zona, como se guardan las fechas"""
+    inicio = pytz.timezone('America/Bogota').localize(datetime.combine(dia, datetime.min.time()))
+    return inicio.astimezone(pytz.utc).replace(tzinfo=None)
+
 #para que los numeros no se vean como decimales si son enteros
 def formatear_numero(value):
     try:
@@ -33,35 +48,342 @@ def formatear_numero(value):
     except (ValueError, TypeError):
         return value
 
+# -----------------------------
+# CARGA DE RELACIONES EN LISTADOS
+# -----------------------------
+# Relaciones que leen los templates de listados (mov.material.nombre,
+# mov.solicitado_por.nombre, mov.usuario.nombre). Se cargan por adelantado
+# para que el número de consultas no dependa del número de filas:
+# material va en el mismo JOIN y cada usuario en un SELECT ... IN.
+configure_mappers()  # Movimiento.material es un backref: debe existir antes de usarlo aquí
+CARGA_MOVIMIENTOS = (
+    joinedload(Movimiento.material),
+    selectinload(Movimiento.solicitado_por),
+    selectinload(Movimiento.usuario),
+)
+# Para consultas que ya hacen .join(Material): material sale de ese mismo JOIN
+# en lugar de unir la tabla una segunda vez
+CARGA_MOVIMIENTOS_CON_MATERIAL = (
+    contains_eager(Movimiento.material),
+    selectinload(Movimiento.solicitado_por),
+    selectinload(Movimiento.usuario),
+)
+
+@contextmanager
+def contar_consultas():
+    """
+    Cuenta las sentencias SQL emitidas dentro del bloque:
+
+        with contar_consultas() as sentencias:
+            client.get('/almacenista/retiros')
+        assert len(sentencias) == N
+    """
+    sentencias = []
+
+    def registrar(conexion, cursor, sentencia, parametros, contexto, executemany):
+        sentencias.append(sentencia)
+
+    motor = db.engine
+    event.listen(motor, 'before_cursor_execute', registrar)
+    try:
+        yield sentencias
+    finally:
+        event.remove(motor, 'before_cursor_execute', registrar)
+
+# -----------------------------
+# PAGINACIÓN POR CURSOR (fecha, id)
+# -----------------------------
+TAMANO_PAGINA = 50
+TAMANO_PAGINA_MAXIMO = 200
+
+# items: movimientos de la página; siguiente: cursor de la próxima página (o None);
+# param_cursor: nombre del parámetro de la URL que lleva el cursor de esta lista
+Pagina = namedtuple('Pagina', ['items', 'siguiente', 'param_cursor'])
+
+def codificar_cursor(movimiento):
+    valor = f"{movimiento.fecha.isoformat()}|{movimiento.id}"
+    return base64.urlsafe_b64encode(valor.encode()).decode()
+
+def decodificar_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        fecha, mov_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(fecha), int(mov_id)
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        return None
+
+def obtener_tamano_pagina():
+    try:
+        limite = int(request.args.get('limite', TAMANO_PAGINA))
+    except ValueError:
+        limite = TAMANO_PAGINA
+    return min(max(limite, 1), TAMANO_PAGINA_MAXIMO)
+
+def paginar_movimientos(consulta, param_cursor='cursor'):
+    """
+    Paginación keyset de movimientos ordenados por (fecha, id) descendente.
+    Lee ?limite= y ?<param_cursor>= de la URL; cada página cuesta lo mismo
+    sin importar cuántos movimientos haya en el historial.
+    """
+    limite = obtener_tamano_pagina()
+    cursor = decodificar_cursor(request.args.get(param_cursor))
+    if cursor:
+        fecha, mov_id = cursor
+        consulta = consulta.filter(or_(
+            Movimiento.fecha < fecha,
+            and_(Movimiento.fecha == fecha, Movimiento.id < mov_id)
+        ))
+
+    items = (
+        consulta.order_by(None)
+        .order_by(Movimiento.fecha.desc(), Movimiento.id.desc())
+        .limit(limite + 1)
+        .all()
+    )
+    siguiente = codificar_cursor(items[limite - 1]) if len(items) > limite else None
+    return Pagina(items[:limite], siguiente, param_cursor)
+
+# -----------------------------
+# SOCKETIO CON VARIOS WORKERS
+# -----------------------------
+class ColaEnMemoriaManager(PubSubManager):
+    """
+    Cola de mensajes dentro del mismo proceso con la misma interfaz que la de
+    Redis. Sirve para pruebas y desarrollo sin levantar un servidor Redis.
+    """
+    name = 'memoria'
+    _suscriptores = []
+
+    def _publish(self, data):
+        for cola in list(self._suscriptores):
+            cola.put(data)
+
+    def _listen(self):
+        cola = queue.Queue()
+        self._suscriptores.append(cola)
+        while True:
+            yield cola.get()
+
+def opciones_cola_socketio(url):
+    """
+    Opciones para SocketIO según SOCKETIO_MESSAGE_QUEUE:
+    redis://... (o cualquier URL soportada por Flask-SocketIO) para compartir
+    eventos entre workers, memory:// para la cola en memoria, vacío = sin cola.
+    """
+    if not url:
+        return {}
+    if url.startswith('memory://'):
+        return {'client_manager': ColaEnMemoriaManager()}
+    return {'message_queue': url}
+
 socketio = None
 
 def configurar_socketio(instance):
     global socketio
     socketio = instance
 
+# Salas de Socket.IO: cada socket se une a la de su usuario y a la de su rol al conectarse
+def sala_usuario(usuario_id):
+    return f'usuario_{usuario_id}'
+
+def sala_rol(rol):
+    return f'rol_{rol.lower()}'
+
+def _emitir_nueva_notificacion(tipo_usuario, mensaje, usuario_id):
+    payload = {
+        'mensaje': mensaje,
+        'fecha': datetime.now().strftime('%d/%m/%Y %I:%M %p'),
+        'tipo_usuario': tipo_usuario,
+        'usuario_id': usuario_id
+    }
+    destino = sala_usuario(usuario_id) if usuario_id else sala_rol(tipo_usuario)
+    socketio.emit('nueva_notificacion', payload, to=destino)
+
 def emitir_notificacion(tipo_usuario, mensaje, usuario_id=None):
-    """Emitir notificación a todos o a un usuario específico (opcional)"""
+    """Emitir notificación a un usuario específico o, si no se indica, a todo su rol"""
     if socketio:
-        payload = {
-            'mensaje': mensaje,
-            'fecha': datetime.now().strftime('%d/%m/%Y %I:%M %p'),
-            'tipo_usuario': tipo_usuario,
-            'usuario_id': usuario_id
-        }
-        socketio.emit('nueva_notificacion', payload)
-        socketio.emit('actualizar-tablas')
+        _emitir_nueva_notificacion(tipo_usuario, mensaje, usuario_id)
+        emitir_actualizacion_paneles(tipo_usuario, usuario_id)
+
+def emitir_notificaciones(tipo_usuario, mensajes):
+    """
+    Varias notificaciones de una misma operación ({usuario_id: mensaje}): una
+    por usuario y una sola actualización del panel del almacenista.
+    """
+    if socketio and mensajes:
+        for usuario_id, mensaje in mensajes.items():
+            _emitir_nueva_notificacion(tipo_usuario, mensaje, usuario_id)
+        emitir_actualizacion_paneles(tipo_usuario, *mensajes)
+
+def emitir_actualizacion_paneles(tipo_usuario=None, *usuario_ids):
+    """
+    Envía los datos nuevos de los paneles dentro del evento 'actualizar-tablas':
+    se calculan una sola vez por cambio y el navegador los aplica sin pedir
+    el fragmento HTML al servidor.
+    """
+    if not socketio:
+        return
+    # Todo cambio de movimientos altera los contadores del panel del almacenista
+    socketio.emit('actualizar-tablas', {'alertas': obtener_alertas_almacenista_cacheado()}, to=sala_rol('almacenista'))
+
+    if tipo_usuario == 'ingeniero':
+        for usuario_id in filter(None, usuario_ids):
+            socketio.emit('actualizar-tablas', {'movimientos': panel_movimientos_ingeniero(usuario_id)}, to=sala_usuario(usuario_id))
+
+# -----------------------------
+# CACHÉ DE CONTEXTO
+# -----------------------------
+# Datos globales (stock bajo, contadores de alertas) compartidos por todas las
+# páginas del proceso durante unos segundos. Se invalida al confirmar cambios
+# sobre Material o Movimiento: el proceso que confirma vacía su caché y suma 1
+# a version_cache; los demás workers guardan cada valor con la versión que
+# leyeron y lo recalculan cuando la versión cambia (una lectura por clave
+# primaria por request).
+CACHE_TTL_SEGUNDOS = 30
+MODELOS_QUE_INVALIDAN_CACHE = (Material, Movimiento)
+VERSION_INVENTARIO = 'inventario'
+
+_cache_global = {}
+_cache_lock = threading.Lock()
+
+def _leer_version_inventario():
+    return db.session.query(VersionCache.version).filter_by(nombre=VERSION_INVENTARIO).scalar() or 0
+
+def version_inventario():
+    if has_request_context():
+        return memo_por_request('version_inventario', _leer_version_inventario)
+    return _leer_version_inventario()
+
+def _incrementar_version_inventario():
+    # En su propia transacción, ya confirmado el cambio: si falla, los demás
+    # workers ven el dato nuevo al vencer el TTL
+    try:
+        with db.engine.begin() as conexion:
+            sumar_en_fila(conexion, VersionCache.__table__, {'nombre': VERSION_INVENTARIO}, {'version': 1})
+    except Exception as e:
+        print(f"Error al incrementar la versión de la caché: {e}")
+
+def obtener_cacheado(clave, calcular, ttl=CACHE_TTL_SEGUNDOS):
+    """Devuelve el valor de la caché global o lo calcula si expiró o cambió la versión"""
+    ahora = time.monotonic()
+    # La versión se lee antes de calcular: el valor nunca es más viejo que ella
+    version = version_inventario()
+    entrada = _cache_global.get(clave)
+    if entrada and entrada[0] > ahora and entrada[1] == version:
+        return entrada[2]
+
+    valor = calcular()
+    with _cache_lock:
+        _cache_global[clave] = (ahora + ttl, version, valor)
+    return valor
+
+def invalidar_cache_global():
+    with _cache_lock:
+        _cache_global.clear()
+
+def memo_por_request(clave, calcular):
+    """Calcula el valor una sola vez por request (se guarda en flask.g)"""
+    memo = g.setdefault('_memo_request', {})
+    if clave not in memo:
+        memo[clave] = calcular()
+    return memo[clave]
+
+def _marcar_si_cambia_inventario(sesion, objetos):
+    if any(isinstance(obj, MODELOS_QUE_INVALIDAN_CACHE) for obj in objetos):
+        sesion.info['invalidar_cache'] = True
+
+@event.listens_for(Session, 'after_flush')
+def _detectar_cambios_inventario(sesion, flush_context):
+    _marcar_si_cambia_inventario(sesion, list(sesion.new) + list(sesion.dirty) + list(sesion.deleted))
+
+@event.listens_for(Session, 'do_orm_execute')
+def _detectar_cambios_masivos(orm_execute_state):
+    # query.delete() / query.update() no pasan por el flush
+    if orm_execute_state.is_update or orm_execute_state.is_delete:
+        mapper = orm_execute_state.bind_mapper
+        if mapper is not None and issubclass(mapper.class_, MODELOS_QUE_INVALIDAN_CACHE):
+            orm_execute_state.session.info['invalidar_cache'] = True
+
+@event.listens_for(Session, 'after_commit')
+def _invalidar_tras_commit(sesion):
+    if sesion.info.pop('invalidar_cache', False):
+        invalidar_cache_global()
+        _incrementar_version_inventario()
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _descartar_invalidacion(sesion, transaccion_previa):
+    sesion.info.pop('invalidar_cache', None)
 
 # detectar materiales con stock bajo para el TOAST
+MaterialBajoStock = namedtuple('MaterialBajoStock', ['id', 'nombre', 'stock', 'stock_minimo', 'unidad'])
+
 def obtener_materiales_bajo_stock():
     return Material.query.filter(
         Material.stock <= Material.stock_minimo,
         Material.activo == True
     ).all()
 
+def obtener_materiales_bajo_stock_cacheado():
+    """Versión en caché (registros de solo lectura, no objetos ORM)"""
+    def calcular():
+        return [
+            MaterialBajoStock(m.id, m.nombre, m.stock, m.stock_minimo, m.unidad)
+            for m in obtener_materiales_bajo_stock()
+        ]
+    return obtener_cacheado('materiales_bajo_stock', calcular)
+
 #logica de conteo para las alertas del panel del almacenista
 # utils.py
 
 def obtener_alertas_almacenista():
+    # Todos los contadores de movimiento en una sola pasada (COUNT ... FILTER)
+    # sobre las filas abiertas: el WHERE con los pares (tipo, estado) que se
+    # cuentan usa ix_movimiento_tipo_estado_fecha, así que no se recorren los
+    # movimientos ya procesados. La última fecha y el stock bajo van como
+    # subconsultas aparte (MAX(fecha) se resuelve con ix_movimiento_fecha).
+    solicitud_pendiente = and_(Movimiento.tipo == 'SOLICITUD', Movimiento.estado == 'PENDIENTE')
+    devolucion_pendiente = and_(Movimiento.tipo == 'DEVOLUCION', Movimiento.estado == 'PENDIENTE')
+    devolucion_autorizada = and_(Movimiento.tipo == 'DEVOLUCION', Movimiento.estado == 'AUTORIZADO')
+    en_revision = and_(devolucion_autorizada, Movimiento.estado_revision == REVISION_EN_FERRETERIA)
+    sin_revision = and_(devolucion_autorizada, Movimiento.estado_revision.is_(None))
+
+    ultima = db.session.query(func.max(Movimiento.fecha)).scalar_subquery()
+    stock_bajo = db.session.query(func.count(Material.id)).filter(
+        Material.stock < Material.stock_minimo
+    ).scalar_subquery()
+
+    contadores = db.session.query(
+        func.count().filter(solicitud_pendiente),
+        func.count().filter(devolucion_pendiente),
+        func.count().filter(en_revision),
+        func.count().filter(sin_revision)
+    ).filter(or_(solicitud_pendiente, devolucion_pendiente, en_revision, sin_revision)).subquery()
+
+    fila = db.session.query(*contadores.c, ultima, stock_bajo).select_from(contadores).one()
+
+    (pendientes_retiro, devoluciones_pendientes, devoluciones_en_revision,
+     devoluciones_autorizadas_sin_revision, ultima, stock_bajo_panel) = fila
+
+    mostrar_alertas = any([
+        pendientes_retiro,
+        devoluciones_pendientes,
+        devoluciones_en_revision,
+        devoluciones_autorizadas_sin_revision
+    ])
+
+    return {
+        'pendientes_retiro': pendientes_retiro,
+        'devoluciones_pendientes': devoluciones_pendientes,
+        'devoluciones_autorizadas_sin_revision': devoluciones_autorizadas_sin_revision,
+        'devoluciones_en_revision': devoluciones_en_revision,
+        'stock_bajo_panel': stock_bajo_panel or 0,
+        'ultima_fecha': fecha_y_hora_colombia(ultima),
+        'mostrar_alertas': mostrar_alertas
+    }
+
+# Versión anterior (una consulta por contador); se conserva para el benchmark
+def obtener_alertas_almacenista_por_separado():
     # --- Solicitudes de retiro pendientes (estado = "PENDIENTE") ---
     pendientes_retiro = Movimiento.query.filter_by(tipo='SOLICITUD', estado='PENDIENTE').count()
 
@@ -79,21 +401,14 @@ def obtener_alertas_almacenista():
     devoluciones_en_revision = Movimiento.query.filter(
         Movimiento.tipo == 'DEVOLUCION',
         Movimiento.estado == 'AUTORIZADO',
-        Movimiento.observacion_almacenista.ilike('%estado: En revisión en ferretería%')
+        Movimiento.estado_revision == REVISION_EN_FERRETERIA
     ).count()
 
     # Devoluciones autorizadas sin revisar aún
-    excluir_estados = [
-        'estado: En revisión en ferretería',
-        'estado: Aprobado por ferretería',
-        'estado: Rechazado por ferretería',
-        'estado: Movido a materiales sin uso',
-        'estado: Retornado a stock'
-    ]
     devoluciones_autorizadas_sin_revision = Movimiento.query.filter(
         Movimiento.tipo == 'DEVOLUCION',
         Movimiento.estado == 'AUTORIZADO',
-        *[~Movimiento.observacion_almacenista.ilike(f'%{estado}%') for estado in excluir_estados]
+        Movimiento.estado_revision.is_(None)
     ).count()
 
     mostrar_alertas = any([
@@ -113,10 +428,29 @@ def obtener_alertas_almacenista():
         'mostrar_alertas':mostrar_alertas
     }
 
-def obtener_alertas_ingeniero():
+def obtener_alertas_almacenista_cacheado():
+    return dict(obtener_cacheado('alertas_almacenista', obtener_alertas_almacenista))
 
-    usuario = User.query.filter_by(username=session.get('user')).first()
-    ultimos_movimientos = Movimiento.query.filter_by(solicitado_por_id=usuario.id).order_by(Movimiento.fecha.desc()).limit(5).all()
+def obtener_alertas_ingeniero(usuario_id=None):
+    if usuario_id is None:
+        usuario = User.query.filter_by(username=session.get('user')).first()
+        usuario_id = usuario.id
+    ultimos_movimientos = Movimiento.query.options(*CARGA_MOVIMIENTOS).filter_by(solicitado_por_id=usuario_id).order_by(Movimiento.fecha.desc()).limit(5).all()
     return {
         'ultimos_movimientos': ultimos_movimientos
-    }    
\ No newline at end of file
+    }
+
+# Versión JSON del panel de últimos movimientos (se envía por socket)
+def panel_movimientos_ingeniero(usuario_id):
+    movimientos = []
+    for mov in obtener_alertas_ingeniero(usuario_id)['ultimos_movimientos']:
+        fecha = fecha_y_hora_colombia(mov.fecha)
+        movimientos.append({
+            'tipo': mov.tipo,
+            'material': mov.material.nombre,
+            'cantidad': mov.cantidad,
+            'fecha': fecha['fecha'],
+            'hora': fecha['hora'],
+            'estado': mov.estado
+        })
+    return movimientos